@@ -0,0 +1,456 @@
+#!/usr/bin/env python
+'''adbClient -- Talk to the adb server's 'smart socket' protocol directly, rather than
+  starting the adb program for each command.
+
+  The adb server (started by 'adb devices' or 'adb start-server') listens on
+  localhost:5037.  Each request is a 4 hex digit length followed by the service name,
+  the server answers 'OKAY' or 'FAIL'+<4 hex digit len>+<message>.  Services used here:
+    host:devices             -- list of attached devices
+    host:transport:<serial>  -- switch this connection to one device (host:transport-any)
+    shell:<cmd>              -- run a device command, stream its output until close
+    exec:<cmd>               -- like shell: but without a pty (Android 5+ adbd)
+    sync:                    -- file transfer, STAT/SEND/RECV/DATA/DONE/QUIT packets
+
+  adbStandIn is a small local server implementing the same protocol, where 'shell:' runs
+  commands on this computer and 'sync:' reads/writes files below a root directory.  It
+  lets adbClient be tried out and benchmarked without an MC74 attached:
+
+    python adbClient.py serve [port=5037] [root=/tmp/standIn]
+    python adbClient.py bench [count=200]
+'''
+import sys, os, time, socket, struct, threading
+
+adbPort = 5037
+syncChunk = 64*1024  # Maximum size of a sync DATA packet
+
+
+class adbError(Exception):
+  pass
+
+
+class adbClient:
+  '''Client for one device (serial "" means the only attached device) through the adb
+  server.  Every request uses a new socket to the server, no adb process is started.
+  '''
+  def __init__(self, serial="", host="127.0.0.1", port=adbPort):
+    self.serial = serial
+    self.host = host
+    self.port = port
+    self.seq = 0
+
+
+  def connect(self):
+    sock = socket.create_connection((self.host, self.port), 5)
+    sock.settimeout(None)  # (dd of a partition may be quiet for a long time)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Small sync packets
+    return sock
+
+
+  def request(self, sock, req):
+    '''Send one smart socket request, raise adbError if the server answers FAIL'''
+    req = req.encode("ISO-8859-1")
+    sock.sendall(b"%04x" % len(req) + req)
+    status = recvAll(sock, 4)
+    if status != b"OKAY":
+      if status == b"FAIL":
+        msg = recvAll(sock, int(recvAll(sock, 4), 16))
+        raise adbError(msg.decode("ISO-8859-1"))
+      raise adbError("unexpected adb server response: "+repr(status))
+
+
+  def transport(self):
+    '''Return a socket connected to this client's device'''
+    sock = self.connect()
+    try:
+      self.request(sock, "host:transport:"+self.serial if self.serial
+        else "host:transport-any")
+    except:
+      sock.close()
+      raise
+    return sock
+
+
+  def devices(self):
+    '''Return a list of [serial, state] for the attached devices'''
+    sock = self.connect()
+    try:
+      self.request(sock, "host:devices")
+      data = recvAll(sock, int(recvAll(sock, 4), 16)).decode("ISO-8859-1")
+    finally:
+      sock.close()
+    return [ln.split('\t') for ln in data.split('\n') if '\t' in ln]
+
+
+  def service(self, svc):
+    '''Open a device service (ie shell:cmd), return the socket streaming its data'''
+    sock = self.transport()
+    try:
+      self.request(sock, svc)
+    except:
+      sock.close()
+      raise
+    return sock
+
+
+  def shell(self, cmd):
+    '''Run a device shell command, return (output, rc) like ribou.execute.  The exit code
+    is recovered from a marker line echoed after the command (old adbd's 'shell:' has no
+    way to return it).
+    '''
+    self.seq += 1
+    tag = "rmc%d_%dE" % (os.getpid(), self.seq)
+    sock = self.service("shell:("+cmd+") 2>&1; echo "+tag+" $?")
+    try:
+      data = recvToEof(sock).decode("ISO-8859-1").replace('\r\n', '\n')
+    finally:
+      sock.close()
+    ii = data.rfind(tag+' ')
+    if ii == -1:
+      return data, -1  # Connection dropped (reboot?) before the command finished
+    try:
+      rc = int(data[ii+len(tag)+1:].split()[0])
+    except (ValueError, IndexError):
+      rc = -1
+    return data[:ii], rc
+
+
+  def execOut(self, cmd, out):
+    '''Run a device command with 'exec:' (no pty, so binary output isn't mangled),
+    writing its output to the file object 'out'.  Return the number of bytes written.
+    '''
+    sock = self.service("exec:"+cmd)
+    cnt = 0
+    try:
+      while True:
+        data = sock.recv(65536)
+        if not data:
+          break
+        out.write(data)
+        cnt += len(data)
+    finally:
+      sock.close()
+    return cnt
+
+
+  def execIn(self, cmd, inp):
+    '''Run a device command with 'exec:', sending the file object 'inp' to its stdin.
+    Returns (bytes sent, the command's output).
+    '''
+    sock = self.service("exec:"+cmd)
+    sent = 0
+    try:
+      for data in iter(lambda: inp.read(65536), b""):
+        sock.sendall(data)
+        sent += len(data)
+      sock.shutdown(socket.SHUT_WR)  # The command sees the end of its stdin
+      out = recvToEof(sock)
+    finally:
+      sock.close()
+    return sent, out.decode("ISO-8859-1")
+
+
+  def stat(self, remote):
+    '''Return (mode, size, mtime) of a device file, mode is 0 if it doesn't exist'''
+    sock = self.service("sync:")
+    try:
+      sendPacket(sock, b"STAT", remote.encode("ISO-8859-1"))
+      resp = recvAll(sock, 16)
+      if resp[:4] != b"STAT":
+        raise adbError("bad STAT response "+repr(resp[:4]))
+      sendPacket(sock, b"QUIT", b"")
+    finally:
+      sock.close()
+    return struct.unpack("<III", resp[4:])
+
+
+  def push(self, local, remote, mode=None):
+    '''Copy a local file to the device, return the number of bytes sent'''
+    st = os.stat(local)
+    if self.stat(remote)[0] & 0o170000 == 0o040000:  # Pushing into a directory?
+      remote = remote.rstrip('/')+'/'+os.path.basename(local)
+    if mode is None:
+      mode = st.st_mode
+    sock = self.service("sync:")
+    sent = 0
+    try:
+      sendPacket(sock, b"SEND", ("%s,%d" % (remote, mode)).encode("ISO-8859-1"))
+      with open(local, 'rb') as ff:
+        while True:
+          data = ff.read(syncChunk)
+          if not data:
+            break
+          sendPacket(sock, b"DATA", data)
+          sent += len(data)
+      sock.sendall(b"DONE"+struct.pack("<I", int(st.st_mtime)))
+      checkSyncStatus(sock)
+      sendPacket(sock, b"QUIT", b"")
+    finally:
+      sock.close()
+    return sent
+
+
+  def pull(self, remote, local):
+    '''Copy a device file to a local file (or into a local directory), return the
+    number of bytes received
+    '''
+    if os.path.isdir(local):
+      local = os.path.join(local, remote.rstrip('/').split('/')[-1])
+    sock = self.service("sync:")
+    got = 0
+    try:
+      sendPacket(sock, b"RECV", remote.encode("ISO-8859-1"))
+      with open(local+".part", 'wb') as ff:
+        while True:
+          cmd, ln = struct.unpack("<4sI", recvAll(sock, 8))
+          if cmd == b"DATA":
+            ff.write(recvAll(sock, ln))
+            got += ln
+          elif cmd == b"DONE":
+            break
+          elif cmd == b"FAIL":
+            raise adbError(recvAll(sock, ln).decode("ISO-8859-1"))
+          else:
+            raise adbError("bad sync response "+repr(cmd))
+      sendPacket(sock, b"QUIT", b"")
+    except:
+      removeQuietly(local+".part")
+      raise
+    finally:
+      sock.close()
+    if os.path.exists(local):
+      os.remove(local)  # (Windows won't rename onto an existing file)
+    os.rename(local+".part", local)
+    return got
+
+
+def recvAll(sock, cnt):
+  buf = bytearray()
+  while len(buf) < cnt:
+    data = sock.recv(cnt-len(buf))
+    if not data:
+      raise adbError("adb connection closed")
+    buf += data
+  return bytes(buf)
+
+
+def recvToEof(sock):
+  buf = bytearray()
+  while True:
+    data = sock.recv(65536)
+    if not data:
+      return bytes(buf)
+    buf += data
+
+
+def sendPacket(sock, cmd, data):
+  sock.sendall(cmd+struct.pack("<I", len(data))+data)
+
+
+def checkSyncStatus(sock):
+  cmd, ln = struct.unpack("<4sI", recvAll(sock, 8))
+  if cmd == b"FAIL":
+    raise adbError(recvAll(sock, ln).decode("ISO-8859-1"))
+  if cmd != b"OKAY":
+    raise adbError("bad sync status "+repr(cmd))
+
+
+def removeQuietly(fid):
+  try:
+    os.remove(fid)
+  except OSError:
+    pass
+
+
+def adbServerUp(host="127.0.0.1", port=adbPort):
+  '''Is an adb server listening?'''
+  try:
+    socket.create_connection((host, port), 1).close()
+    return True
+  except (IOError, OSError):
+    return False
+
+
+# STAND-IN SERVER ------------------------------------------------------------
+class adbStandIn:
+  '''A local server speaking the adb server protocol for one pretend device.  'shell:'
+  and 'exec:' commands run with 'sh -c' on this computer, 'sync:' paths are relative to
+  the 'root' directory.  state is what 'host:devices' reports ('device', 'recovery'...),
+  shell=False makes it answer 'shell:' like the MC74's stock recovery, which has no sh.
+  '''
+  def __init__(self, port=0, root=".", serial="standIn0", state="device", shell=True):
+    self.root = os.path.abspath(root)
+    self.serial = serial
+    self.state = state
+    self.shell = shell
+    self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self.sock.bind(("127.0.0.1", port))
+    self.sock.listen(16)
+    self.port = self.sock.getsockname()[1]
+    self.thread = None
+
+
+  def start(self):
+    '''Serve connections on a background thread, return self'''
+    self.thread = threading.Thread(target=self.serve, name="adbStandIn")
+    self.thread.daemon = True
+    self.thread.start()
+    return self
+
+
+  def serve(self):
+    while True:
+      try:
+        conn, addr = self.sock.accept()
+      except (IOError, OSError):
+        return  # Socket was closed by stop()
+      conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+      th = threading.Thread(target=self.handle, args=(conn,))
+      th.daemon = True
+      th.start()
+
+
+  def stop(self):
+    self.sock.close()
+
+
+  def path(self, remote):
+    return os.path.join(self.root, remote.lstrip('/'))
+
+
+  def handle(self, conn):
+    try:
+      while True:
+        req = recvAll(conn, int(recvAll(conn, 4), 16)).decode("ISO-8859-1")
+        if req == "host:devices":
+          data = (self.serial+"\t"+self.state+"\n").encode()
+          conn.sendall(b"OKAY"+b"%04x" % len(data)+data)
+          return
+        elif req == "host:transport-any" or req == "host:transport:"+self.serial:
+          conn.sendall(b"OKAY")  # Connection now talks to the 'device', keep reading
+        elif req.startswith("host:transport:"):
+          return fail(conn, "device '"+req[15:]+"' not found")
+        elif req.startswith("shell:") and not self.shell:
+          conn.sendall(b"OKAY- exec '/system/bin/sh' failed: No such file or directory"
+            b" (2) -\r\n")
+          return
+        elif req.startswith("shell:") or req.startswith("exec:"):
+          conn.sendall(b"OKAY")
+          return self.runCmd(conn, req.split(':', 1)[1])
+        elif req == "sync:":
+          conn.sendall(b"OKAY")
+          return self.sync(conn)
+        else:
+          return fail(conn, "unknown service "+req)
+    except adbError:
+      pass
+    finally:
+      try:  # (shutdown wakes runCmd's feed thread, close alone wouldn't send the EOF)
+        conn.shutdown(socket.SHUT_RDWR)
+      except (IOError, OSError):
+        pass
+      conn.close()
+
+
+  def runCmd(self, conn, cmd):
+    import subprocess
+    proc = subprocess.Popen(["sh", "-c", cmd], stdin=subprocess.PIPE,
+      stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=self.root)
+
+    def feed():  # Pass data sent by the client to the command's stdin (exec-in)
+      try:
+        while True:
+          data = conn.recv(65536)
+          if not data:
+            break
+          proc.stdin.write(data)
+      except (IOError, OSError):
+        pass
+      try:
+        proc.stdin.close()
+      except (IOError, OSError):
+        pass
+    th = threading.Thread(target=feed)
+    th.daemon = True
+    th.start()
+    for data in iter(lambda: proc.stdout.read1(65536), b""):
+      conn.sendall(data)
+    proc.wait()
+
+
+  def sync(self, conn):
+    while True:
+      cmd, ln = struct.unpack("<4sI", recvAll(conn, 8))
+      arg = recvAll(conn, ln).decode("ISO-8859-1")
+      if cmd == b"QUIT":
+        return
+      elif cmd == b"STAT":
+        try:
+          st = os.stat(self.path(arg))
+          conn.sendall(b"STAT"+struct.pack("<III", st.st_mode, st.st_size,
+            int(st.st_mtime)))
+        except OSError:
+          conn.sendall(b"STAT"+struct.pack("<III", 0, 0, 0))
+      elif cmd == b"RECV":
+        try:
+          with open(self.path(arg), 'rb') as ff:
+            for data in iter(lambda: ff.read(syncChunk), b""):
+              sendPacket(conn, b"DATA", data)
+          conn.sendall(b"DONE"+struct.pack("<I", 0))
+        except (IOError, OSError) as ex:
+          sendPacket(conn, b"FAIL", str(ex).encode())
+      elif cmd == b"SEND":
+        remote, mode = arg.rsplit(',', 1)
+        with open(self.path(remote), 'wb') as ff:
+          while True:
+            cmd, ln = struct.unpack("<4sI", recvAll(conn, 8))
+            if cmd == b"DONE":
+              break
+            ff.write(recvAll(conn, ln))
+        os.chmod(self.path(remote), int(mode) & 0o777)
+        os.utime(self.path(remote), (ln, ln))  # DONE's 'length' is the mtime
+        sendPacket(conn, b"OKAY", b"")
+      else:
+        return sendPacket(conn, b"FAIL", b"unknown sync command")
+
+
+def fail(conn, msg):
+  msg = msg.encode("ISO-8859-1")
+  conn.sendall(b"FAIL"+b"%04x" % len(msg)+msg)
+
+
+def bench(count=200):
+  '''Time shell/push/pull round trips through the stand-in server'''
+  import tempfile, shutil
+  root = tempfile.mkdtemp()
+  srv = adbStandIn(root=root).start()
+  cl = adbClient(port=srv.port)
+  try:
+    t0 = time.time()
+    for ii in range(0, count):
+      cl.shell("true")
+    dt = time.time()-t0
+    print("shell: %d cmds in %.3fs, %.2fms each" % (count, dt, dt*1000/count))
+
+    local = os.path.join(root, "bench.bin")
+    with open(local, 'wb') as ff:
+      ff.write(os.urandom(8192*1024))  # Size of an MC74 boot partition
+    t0 = time.time()
+    cl.push(local, "/bench.img")
+    cl.pull("/bench.img", local+".back")
+    dt = time.time()-t0
+    print("push+pull 8MB: %.3fs, %.1f MB/s" % (dt, 16/dt))
+  finally:
+    srv.stop()
+    shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+  op = sys.argv[1] if len(sys.argv)>1 else "bench"
+  args = dict(tok.split('=', 1) for tok in sys.argv[2:] if '=' in tok)
+  if op == "serve":
+    srv = adbStandIn(int(args.get("port", adbPort)), args.get("root", "."))
+    print("adbStandIn serving on port %d, root %s" % (srv.port, srv.root))
+    srv.serve()
+  else:
+    bench(int(args.get("count", 200)))
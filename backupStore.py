@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+'''backupStore -- A deduplicating store of partition backups, for a bench of MC74s.
+
+  Each backup is cut into chunkSize (1MB) chunks, each chunk is stored once, zlib
+  compressed, under its sha256 (chunks/ab/abcd...), and a manifest records which chunks
+  make up the backup (manifests/<serial>/<partition>-<yymmddHHMMSS>.json, with the
+  serial, partition, time, size and sha256 of the whole image).  Phones with the same
+  firmware share nearly all their chunks, and the zero filled ends of partitions take
+  almost nothing.  The first manifest of a device's partition is its original image.
+
+  The store is ~/.reviveMC74/backupStore, or the store=<dir> arg.
+'''
+import os, json, time, hashlib, zlib
+from ribou import bunch
+
+chunkSize = 1024*1024
+
+
+class backupStore:
+  def __init__(self, dir=None):
+    self.dir = dir if dir else os.path.join(os.path.expanduser("~"), ".reviveMC74",
+      "backupStore")
+    for sub in ("chunks", "manifests"):
+      if not os.path.isdir(os.path.join(self.dir, sub)):
+        os.makedirs(os.path.join(self.dir, sub))
+
+
+  def chunkFid(self, hash):
+    return os.path.join(self.dir, "chunks", hash[:2], hash)
+
+
+  def putChunk(self, data):
+    '''Store a chunk (if it isn't already), return (hash, bytes added to the store)'''
+    hash = hashlib.sha256(data).hexdigest()
+    fid = self.chunkFid(hash)
+    if os.path.isfile(fid):
+      return hash, 0
+    if not os.path.isdir(os.path.dirname(fid)):
+      os.makedirs(os.path.dirname(fid))
+    packed = zlib.compress(data, 6)
+    tmp = fid+".%d.tmp" % os.getpid()
+    with open(tmp, 'wb') as ff:
+      ff.write(packed)
+    os.replace(tmp, fid)
+    return hash, len(packed)
+
+
+  def getChunk(self, hash):
+    with open(self.chunkFid(hash), 'rb') as ff:
+      data = zlib.decompress(ff.read())
+    if hashlib.sha256(data).hexdigest()!=hash:
+      raise ValueError("backup store chunk "+hash+" is corrupt")
+    return data
+
+
+  def put(self, fid, serial, part):
+    '''Add a backup image file to the store, return its manifest (a bunch, with 'added',
+    the bytes it added to the store)'''
+    whole = hashlib.sha256()
+    chunks, added, size = [], 0, 0
+    with open(fid, 'rb') as ff:
+      for data in iter(lambda: ff.read(chunkSize), b""):
+        whole.update(data)
+        hash, nn = self.putChunk(data)
+        chunks.append(hash)
+        added += nn
+        size += len(data)
+    man = bunch(serial=serial, partition=part, time=time.strftime("%Y-%m-%d %H:%M:%S"),
+      source=os.path.basename(fid), size=size, sha256=whole.hexdigest(),
+      chunkSize=chunkSize, chunks=chunks)
+    manDir = os.path.join(self.dir, "manifests", safeName(serial))
+    if not os.path.isdir(manDir):
+      os.makedirs(manDir)
+    stamp = time.strftime("%y%m%d%H%M%S")
+    man.fid = os.path.join(manDir, part+"-"+stamp+".json")
+    nn = 1
+    while os.path.exists(man.fid):  # (Two backups in the same second)
+      nn += 1
+      man.fid = os.path.join(manDir, part+"-"+stamp+"_"+str(nn)+".json")
+    with open(man.fid, 'w') as ff:
+      json.dump(man, ff, indent=1)
+    man.added = added
+    return man
+
+
+  def manifests(self, serial=None, part=None):
+    '''Return the manifests (bunches, without the chunk lists), oldest first, of one
+    device/partition or all of them'''
+    mans = []
+    serials = [safeName(serial)] if serial else sorted(os.listdir(os.path.join(self.dir,
+      "manifests")))
+    for ss in serials:
+      manDir = os.path.join(self.dir, "manifests", ss)
+      if not os.path.isdir(manDir):
+        continue
+      for fn in sorted(os.listdir(manDir)):
+        if fn[-5:]==".json" and (part is None or fn.rsplit('-', 1)[0]==part):
+          man = self.readManifest(os.path.join(manDir, fn))
+          man.nChunks = len(man.pop("chunks"))
+          mans.append(man)
+    return mans
+
+
+  def readManifest(self, fid):
+    with open(fid) as ff:
+      man = bunch(**json.load(ff))
+    man.fid = fid
+    return man
+
+
+  def find(self, serial, part, which="orig"):
+    '''Return the manifest fid of a device's partition backup: which='orig' (the first),
+    'latest', or a yymmddHHMMSS timestamp.  None if there isn't one.'''
+    mans = self.manifests(serial, part)
+    if len(mans)==0:
+      return None
+    if which=="orig":
+      return mans[0].fid
+    if which=="latest":
+      return mans[-1].fid
+    for man in mans:
+      if man.fid.endswith("-"+which+".json"):
+        return man.fid
+    return None
+
+
+  def restore(self, manFid, outFid):
+    '''Write the image recorded by a manifest to outFid, checking its sha256'''
+    man = self.readManifest(manFid)
+    whole = hashlib.sha256()
+    with open(outFid+".part", 'wb') as ff:
+      for hash in man.chunks:
+        data = self.getChunk(hash)
+        whole.update(data)
+        ff.write(data)
+    if whole.hexdigest()!=man.sha256:
+      os.remove(outFid+".part")
+      raise ValueError("restored "+outFid+" does not match its manifest's sha256")
+    os.replace(outFid+".part", outFid)
+    return man
+
+
+  def stats(self):
+    '''Return a bunch(manifests, devices, logical (bytes backed up), unique (bytes of the
+    distinct chunks, before compression), chunks, stored (bytes on disk), dedup
+    (logical/unique), compression (unique/stored), ratio (logical/stored, both))'''
+    mans = self.manifests()
+    sizes = {}  # Chunk hash: its size before compression
+    for mm in mans:
+      for ii, hash in enumerate(self.readManifest(mm.fid).chunks):
+        sizes[hash] = min(mm.chunkSize, mm.size-ii*mm.chunkSize)
+    nChunks, stored = 0, 0
+    chunkDir = os.path.join(self.dir, "chunks")
+    for sub in os.listdir(chunkDir):
+      for fn in os.listdir(os.path.join(chunkDir, sub)):
+        if fn[-4:]!=".tmp":
+          nChunks += 1
+          stored += os.path.getsize(os.path.join(chunkDir, sub, fn))
+    logical, unique = sum(mm.size for mm in mans), sum(sizes.values())
+    return bunch(dir=self.dir, manifests=len(mans), devices=len(set(mm.serial
+      for mm in mans)), logical=logical, unique=unique, chunks=nChunks, stored=stored,
+      dedup=float(logical)/unique if unique else 0.0,
+      compression=float(unique)/stored if stored else 0.0,
+      ratio=float(logical)/stored if stored else 0.0)
+
+
+def safeName(serial):
+  '''A serial (maybe host:port) as a directory name'''
+  return serial.replace(':', '_').replace('/', '_').replace('\\', '_')
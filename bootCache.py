@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+'''bootCache -- A local cache of patched (fixPart'd) boot images, keyed by the sha256 of
+  the backed up image (rmcBoot.imgRaw) and the version of the patches applied to it.
+
+  Most MC74s run the same stock firmware, so the patched rmcBoot.img is the same for
+  each of them.  fixPart looks the .imgRaw up here first, and stores what it made.
+
+  The cache is a directory (~/.reviveMC74/bootCache, or the cache=<dir> arg) of
+  <key>.img files, and stats.json (hits, misses, stores, evictions).  When the .img
+  files total more than maxBytes (cacheMax=<MB> arg, default 256), the least recently
+  used ones (by mtime, which is touched on each hit) are removed.  Files are written
+  to a temp name then renamed, so fleet processes sharing the cache don't see partial
+  images (the stats counts may miss an update when processes race).
+'''
+import os, json, hashlib, time
+from ribou import bunch
+
+defaultMaxMB = 256
+
+
+class bootCache:
+  def __init__(self, dir=None, maxBytes=defaultMaxMB*1024*1024):
+    self.dir = dir if dir else os.path.join(os.path.expanduser("~"), ".reviveMC74",
+      "bootCache")
+    self.maxBytes = maxBytes
+    if not os.path.isdir(self.dir):
+      os.makedirs(self.dir)
+
+
+  def key(self, raw, version):
+    '''The cache key for a backed up image (bytes) and patch set version'''
+    return hashlib.sha256(raw).hexdigest()+"-v"+str(version)
+
+
+  def path(self, key):
+    return os.path.join(self.dir, key+".img")
+
+
+  def get(self, key):
+    '''Return the cached image for key (bytes), or None'''
+    try:
+      with open(self.path(key), 'rb') as ff:
+        data = ff.read()
+    except IOError:
+      self.count("misses")
+      return None
+    try:
+      os.utime(self.path(key), None)  # Most recently used
+    except OSError:
+      pass  # (Evicted by another process since we read it, or a read only cache)
+    self.count("hits")
+    return data
+
+
+  def put(self, key, data):
+    '''Store an image, then evict least recently used images to stay under maxBytes'''
+    tmp = self.path(key)+".%d.tmp" % os.getpid()
+    with open(tmp, 'wb') as ff:
+      ff.write(data)
+    os.replace(tmp, self.path(key))
+    self.count("stores")
+    self.evict()
+
+
+  def entries(self):
+    '''Return a list of bunch(key, size, mtime) for the cached images, oldest first'''
+    ents = []
+    for fn in os.listdir(self.dir):
+      if fn[-4:]==".img":
+        try:
+          st = os.stat(os.path.join(self.dir, fn))
+        except OSError:
+          continue  # (Evicted by another process)
+        ents.append(bunch(key=fn[:-4], size=st.st_size, mtime=st.st_mtime))
+    ents.sort(key=lambda ee: ee.mtime)
+    return ents
+
+
+  def evict(self):
+    ents = self.entries()
+    total = sum(ee.size for ee in ents)
+    for ee in ents:
+      if total<=self.maxBytes:
+        break
+      try:
+        os.remove(self.path(ee.key))
+      except OSError:
+        pass
+      total -= ee.size
+      self.count("evictions")
+
+
+  def statsFid(self):
+    return os.path.join(self.dir, "stats.json")
+
+
+  def readStats(self):
+    try:
+      with open(self.statsFid()) as ff:
+        return json.load(ff)
+    except (IOError, ValueError):
+      return {}
+
+
+  def count(self, name):
+    st = self.readStats()
+    st[name] = st.get(name, 0)+1
+    st["last"+name[0].upper()+name[1:]] = time.strftime("%Y-%m-%d %H:%M:%S")
+    tmp = self.statsFid()+".%d.tmp" % os.getpid()
+    with open(tmp, 'w') as ff:
+      json.dump(st, ff, indent=1, sort_keys=True)
+    os.replace(tmp, self.statsFid())
+
+
+  def stats(self):
+    '''Return a bunch of the counts in stats.json, and the cache's current contents'''
+    st = self.readStats()
+    ents = self.entries()
+    hits, misses = st.get("hits", 0), st.get("misses", 0)
+    return bunch(dir=self.dir, hits=hits, misses=misses, stores=st.get("stores", 0),
+      evictions=st.get("evictions", 0), entries=len(ents),
+      bytes=sum(ee.size for ee in ents), maxBytes=self.maxBytes,
+      hitRate=float(hits)/(hits+misses) if hits+misses else 0.0)
+
+
+  def clear(self):
+    for ee in self.entries():
+      os.remove(self.path(ee.key))
+    if os.path.isfile(self.statsFid()):
+      os.remove(self.statsFid())
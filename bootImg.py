@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+'''bootImg -- Read and write Android boot.img files in python, in place of the
+  unpackbootimg and mkbootimg programs.
+
+  A boot image is a one page header followed by the kernel, the ramdisk and an optional
+  second stage loader, each padded to a whole number of pages.  The header
+  (boot_img_hdr, all fields little endian uint32 unless noted) is:
+    magic[8]        'ANDROID!'
+    kernel_size, kernel_addr, ramdisk_size, ramdisk_addr, second_size, second_addr,
+    tags_addr, page_size, dt_size (unused), os_version (unused)
+    name[16]        board name
+    cmdline[512]    kernel command line
+    id[32]          sha1 of the kernel, ramdisk and second, and their sizes
+    extra_cmdline[1024]
+
+  unpackBootFile and packBootFile unpack/pack image files to/from directories given by
+  explicit paths, they never change the cwd, so several can run at once in threads.
+'''
+import os, struct, hashlib, shutil, gzip
+from ribou import bunch
+
+bootMagic = b"ANDROID!"
+hdrFormat = "<8s10I16s512s32s1024s"
+hdrSize = struct.calcsize(hdrFormat)
+
+# mkbootimg's default load addresses, as offsets from --base
+kernelOff = 0x00008000
+ramdiskOff = 0x01000000
+secondOff = 0x00f00000
+tagsOff = 0x00000100
+
+
+def isBootImg(data):
+  return bytes(data[:8]) == bootMagic
+
+
+def parseBootImg(data):
+  '''Parse a boot image (bytes, or a memoryview of a whole partition backup).  Returns a
+  bunch of the header values, with kernel, ramdisk and second as memoryviews into data.
+  '''
+  if not isBootImg(data):
+    raise ValueError("not an Android boot image (no 'ANDROID!' magic)")
+  mv = memoryview(data)
+  (magic, kernelSize, kernelAddr, ramdiskSize, ramdiskAddr, secondSize, secondAddr,
+    tagsAddr, pageSize, dtSize, osVersion, name, cmdline, id, extraCmdline
+    ) = struct.unpack(hdrFormat, mv[:hdrSize])
+  if pageSize == 0 or pageSize & (pageSize-1):
+    raise ValueError("boot image page size %d is not a power of 2" % pageSize)
+
+  base = kernelAddr-kernelOff
+  img = bunch(pagesize=pageSize, base=base, kernelOff=kernelAddr-base,
+    ramdiskOff=ramdiskAddr-base, secondOff=secondAddr-base, tagsOff=tagsAddr-base,
+    name=cstr(name), cmdline=cstr(cmdline)+cstr(extraCmdline), id=bytes(id))
+  offset = pageSize  # Header takes the first page
+  for part, size in (("kernel", kernelSize), ("ramdisk", ramdiskSize),
+      ("second", secondSize)):
+    if offset+size > len(mv):
+      raise ValueError("boot image is truncated, %s runs past the end" % part)
+    img[part] = mv[offset:offset+size]
+    offset += pages(size, pageSize)*pageSize
+  img.size = offset  # Length of the image, a partition backup is padded beyond this
+  return img
+
+
+def buildBootImg(kernel, ramdisk, cmdline="", base=0x10000000, pagesize=2048,
+    second=b"", name="", kernelOff=kernelOff, ramdiskOff=ramdiskOff,
+    secondOff=secondOff, tagsOff=tagsOff):
+  '''Build a boot image the way mkbootimg does, return it as bytes'''
+  cmdline = cmdline.encode("ISO-8859-1")
+  if len(cmdline) > 512+1024-1:
+    raise ValueError("kernel command line is too long (%d bytes)" % len(cmdline))
+
+  sha = hashlib.sha1()
+  for data in (kernel, ramdisk, second):
+    sha.update(data)
+    sha.update(struct.pack("<I", len(data)))
+
+  hdr = struct.pack(hdrFormat, bootMagic, len(kernel), base+kernelOff, len(ramdisk),
+    base+ramdiskOff, len(second), base+secondOff, base+tagsOff, pagesize, 0, 0,
+    name.encode("ISO-8859-1"), cmdline[:511], sha.digest(), cmdline[511:])
+
+  out = bytearray()
+  for data in (hdr, kernel, ramdisk, second):
+    out += data
+    out += b"\0"*(pages(len(data), pagesize)*pagesize-len(data))
+  return bytes(out)
+
+
+def pages(size, pageSize):
+  return (size+pageSize-1)//pageSize
+
+
+def cstr(data):
+  '''Convert a NUL padded header field to a str'''
+  return bytes(data).split(b"\0", 1)[0].decode("ISO-8859-1")
+
+
+def unpackFiles(img):
+  '''Return the files unpackbootimg would write for a parsed image, as a dict of
+  name: bytes (without unpackbootimg's '<imageName>-' prefix)
+  '''
+  files = {
+    "zImage": bytes(img.kernel),
+    "ramdisk.gz": bytes(img.ramdisk),
+    "cmdline": img.cmdline+"\n",
+    "board": img.name+"\n",
+    "base": "%08x\n" % img.base,
+    "pagesize": "%d\n" % img.pagesize,
+    "kerneloff": "%08x\n" % img.kernelOff,
+    "ramdiskoff": "%08x\n" % img.ramdiskOff,
+    "secondoff": "%08x\n" % img.secondOff,
+    "tagsoff": "%08x\n" % img.tagsOff,
+  }
+  if len(img.second) > 0:
+    files["second"] = bytes(img.second)
+  return files
+
+
+def unpackBootFile(imgFid, outDir=None, fn=None):
+  '''Unpack the boot image file imgFid into <outDir>/<fn>Unpack (kernel, ramdisk.gz,
+  cmdline... files, like unpackbootimg) and extract its ramdisk into <outDir>/<fn>Ramdisk.
+  outDir defaults to imgFid's directory and fn to imgFid's name up to the first '.' (ie
+  rmcBoot for rmcBoot.imgRaw).  Any old Unpack/Ramdisk directories are replaced.  Raises
+  ValueError if imgFid is not a boot image.  Returns a bunch(img (header values),
+  unpackDir, ramdiskDir, files (names in unpackDir), entries (cpio -tv style lines)).
+  '''
+  from cpioNewc import readEntries, extractEntries
+  if outDir is None:
+    outDir = os.path.dirname(imgFid) or '.'
+  if fn is None:
+    fn = os.path.basename(imgFid).split('.')[0]
+  with open(imgFid, 'rb') as ff:
+    img = parseBootImg(ff.read())
+
+  res = bunch(img=bunch(**dict((kk, vv) for kk, vv in img.items()
+      if kk not in ("kernel", "ramdisk", "second"))),
+    unpackDir=os.path.join(outDir, fn+"Unpack"),
+    ramdiskDir=os.path.join(outDir, fn+"Ramdisk"), files=[], entries=[])
+  for dir in (res.unpackDir, res.ramdiskDir):
+    if os.path.isdir(dir):
+      shutil.rmtree(dir)
+    os.makedirs(dir)
+
+  for name, data in sorted(unpackFiles(img).items()):
+    with open(os.path.join(res.unpackDir, name), 'wb') as ff:
+      ff.write(data if type(data)==bytes else data.encode("ISO-8859-1"))
+    res.files.append(name)
+
+  # Extract (and list) the ramdisk entries in one pass, streaming from ramdisk.gz
+  with gzip.open(os.path.join(res.unpackDir, "ramdisk.gz"), 'rb') as fp:
+    res.entries = extractEntries(readEntries(fp), res.ramdiskDir)  # (Keeps modes, mtimes)
+  return res
+
+
+def packBootFile(unpackDir, ramdiskDir, imgFid):
+  '''Archive ramdiskDir (sorted by name, owned by root) into unpackDir/ramdisk.gz, then
+  build the boot image file imgFid from it and the zImage, cmdline, base and pagesize
+  files in unpackDir.  Returns a bunch(imgFid, size, entries (count), ramdiskSize,
+  cmdline, base, pagesize).
+  '''
+  from cpioNewc import cpioWriter, dirEntries
+  rdFid = os.path.join(unpackDir, "ramdisk.gz")
+  cnt = 0
+  with open(rdFid, 'wb') as ff:
+    with gzip.GzipFile(filename="", mode='wb', fileobj=ff, mtime=0) as gz:
+      wr = cpioWriter(gz)
+      for ent in dirEntries(ramdiskDir):
+        wr.addEntry(ent)
+        cnt += 1
+      wr.close()
+
+  def readText(name):
+    with open(os.path.join(unpackDir, name), 'rb') as ff:
+      return ff.read().decode("ISO-8859-1").rstrip("\r\n")
+  cmdline, base, pagesize = readText("cmdline"), readText("base"), readText("pagesize")
+  with open(os.path.join(unpackDir, "zImage"), 'rb') as ff:
+    kernel = ff.read()
+  with open(rdFid, 'rb') as ff:
+    ramdisk = ff.read()
+  data = buildBootImg(kernel, ramdisk, cmdline=cmdline, base=int(base, 16),
+    pagesize=int(pagesize))
+  with open(imgFid, 'wb') as ff:
+    ff.write(data)
+  return bunch(imgFid=imgFid, size=len(data), entries=cnt, ramdiskSize=len(ramdisk),
+    cmdline=cmdline, base=base, pagesize=pagesize)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+'''checkpoint -- What reviveMC74 has already done to a device, kept between runs.
+
+  When an objective is done (or its done probe finds it was), it is recorded in the
+  device's checkpoint file, checkpoints/<serial>.json, with a fingerprint of its inputs:
+  the args that choose them (part, img...) and the size, mtime and md5 of each local file
+  it used (boot images, recovery image, apks...).  On a rerun, an objective recorded with
+  the same args and unchanged files (the same size and mtime, or else the same md5) is
+  taken as done, without asking the device.  A failed objective's record is removed.
+  The file also keeps a copy of the run's state bunch (mac address, serial...).
+
+  With trust=False (reviveMC74's verify=full) the records are not used, every objective
+  is reassessed by its probe, but they are still written, for the next run.
+'''
+import os, json, time, hashlib, threading
+from backupStore import safeName
+
+checkpointDir = "checkpoints"
+
+
+class checkpoint:
+  def __init__(self, serialOf, inputs, argsOf, state=None, trust=True, log=print):
+    self.serialOf = serialOf  # Returns the device serial (or None: no checkpoint)
+    self.inputs = inputs  # objective name: func returning the local files it uses
+    self.argsOf = argsOf  # Returns a dict of the args the objectives' inputs depend on
+    self.state = state  # The state bunch, saved with each record
+    self.trust = trust
+    self.log = log
+    self.lock = threading.Lock()
+    self.fid = None
+    self.data = None  # (Read when it's first needed)
+
+
+  def load(self):
+    '''Read the device's checkpoint file, return False if there is no device serial'''
+    with self.lock:
+      if self.data is None:
+        serial = self.serialOf()
+        self.data = {"serial": serial, "objectives": {}, "state": {}}
+        if serial:
+          self.fid = os.path.join(checkpointDir, safeName(serial)+".json")
+          try:
+            with open(self.fid) as ff:
+              data = json.load(ff)
+            if data.get("serial")==serial:
+              self.data = data
+          except (IOError, OSError, ValueError):
+            pass
+          if self.state is not None:
+            for kk, vv in self.data["state"].items():
+              if kk not in self.state:
+                self.state[kk] = vv  # (Not adbMode, error...: the device may have changed)
+        else:
+          self.log("  -- no checkpoint (no device serial), every objective is assessed")
+    return self.fid is not None
+
+
+  def isDone(self, name):
+    '''True if name is recorded as done, with the same args and unchanged input files'''
+    if not self.trust or name not in self.inputs or not self.load():
+      return False
+    with self.lock:
+      rec = self.data["objectives"].get(name)
+    if rec is None:
+      return False
+    old = rec["fingerprint"]
+    fp = fingerprint(self.inputs[name](), self.argsOf(), old)
+    if fp["args"]!=old["args"] or sorted(fp["files"])!=sorted(old["files"]):
+      return False
+    for fid, ff in fp["files"].items():
+      if ff is None or old["files"][fid] is None or ff[0]!=old["files"][fid][0] \
+          or ff[2]!=old["files"][fid][2]:
+        return False
+    if fp!=old:  # (Same contents, new mtimes: remember them, so md5s aren't redone)
+      self.record(name, fp)
+    return True
+
+
+  def done(self, name, ok):
+    '''Record (ok) or forget (not ok) an objective'''
+    if name not in self.inputs or not self.load():
+      return
+    if ok:
+      with self.lock:
+        rec = self.data["objectives"].get(name)
+      self.record(name, fingerprint(self.inputs[name](), self.argsOf(),
+        rec["fingerprint"] if rec else None))
+    else:
+      with self.lock:
+        self.data["objectives"].pop(name, None)
+      self.save()
+
+
+  def record(self, name, fp):
+    with self.lock:
+      self.data["objectives"][name] = {"time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "fingerprint": fp}
+    self.save()
+
+
+  def save(self):
+    '''Write the checkpoint file (with the current state)'''
+    if self.fid is None:
+      return
+    with self.lock:
+      if self.state is not None:
+        self.data["state"] = json.loads(json.dumps(dict((kk, vv) for kk, vv
+          in self.state.items() if kk not in ("error", "needed")), default=str))
+      if not os.path.isdir(checkpointDir):
+        os.makedirs(checkpointDir)
+      tmp = self.fid+".%d.tmp" % os.getpid()
+      with open(tmp, 'w') as ff:
+        json.dump(self.data, ff, indent=1, sort_keys=True)
+      os.replace(tmp, self.fid)
+
+
+def fingerprint(fids, args, old=None):
+  '''Return {"args": args, "files": {fid: [size, mtime ns, md5] (None if missing)}}.
+  A file with the same size and mtime as in old keeps its md5 from there.'''
+  oldFiles = (old or {}).get("files", {})
+  files = {}
+  for fid in fids:
+    if not os.path.isfile(fid):
+      files[fid] = None
+      continue
+    st = os.stat(fid)
+    prev = oldFiles.get(fid)
+    if prev and prev[:2]==[st.st_size, st.st_mtime_ns]:
+      files[fid] = prev
+    else:
+      md5 = hashlib.md5()
+      with open(fid, 'rb') as ff:
+        for data in iter(lambda: ff.read(1024*1024), b""):
+          md5.update(data)
+      files[fid] = [st.st_size, st.st_mtime_ns, md5.hexdigest()]
+  return {"args": args, "files": files}
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+'''cpioNewc -- Read and write 'newc' (SVR4, no CRC) cpio archives, the format of an
+  Android ramdisk, in place of the cpio program.
+
+  Each entry is a 110 byte ASCII header: '070701' then 13 eight digit hex fields (ino,
+  mode, uid, gid, nlink, mtime, filesize, devmajor, devminor, rdevmajor, rdevminor,
+  namesize, check), the NUL terminated name, padding to a multiple of 4, the file data
+  (a symlink's data is its target), and padding to a multiple of 4.  The archive ends
+  with an entry named 'TRAILER!!!'.
+
+  Entries are read and written one at a time from/to file objects, so a gzip'd ramdisk
+  can be streamed without holding the whole archive in memory.
+'''
+import os, stat
+from ribou import bunch
+
+newcMagic = b"070701"
+trailer = "TRAILER!!!"
+hdrLen = 110
+
+
+def pad4(nn):
+  return (4-nn%4)%4
+
+
+def readEntries(fp):
+  '''Generate a bunch(name, mode, mtime, uid, gid, data...) for each entry of a newc
+  archive read from the file object fp (ie a gzip.GzipFile)
+  '''
+  while True:
+    hdr = readExact(fp, hdrLen)
+    if hdr[:6] != newcMagic:
+      raise ValueError("not a newc cpio archive (magic %r)" % hdr[:6])
+    fld = [int(hdr[6+ii*8:14+ii*8], 16) for ii in range(0, 13)]
+    nameSize, fileSize = fld[11], fld[6]
+    name = readExact(fp, nameSize)[:-1].decode("ISO-8859-1")
+    readExact(fp, pad4(hdrLen+nameSize))
+    if name == trailer:
+      return
+    data = readExact(fp, fileSize)
+    readExact(fp, pad4(fileSize))
+    yield bunch(name=name, ino=fld[0], mode=fld[1], uid=fld[2], gid=fld[3],
+      nlink=fld[4], mtime=fld[5], devMajor=fld[7], devMinor=fld[8], rdevMajor=fld[9],
+      rdevMinor=fld[10], data=data)
+
+
+def readExact(fp, cnt):
+  data = fp.read(cnt)
+  if len(data) != cnt:
+    raise ValueError("cpio archive is truncated")
+  return data
+
+
+class cpioWriter:
+  '''Write newc entries to a file object.  Like 'cpio -o -H newc -R 0.0', every entry is
+  owned by uid/gid 0.  Inode numbers are assigned in order, so the output only depends
+  on the entries given.
+  '''
+  def __init__(self, fp):
+    self.fp = fp
+    self.ino = 300000  # (Arbitrary, like the kernel's initramfs)
+
+
+  def add(self, name, mode, data=b"", mtime=0, nlink=None, rdev=(0, 0), ino=None):
+    if type(data) != bytes:
+      data = data.encode("ISO-8859-1")
+    if nlink is None:
+      nlink = 2 if stat.S_ISDIR(mode) else 1
+    if ino is None:
+      self.ino += 1
+      ino = self.ino
+    nameB = name.encode("ISO-8859-1")+b"\0"
+    fld = [ino, mode, 0, 0, nlink, int(mtime), len(data), 0, 0, rdev[0], rdev[1],
+      len(nameB), 0]
+    hdr = newcMagic+b"".join([b"%08x" % ff for ff in fld])
+    self.fp.write(hdr+nameB+b"\0"*pad4(hdrLen+len(nameB)))
+    self.fp.write(data+b"\0"*pad4(len(data)))
+
+
+  def addEntry(self, ent):
+    '''Write an entry read by readEntries (or an edited copy of one)'''
+    self.add(ent.name, ent.mode, ent.data, ent.mtime, ent.nlink, (ent.rdevMajor,
+      ent.rdevMinor))
+
+
+  def close(self):
+    '''Write the trailer entry, which ends the archive'''
+    self.add(trailer, 0, nlink=1, ino=0)
+
+
+def extractEntries(entries, dir):
+  '''Extract entries below dir (like 'cpio -i -m'), setting the directories' modes and
+  mtimes after all of the entries are extracted (as cpio does), so writing the files in
+  a directory doesn't change its mtime, or fail if it is read only.  Returns the
+  entries' 'cpio -tv' style listing lines.
+  '''
+  lines, dirs = [], []
+  for ent in entries:
+    lines.append(extractEntry(ent, dir, dirs))
+  for path, ent in reversed(dirs):  # (Deepest first)
+    os.chmod(path, stat.S_IMODE(ent.mode))
+    os.utime(path, (ent.mtime, ent.mtime))
+  return lines
+
+
+def extractEntry(ent, dir, dirs=None):
+  '''Create a file, directory or symlink for an entry below dir, with its mode and mtime
+  (like 'cpio -i -m'), except that a directory is appended to dirs, as (path, ent), if
+  dirs is given, for the caller to set later.  Returns a 'cpio -tv' style listing line
+  for the entry.
+  '''
+  path = os.path.join(dir, ent.name)
+  kind = stat.S_IFMT(ent.mode)
+  if kind == stat.S_IFDIR:
+    if not os.path.isdir(path):
+      os.makedirs(path)
+  elif kind == stat.S_IFLNK:
+    if os.path.lexists(path):
+      os.remove(path)
+    try:
+      os.symlink(ent.data.decode("ISO-8859-1"), path)
+    except (OSError, NotImplementedError, AttributeError):
+      with open(path, 'wb') as ff:  # (Windows, may not allow symlinks, save the target)
+        ff.write(ent.data)
+  elif kind == stat.S_IFREG:
+    with open(path, 'wb') as ff:
+      ff.write(ent.data)
+  else:
+    return listLine(ent)+"  (special file, not extracted)"
+  if kind == stat.S_IFDIR and dirs is not None:
+    dirs.append((path, ent))
+  elif kind != stat.S_IFLNK:
+    os.chmod(path, stat.S_IMODE(ent.mode))
+    os.utime(path, (ent.mtime, ent.mtime))
+  return listLine(ent)
+
+
+def listLine(ent):
+  import time
+  return "%s %3d %-4d %-4d %8d %s %s%s" % (stat.filemode(ent.mode), ent.nlink, ent.uid,
+    ent.gid, len(ent.data), time.strftime("%b %d %Y", time.localtime(ent.mtime)),
+    ent.name, " -> "+ent.data.decode("ISO-8859-1") if stat.S_ISLNK(ent.mode) else "")
+
+
+def dirEntries(dir):
+  '''Generate entries for the files below dir, sorted by name (like sorting 'find .'
+  output), for re-archiving an extracted ramdisk
+  '''
+  names = []
+  for root, dirs, files in os.walk(dir):
+    for fn in dirs+files:
+      names.append(os.path.relpath(os.path.join(root, fn), dir).replace(os.sep, '/'))
+  names.sort()
+  for name in names:
+    path = os.path.join(dir, name)
+    st = os.lstat(path)
+    if stat.S_ISLNK(st.st_mode):
+      data = os.readlink(path).encode("ISO-8859-1")
+    elif stat.S_ISREG(st.st_mode):
+      with open(path, 'rb') as ff:
+        data = ff.read()
+    else:
+      data = b""
+    yield bunch(name=name, mode=st.st_mode, mtime=int(st.st_mtime), nlink=None,
+      rdevMajor=0, rdevMinor=0, data=data)
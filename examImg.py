@@ -3,8 +3,12 @@
   its form and files.
 '''
 
-import sys, os, time, datetime, shutil, inspect
+import sys, os, time, datetime, shutil, inspect, threading, atexit, queue
 from ribou import *
+from adbClient import adbClient, adbError, adbServerUp
+from bootImg import unpackBootFile, packBootFile
+from runLog import runLog, installCrashHook
+import perf
 
 logFid = "reviveMC74.log"
 
@@ -14,48 +18,59 @@ def examImg(args):
     return compareImg(args[1:])
   if args[0][:4]=="pack":
     return pack(args[1:])
+  if args[0][:4]=="regi":  # Block by block map/diff of raw partition images (numpy)
+    from imgRegions import imgRegions
+    return imgRegions(args[1:])
+  if args[0][:4]=="diff":  # Added/removed/changed files (and lines), as text or json
+    from imgDiff import imgDiff
+    return imgDiff(args[1:])
   
   imgFn = args[0]
   ii = imgFn.find('.')
   if ii<=0:
     imgFn = "rmcBoot."+imgFn[ii+1:]
   imgDir = args[1] if len(args)>1 else imgFn.split('.')[1]
+  inf = unpackImg(imgFn, imgDir)
+  if inf is None:
+    return
 
-  # Move the .img file to a directory with the name equal to the img file name extension
-  # Create the directory for unpacking the files
-  if os.path.isdir(imgDir):
-    shutil.rmtree(imgDir)
-  os.mkdir(imgDir)
-  shutil.copyfile(imgFn, imgDir+'/'+imgFn)
-  os.chdir(os.getcwd()+'/'+imgDir)
-
-  resp, rc = execute(sys.executable+' '+pyFileDir+"/installFiles/packBoot.py unpack "+imgFn)
-  #print("unpack: %d -- %s" % (rc, resp))
-
-  print(fileInfo('', imgFn))
-
+  print(fileSum(inf.img))
   print(imgDir+" -- ramdisk:")
-  for fn in os.listdir("./rmcBootRamdisk"):
-    print(fileInfo("./rmcBootRamdisk/", fn))
-
+  for fn in sorted(inf.ramdisk):
+    print(fileSum(inf.ramdisk[fn]))
   print(imgDir+" -- unpack:")
-  for fn in os.listdir("./rmcBootUnpack"):
-    print(fileInfo("./rmcBootUnpack/", fn))
+  for fn in sorted(inf.unpack):
+    print(fileSum(inf.unpack[fn]))
 
-  os.chdir('..')  # Go back from imgDir to the original directory
+
+def unpackImg(imgFid, imgDir):
+  '''Copy an image file into the directory imgDir (replacing it), unpack it there (to
+  rmcBootUnpack and rmcBootRamdisk) and return analyzeDir's bunch for it, or None if it
+  is not a boot image.  Uses explicit paths (no chdir), so images can be unpacked in
+  threads.
+  '''
+  # Copy the .img file to a directory with the name equal to the img file name extension
+  if os.path.isdir(imgDir):
+    shutil.rmtree(imgDir)
+  os.makedirs(imgDir)
+  imgFn = "rmcBoot."+os.path.basename(imgDir)
+  shutil.copyfile(imgFid, os.path.join(imgDir, imgFn))
+  try:
+    unpackBootFile(os.path.join(imgDir, imgFn), imgDir, "rmcBoot")
+  except ValueError as err:
+    print("unpack "+imgFid+": "+str(err))
+    return None
+  return analyzeDir(imgDir)
 
 
 def compareImg(args):
   '''Make a signature of all files in an unpacked image and display/compare them'''
-  iInfo = bunch()  # Collection of data about an img
-
-  for fn in os.listdir('.'):
-    if os.path.isdir(fn) and fn[:3]=="img":  # If this is a img* directory...
-      print("  (%s)" % (fn))
-      iInfo[fn] = analyzeDir(fn)
+  # Collection of data about each img* directory, analyzed concurrently
+  iInfo = analyzeDirs(sorted([fn for fn in os.listdir('.')
+    if os.path.isdir(fn) and fn[:3]=="img"]))
      
   # For each .img, prepare a column of signature information
-  imgNmList = args if len(args)>0 else iInfo.keys()
+  imgNmList = args if len(args)>0 else sorted(iInfo.keys())
   ref = iInfo[imgNmList[0]]  # Reference img to compare to
   sig = bunch()
   for imgNm in iInfo:
@@ -79,12 +94,12 @@ def makeSignature(ref, iInf):
   resp = [fileSig(None, iInf.img.name, iInf, ref)]
 
   resp.append("         UNPACK".ljust(len(resp[0])))  # Make all lines the same length
-  sortedFns = iInf.unpack.keys(); sortedFns.sort()
+  sortedFns = sorted(iInf.unpack.keys())
   for fn in sortedFns:
     resp.append(fileSig("unpack", fn, iInf, ref))
     
   resp.append("        RAMDISK".ljust(len(resp[0])))
-  sortedFns = iInf.ramdisk.keys(); sortedFns.sort()
+  sortedFns = sorted(iInf.ramdisk.keys())
   for fn in sortedFns:
     resp.append(fileSig("ramdisk", fn, iInf, ref))
   return resp  
@@ -114,28 +129,47 @@ def fileSig(group, fn, iInf, ref):
 
 
 def analyzeDir(dir):
-  inf = bunch(img=bunch(fn=dir), unpack=bunch(), ramdisk=bunch())
-  os.chdir(dir)  # Enter the directory with the files
-  inf.img = fInfo('', "rmcBoot."+dir)
-  inf.img.name = dir
-
-  for fn in os.listdir("./rmcBootRamdisk"):
-    inf.ramdisk[fn] = fInfo("./rmcBootRamdisk/", fn)
+  '''Return a bunch(img, unpack, ramdisk) of fInfo's for the files of an unpacked img*
+  directory (the image file, rmcBoot.<dir>, and the rmcBootUnpack and rmcBootRamdisk
+  files).  dir is used as a path, the cwd is not changed.
+  '''
+  name = os.path.basename(os.path.normpath(dir))
+  inf = bunch(img=bunch(fn=name), unpack=bunch(), ramdisk=bunch())
+  rdDir = os.path.join(dir, "rmcBootRamdisk")+'/'
+  unDir = os.path.join(dir, "rmcBootUnpack")+'/'
+  ramdisk = os.listdir(rdDir)
+  unpack = os.listdir(unDir)
+  md5s = indexedMd5s(dir, [os.path.join(dir, "rmcBoot."+name)]+[rdDir+fn for fn in ramdisk]
+    +[unDir+fn for fn in unpack])  # Only files changed since last time are hashed
+  inf.img = fInfo(dir+'/', "rmcBoot."+name, md5s)
+  inf.img.name = name
+
+  for fn in ramdisk:
+    inf.ramdisk[fn] = fInfo(rdDir, fn, md5s)
+
+  for fn in unpack:
+    inf.unpack[fn] = fInfo(unDir, fn, md5s)
+  return inf
 
-  for fn in os.listdir("./rmcBootUnpack"):
-    inf.unpack[fn] = fInfo("./rmcBootUnpack/", fn)
 
-  os.chdir('..')  # Go back from imgDir to the original directory
-  return inf
+def analyzeDirs(dirs):
+  '''analyzeDir a list of img* directories concurrently, return a bunch of dir: info'''
+  from concurrent.futures import ThreadPoolExecutor
+  with ThreadPoolExecutor(max_workers=min(len(dirs), 8) or 1) as pool:
+    return bunch(**dict(zip(dirs, pool.map(analyzeDir, dirs))))
 
 
-def fInfo(dir, fn):
+def fInfo(dir, fn, md5s=None):
+  '''Return a bunch of the size, date, md5 (and short contents) of a file.  md5s is a
+  dict of path: md5 from md5Files, if the file was already hashed.
+  '''
   tm = os.path.getmtime(dir+fn)
   tm = time.localtime(tm)  # Convert tm to time.struct_time format
   ts = tc(tm.tm_year%100)+'/'+tc(tm.tm_mon)+'/'+tc(tm.tm_mday)+'-' \
     +tc(tm.tm_hour)+':'+tc(tm.tm_min)+':'+tc(tm.tm_sec)
   sz = os.path.getsize(dir+fn)
   finf = bunch(
+    fn = fn,
     size = sz,
     date = ts
   )
@@ -143,14 +177,19 @@ def fInfo(dir, fn):
   if sz<80 and os.path.isfile(dir+fn): finf.cont = readFile(dir+fn)
 
   if os.path.isfile(dir+fn):
-    md5, rc = execute('md5 '+dir+fn)
-    finf.md5 = md5.split()[0]
+    finf.md5 = md5s[dir+fn] if md5s and dir+fn in md5s else md5File(dir+fn)
   return finf
 
 
-def fileInfo(dir, fn):
+def fileSum(finf):
+  '''fileInfo's line, for an fInfo bunch'''
+  md5 = finf.get('md5', "        ")
+  return "  "+md5[0:4]+" "+md5[4:8]+" "+str(finf.size).rjust(8)+' '+finf.fn
+
+
+def fileInfo(dir, fn, md5s=None):
   if os.path.isfile(dir+fn):
-    md5, rc = execute('md5 '+dir+fn)
+    md5 = md5s[dir+fn] if md5s and dir+fn in md5s else md5File(dir+fn)
   else:
     md5 = "        "
   resp = "  "+md5[0:4]+" "+md5[4:8]+" "+str(os.path.getsize(dir+fn)).rjust(8)
@@ -165,8 +204,8 @@ def pack(args):
   if ii==0:  imgFn = 'rmcBoot'+imgFn
   print("Pack this dir into %s" % (imgFn))
 
-  resp, rc = execute(sys.executable+' '+pyFileDir+'/installFiles/packBoot.py pack '+imgFn)
-  print("%d %s" % (rc, resp))
+  res = packBootFile("rmcBootUnpack", "rmcBootRamdisk", imgFn+time.strftime("%y%m%d%H%M"))
+  print("built %s: %d bytes, %d ramdisk entries" % (res.imgFid, res.size, res.entries))
 
 
 def tc(vv):
@@ -183,57 +222,94 @@ def editFile(fid, find="<editMe>", replace=None, insert=None, delete=None, adb=F
     By default, the file is on this computer's file system, if adb=True, the file is read
     and written (pulled and pushed) to the remove Android device using adb.
   '''
-  logp("  -- editFile "+fid+" find '"+find+"'")
+  return editFileMulti(fid, [bunch(find=find, replace=replace, insert=insert,
+    delete=delete)], adb)
+
+
+def editFileMulti(fid, edits, adb=False):
+  '''Apply a list of edits (bunches or dicts of editFile's find, replace, insert, delete
+    args), in order, to a file, reading and writing (pulling and pushing, if adb=True) it
+    just once.  The file is only written if an edit changed it.  Returns editLinesMulti's
+    report (a bunch(find, status) per edit), or False if the file can't be read.
+  '''
+  logp("  -- editFile "+fid+": "+', '.join(["'"+ed['find']+"'" for ed in edits]))
+  localTmpFid = "examImgEditFile.tmp"
   try:
     if adb:
-      localTmpFid = "examImgEditFile.tmp"
       resp, rc = executeAdbLog("pull "+fid+" "+localTmpFid)
       body = readFile(localTmpFid)
     else:
       body = readFile(fid)
-    
-    lines = body.split('\n')
-    pp = []
-    for lnNo in range(0, len(lines)):
-      ln = lines[lnNo]  # Get lines by index number so we can inspect/insert/delete future lines
-      if ln[-1:]=='\r':  ln = ln[:-1]  # Remove \r from \r\n on windows systems
-      if find and ln.find(find)!=-1:  # Does this line contain the content we need to find?
-        find = None  # Remove the 'find' string now that we found it
-        if replace:  # If the line is to be replaced, replace it, otherwise add it
-          pp.append(replace)
-        elif not delete:
-          pp.append(ln)  # Keep this line, others may be inserted next
-        
-        if insert:  # Insert a list of lines, or just one line
-          # Avoid creating duplicate inserts if fixPart is run multiple times
-          firstInsert = insert if type(insert)==str else insert[0]
-          print("    firstInsert '"+firstInsert+"'")
-          print("    next line   '"+lines[lnNo+1]+"' ("+str(len(lines)>lnNo+1)
-            +" "+str(len(lines)>lnNo+1 and lines[lnNo+1]!=firstInsert)+")")
-          if len(lines)>lnNo+1 and lines[lnNo+1]!=firstInsert:
-            if type(insert)==list:
-              for il in insert:
-                pp.append(il)
-            else:
-              pp.append(insert)
-          else:
-            logp("  (ignoring duplicate insertion edit request for: '"+firstInsert+"'")
-      else:
-        pp.append(ln)  # This is not the line you are looking for, just copy the file
-        
-    if find:
-      logp("  !! Failed to find '"+find+"' in "+fid)
+  except IOError as err:
+    logp("  !! Can't find: "+fid+" in "+os.getcwd())
+    return False
+
+  pp, report = editLinesMulti(body.split('\n'), edits)
+  for rr in report:
+    if rr.status=="notFound":
+      logp("  !! Failed to find '"+rr.find+"' in "+fid)
 
+  if any(rr.status=="edited" for rr in report):
     pp = '\n'.join(pp)
     if adb:
       writeFile(localTmpFid, pp)
       resp, rc = executeAdbLog("push "+localTmpFid+" "+fid)
     else :
       writeFile(fid, pp)
-    
-  except IOError as err:
-    logp("  !! Can't find: "+fid+" in "+os.getcwd())
-    return False
+  return report
+
+
+def editLinesMulti(lines, edits):
+  '''Apply a list of edits (bunches or dicts of editLines' find, replace, insert, delete
+    args) to a list of lines, in order.  Returns (new lines, report), the report has a
+    bunch(find, status) for each edit, status is 'edited', 'already' (the find line is
+    already the replace line, or is followed by the insert line, so the edit was done
+    before) or 'notFound' (even if the replace line is elsewhere in the file).
+  '''
+  report = []
+  for ed in edits:
+    find, replace, insert = ed['find'], ed.get('replace'), ed.get('insert')
+    new, found = editLines(lines, find, replace, insert, ed.get('delete'))
+    if not found:
+      status = "notFound"
+    elif new!=[ln.rstrip('\r') for ln in lines]:
+      status = "edited"
+    else:
+      status = "already"
+    lines = new
+    report.append(bunch(find=find, status=status))
+  return lines, report
+
+
+def editLines(lines, find, replace=None, insert=None, delete=None):
+  '''Edit a list of lines (the guts of editFile): find the first line containing 'find',
+  then 'replace' or 'delete' it, and/or 'insert' a line (or list of lines) after it.  An
+  insert is skipped if the line after the found line is already the (first) inserted
+  line, so repeating an edit doesn't duplicate it.  Returns (new lines, found).
+  '''
+  pp = []
+  found = False
+  for lnNo in range(0, len(lines)):
+    ln = lines[lnNo]  # Get lines by index number so we can inspect/insert/delete future lines
+    if ln[-1:]=='\r':  ln = ln[:-1]  # Remove \r from \r\n on windows systems
+    if find and not found and ln.find(find)!=-1:  # Does this line contain 'find'?
+      found = True
+      if replace:  # If the line is to be replaced, replace it, otherwise add it
+        pp.append(replace)
+      elif not delete:
+        pp.append(ln)  # Keep this line, others may be inserted next
+
+      if insert:  # Insert a list of lines, or just one line
+        # Avoid creating duplicate inserts if fixPart is run multiple times
+        firstInsert = insert if type(insert)==str else insert[0]
+        nextLn = lines[lnNo+1].rstrip('\r') if len(lines)>lnNo+1 else None
+        if nextLn!=firstInsert:
+          pp.extend(insert if type(insert)==list else [insert])
+        else:
+          logp("  (ignoring duplicate insertion edit request for: '"+firstInsert+"'")
+    else:
+      pp.append(ln)  # This is not the line you are looking for, just copy the file
+  return pp, found
 
 
 def getDateTime(iList, fn):
@@ -260,16 +336,22 @@ def fileDtTm(fid):
 
 def remoteFileDtTm(fid, tag=None):
   if tag == None: tag = fid
-  remDtTm = ["(noDate)", "(noTime)", 0]
   resp, rc = executeAdb("shell ls -l "+fid)
   if rc==0:
-    for ln in resp.split('\n'):
-      if ln.find(tag)>0:  # If this line of ls -l is the one for this file...
-        if ln.find("No such") != -1:
-          logp("    (remoteFile"+fid+" present ("+tag+"))")
-          break
-        sz, dt, tm, fn = ln.split(' ')[-4:]
-        remDtTm = [dt, tm, int(sz)]
+    return lsDtTm(resp, tag)
+  return ["(noDate)", "(noTime)", 0]
+
+
+def lsDtTm(resp, tag):
+  '''Return [date, time, size] of the file named tag... in device 'ls -l' output'''
+  remDtTm = ["(noDate)", "(noTime)", 0]
+  for ln in resp.split('\n'):
+    if ln.find(tag)>0:  # If this line of ls -l is the one for this file...
+      if ln.find("No such") != -1:
+        logp("    (remoteFile "+tag+" not present)")
+        break
+      sz, dt, tm, fn = ln.strip().split(' ')[-4:]
+      remDtTm = [dt, tm, int(sz)]
   return remDtTm
 
 
@@ -298,13 +380,15 @@ def executeAdbLog(cmd, showErr=True, ignore=None):
 def executeAdb(cmd, showErr=True, returnStr=True, log=False):
   '''Execute a command through ADB on android device, optionally specifying the TCP 
   host name (and optional port number).  Either do it with logging or without
+
+  How the command reaches the device depends on adbTransport(): 'native' does shell,
+  push and pull with adbClient (straight to the adb server socket), 'session' sends
+  'shell ...' commands through a long lived adbShell session for the device.  Anything
+  else (install, uninstall, reboot...) runs the adb program.
   '''
-  if 'arg' in sys.__dict__ and "host" in sys.arg:
-    host = sys.arg.host  # Was an explicity host device specified?
-    if host.find(':') == -1:
-      host += ":5555"
-  else:
-    host = ""
+  host = adbHost()
+  shellCmd = adbShellCmd(cmd)
+  tokens = list(cmd) if type(cmd) == list else [tt for tt in cmd.split(' ') if tt]
   if type(cmd) == list:
     cmd.insert(0, "adb")
     if host:
@@ -314,16 +398,585 @@ def executeAdb(cmd, showErr=True, returnStr=True, log=False):
     hostOpt = "-s "+host+" " if host else ""
     cmd = "adb "+hostOpt+cmd 
   
+  run = execute
+  transport = adbTransport()
+  if transport == "native" and tokens and tokens[0] in ("shell", "push", "pull"):
+    run = lambda cmd, showErr=True, returnStr=True: adbNative(host, tokens)
+  elif shellCmd and transport == "session":
+    run = lambda cmd, showErr=True, returnStr=True: adbSession(host).run(shellCmd)
+
   if log:
-    return executeLog(cmd, showErr, returnStr);
+    ret = executeLog(cmd, showErr, returnStr, run=run);
   else:
-    return execute(cmd, showErr, returnStr);
+    ret = run(cmd, showErr, returnStr);
+  if run==execute and tokens and tokens[0] in ("push", "pull"):
+    countFileXfer(tokens)
+  return ret
+
+
+def countFileXfer(tokens):
+  '''Count the bytes of an 'adb push/pull' run by the adb program (for perf.metrics)'''
+  fids = [tt for tt in tokens[1:] if tt[:1]!='-']
+  if len(fids)==0:
+    return
+  local = fids[0] if tokens[0]=="push" else (fids[1] if len(fids)>1 else '.')
+  if os.path.isdir(local):
+    local = os.path.join(local, os.path.basename(fids[0]))
+  if os.path.isfile(local):
+    perf.count("pushed" if tokens[0]=="push" else "pulled", os.path.getsize(local))
+
+
+def sysArg(name, default=None):
+  '''Return the value of a reviveMC74 name=value arg (in sys.arg), or default'''
+  if 'arg' in sys.__dict__ and name in sys.arg:
+    return sys.arg[name]
+  return default
+
+
+def adbHost():
+  '''Return the device name for 'adb -s', from the serial= or host= arg, or "" for the
+  only device
+  '''
+  if sysArg("serial"):  # A device serial number (ie from 'adb devices'), use as is
+    return sysArg("serial")
+  host = sysArg("host", "")  # Was an explicity host device specified?
+  if host and host.find(':') == -1:
+    host += ":5555"
+  return host
+
+
+def adbArgs():
+  '''Return the start of an adb command line (as a list) for the selected device'''
+  host = adbHost()
+  return ["adb", "-s", host] if host else ["adb"]
+
+
+def executeFastbootLog(cmd):
+  '''executeLog a fastboot command, for the serial= device if one was given'''
+  serial = sysArg("serial")
+  return executeLog("fastboot "+("-s "+serial+" " if serial else "")+cmd)
+
 
+def findDevLine(resp, searchStr):
+  '''findLine for 'adb devices' or 'fastboot devices' output, but only the line for the
+  serial= device if one was given (other devices may be attached)
+  '''
+  serial = sysArg("serial")
+  for line in resp.split('\n'):
+    if searchStr in line and (not serial or line.split('\t')[0]==serial):
+      return line
 
-def executeLog(cmd, showErr=True, ignore=None):
+
+def adbShellCmd(cmd):
+  '''If cmd is an 'adb shell ...' command, return the device side command string'''
+  if type(cmd) == list:
+    if len(cmd)>1 and cmd[0]=="shell":
+      return ' '.join(cmd[1:])
+  elif cmd[:6]=="shell ":
+    return cmd[6:].strip()
+  return None
+
+
+adbServerSeen = None  # (Not asked yet)
+def adbTransport():
+  '''Return how executeAdb reaches the device: the 'adb=' arg if given ('native',
+  'session' or 'exec'), else 'native' if the adb server was running when this was first
+  asked, else 'session' (for the whole run, an adb server started later doesn't change it)
+  '''
+  global adbServerSeen
+  transport = sysArg("adb")
+  if transport:
+    return transport
+  if adbServerSeen is None:
+    adbServerSeen = adbServerUp()
+  return "native" if adbServerSeen else "session"
+
+
+def adbNative(host, tokens):
+  '''Do an adb shell, push or pull command with adbClient, return (resp, rc)'''
+  cl = adbClient(host)
+  try:
+    if tokens[0] == "shell":
+      return cl.shell(' '.join(tokens[1:]))
+    paths = [tt for tt in tokens[1:] if tt[:1]!='-']
+    if tokens[0] == "pull" and len(paths) == 1:
+      paths.append('.')  # (Like adb pull, into the current directory)
+    if len(paths) < 2:
+      return "error: "+tokens[0]+" needs a source and a destination\n", 1
+    src, dst = paths[:2]
+    t0 = time.time()
+    cnt = cl.push(src, dst) if tokens[0] == "push" else cl.pull(src, dst)
+    perf.count("pushed" if tokens[0]=="push" else "pulled", cnt)
+    dt = max(time.time()-t0, 0.001)
+    return "%d KB/s (%d bytes in %.3fs)\n" % (cnt/1024/dt, cnt, dt), 0
+  except adbError as ex:
+    return "error: "+str(ex)+"\n", 1
+  except (IOError, OSError) as ex:
+    return "error: "+str(ex)+"\n", 1
+
+
+def adbExecOut(cmd, fid):
+  '''Run a device command, writing its (binary) stdout straight into a local file.  This
+  needs adbd's 'exec:' service (Android 5 and later).  Returns the number of bytes
+  written, or -1 if the device couldn't do it.
+  '''
+  try:
+    with open(fid, 'wb') as out:
+      if adbTransport() == "native":
+        cnt = adbClient(adbHost()).execOut(cmd, out)
+      else:
+        import subprocess
+        perf.countSpawn("adb")
+        rc = subprocess.call(adbArgs()+["exec-out", cmd], stdout=out,
+          stderr=subprocess.DEVNULL)
+        cnt = out.tell() if rc==0 else -1
+      perf.count("pulled", max(cnt, 0))
+      return cnt
+  except (adbError, IOError, OSError) as ex:
+    log("  adbExecOut '"+cmd+"' failed: "+str(ex))
+    return -1
+
+
+def adbExecIn(cmd, fid):
+  '''Run a device command with a local file as its stdin (adbd's 'exec:' service, like
+  adbExecOut).  Returns (bytes sent, output), bytes sent is -1 if it didn't work.
+  '''
+  try:
+    with open(fid, 'rb') as inp:
+      if adbTransport() == "native":
+        cnt, out = adbClient(adbHost()).execIn(cmd, inp)
+      else:
+        import subprocess
+        perf.countSpawn("adb")
+        proc = subprocess.Popen(adbArgs()+["exec-in", cmd], stdin=inp,
+          stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        out = proc.communicate()[0].decode("ISO-8859-1")
+        cnt = os.path.getsize(fid) if proc.returncode==0 else -1
+      perf.count("pushed", max(cnt, 0))
+      return cnt, out
+  except (adbError, IOError, OSError) as ex:
+    return -1, str(ex)
+
+
+def remoteMd5(fid, size=None):
+  '''Return the md5 of a device file (or partition), None if the device has no md5sum.
+  If size is given, only that many bytes from the start of the file are hashed.
+  '''
+  if size:  # Use the biggest dd block size that fits evenly in size
+    bs = [bb for bb in (65536, 4096, 512, 1) if size%bb==0][0]
+    resp, rc = executeAdb("shell dd if="+fid+" bs="+str(bs)+" count="+str(size//bs)
+      +" 2>/dev/null | md5sum")
+  else:
+    resp, rc = executeAdb("shell md5sum "+fid)
+  tok = resp.split() if type(resp)==str else resp.decode("ISO-8859-1").split()
+  if rc==0 and len(tok)>0 and len(tok[0])==32:
+    return tok[0].lower()
+  return None
+
+
+def remotePartSize(partFid):
+  '''Return the size in bytes of a device partition, from /sys/class/block (following
+  its by-name link, if it is one), None if it can't be found'''
+  # (An old toolbox readlink has no -f, and fails on a file that isn't a link)
+  resp, rc = executeAdb("shell d=$(readlink -f "+partFid+" || readlink "+partFid+" || echo "
+    +partFid+"); s=/sys/class/block/${d##*/}/size; [ -f $s ] && cat $s")
+  tok = resp.split() if type(resp)==str else resp.decode("ISO-8859-1").split()
+  if rc==0 and len(tok)==1 and tok[0].isdigit():
+    return int(tok[0])*512  # (sysfs sizes are in 512 byte sectors)
+  return None
+
+
+def md5File(fid):
+  '''Return the md5 hex digest of a local file'''
+  import hashlib
+  md5 = hashlib.md5()
+  with open(fid, 'rb') as ff:
+    for data in iter(lambda: ff.read(1024*1024), b""):
+      md5.update(data)
+  return md5.hexdigest()
+
+
+def md5Files(fids, threads=None):
+  '''Return a dict of fid: md5 for a list of local files, hashed across a pool of threads
+  (hashlib releases the GIL while hashing, so big files hash in parallel).  Fids that are
+  not files (directories, dangling symlinks) are left out.
+  '''
+  from concurrent.futures import ThreadPoolExecutor
+  fids = [fid for fid in fids if os.path.isfile(fid)]
+  if len(fids)==0:
+    return {}
+  with ThreadPoolExecutor(max_workers=threads or min(len(fids), (os.cpu_count() or 1)+4)
+      ) as pool:
+    return dict(zip(fids, pool.map(md5File, fids)))
+
+
+md5IndexFid = ".md5Index.json"
+def indexedMd5s(dir, fids):
+  '''Like md5Files, but remember the md5s in an index file in dir (an img* directory),
+  keyed by the file's path relative to dir, its size and mtime.  Only the files that are
+  new or whose size or mtime changed since the last call are hashed.
+  '''
+  import json
+  indexFid = os.path.join(dir, md5IndexFid)
+  try:
+    with open(indexFid) as ff:
+      index = json.load(ff)
+  except (IOError, ValueError):
+    index = {}
+
+  md5s, stale, stats = {}, [], {}
+  for fid in fids:
+    try:
+      st = os.stat(fid)
+    except OSError:
+      continue
+    if not os.path.isfile(fid):
+      continue
+    rel = os.path.relpath(fid, dir).replace(os.sep, '/')
+    stats[rel] = [st.st_size, st.st_mtime_ns]
+    ent = index.get(rel)
+    if ent and ent[:2]==stats[rel]:
+      md5s[fid] = ent[2]
+    else:
+      stale.append(fid)
+
+  new = md5Files(stale)
+  md5s.update(new)
+  if new or set(index)-set(stats):  # Rewrite the index if anything changed
+    index = {}
+    for fid, md5 in md5s.items():
+      rel = os.path.relpath(fid, dir).replace(os.sep, '/')
+      index[rel] = stats[rel]+[md5]
+    try:
+      with open(indexFid+".tmp", 'w') as ff:
+        json.dump(index, ff, sort_keys=True)
+      os.replace(indexFid+".tmp", indexFid)
+    except (IOError, OSError) as err:
+      log("  (can't write "+indexFid+": "+str(err)+")")
+  return md5s
+
+
+def streamPartBackup(partFid, fid):
+  '''Copy a device partition straight into a local file, rather than dd'ing it into
+  /cache and pulling that, then check the copy's md5 against the partition's (or, with no
+  md5sum on the device, its size).  Returns False (leaving no file) if the device can't
+  stream or the copy doesn't match.
+  '''
+  logp("  streaming "+partFid+" to "+fid)
+  cnt = adbExecOut("dd if="+partFid+" bs=65536 2>/dev/null", fid+".part")
+  if cnt<=0:
+    logp("    (device can't stream the partition, copying it through /cache)")
+    removeFile(fid+".part")
+    return False
+
+  partMd5 = remoteMd5(partFid)
+  fileMd5 = md5File(fid+".part")
+  if partMd5 and partMd5!=fileMd5:
+    logp("  !! "+fid+" md5 "+fileMd5+" does not match "+partFid+" md5 "+partMd5)
+    removeFile(fid+".part")
+    return False
+  if not partMd5:  # Then at least the copy must be the partition's size
+    partSize = remotePartSize(partFid)
+    if partSize!=cnt:
+      logp("    (no md5sum on device, streamed "+str(cnt)+" bytes of "+partFid+", size "
+        +str(partSize)+", copying it through /cache)")
+      removeFile(fid+".part")
+      return False
+  logp("    "+str(cnt)+" bytes, md5 "+fileMd5+(" (verified)" if partMd5
+    else " (no md5sum on device, size checked)"))
+  removeFile(fid)
+  os.rename(fid+".part", fid)
+  return True
+
+
+def streamPartFlash(fid, partFids):
+  '''Write a local image file straight into one or more device partitions in one pass
+  (the stream is tee'd to any extra partitions), rather than pushing it to /cache and
+  dd'ing it from there.  Each partition is then checked against the file's md5 (or,
+  with no md5sum on the device, dd must report writing all of the file).  Returns False
+  if the device can't stream or a partition doesn't match or can't be checked, the
+  caller should then write it the old way.
+  '''
+  size = os.path.getsize(fid)
+  cmd = "dd of="+partFids[0]+" bs=65536 2>&1"
+  for pf in partFids[1:]:
+    cmd = "tee "+pf+" | "+cmd
+  logp("  streaming "+fid+" to "+', '.join(partFids))
+  cnt, resp = adbExecIn(cmd, fid)
+  if cnt<size:
+    logp("    (device can't stream to the partition, copying it through /cache)")
+    return False
+
+  fileMd5 = md5File(fid)
+  wrote = ddBytes(resp)
+  for pf in partFids:
+    partMd5 = remoteMd5(pf, size)
+    if partMd5 and partMd5!=fileMd5:  # dd may still be finishing, wait and check again
+      executeAdb("shell sync")
+      perf.sleep(1)
+      partMd5 = remoteMd5(pf, size)
+    if partMd5 and partMd5!=fileMd5:
+      logp("  !! "+pf+" md5 "+partMd5+" does not match "+fid+" md5 "+fileMd5)
+      return False
+    # With no md5sum, dd must say it wrote all of the file (a tee'd partition can't be
+    # checked at all)
+    if not partMd5 and (pf!=partFids[0] or wrote!=size):
+      logp("    (no md5sum on device, "+("dd wrote "+str(wrote)+" of "+str(size)
+        +" bytes" if pf==partFids[0] else "can't check "+pf)+", writing it through /cache)")
+      return False
+    logp("    "+pf+": "+str(size)+" bytes, md5 "+fileMd5+(" (verified)" if partMd5
+      else " (no md5sum on device, dd wrote "+str(wrote)+" bytes)"))
+  return True
+
+
+def ddBytes(resp):
+  '''Return the bytes dd says it wrote ('8388608 bytes transferred...' or '... copied'),
+  None if its output doesn't say'''
+  import re
+  resp = resp if type(resp)==str else resp.decode("ISO-8859-1")
+  mm = re.search(r"(\d+) bytes", resp)
+  return int(mm.group(1)) if mm else None
+
+
+deltaBlock = 65536  # Block size for comparing an image with a partition's contents
+adbCmdMax = 4000  # (adbd truncates a shell command line longer than 4096 bytes)
+def shellLoops(head, items, tail, limit=adbCmdMax):
+  '''Return shell commands head+' '.join(items)+tail, splitting items among as many
+  commands as needed to keep each one under limit bytes'''
+  cmds, cur = [], []
+  for it in items:
+    if cur and len(head)+len(' '.join(cur))+len(it)+1+len(tail)>limit:
+      cmds.append(head+' '.join(cur)+tail)
+      cur = []
+    cur.append(it)
+  if cur:
+    cmds.append(head+' '.join(cur)+tail)
+  return cmds
+
+
+def remoteBlockMd5s(partFid, blocks, bs=deltaBlock):
+  '''Return a dict of block number: md5 for a list of bs sized blocks of a device
+  partition, hashed by device side shell loops.  None if the device can't do it.
+  '''
+  md5s = {}
+  for cmd in shellLoops("for i in ", [str(bb) for bb in blocks], "; do echo blk$i"
+      " $(dd if="+partFid+" bs="+str(bs)+" skip=$i count=1 2>/dev/null | md5sum); done"):
+    resp, rc = executeAdb("shell "+cmd)
+    if type(resp)==bytes:
+      resp = resp.decode("ISO-8859-1")
+    for ln in resp.split('\n'):
+      tok = ln.split()
+      if len(tok)>1 and tok[0][:3]=="blk" and len(tok[1])==32:
+        md5s[int(tok[0][3:])] = tok[1].lower()
+  return md5s if len(md5s)==len(blocks) else None
+
+
+def deltaPartFlash(fid, partFids, bs=deltaBlock):
+  '''Write only the blocks of a local image that differ from the device partition(s)
+  contents.  The partitions' blocks are hashed on the device and compared with the
+  file's, the differing blocks are pushed to /cache as one small file, dd'd into place,
+  then rehashed to verify.  Returns False if the device can't hash its blocks or most
+  blocks differ (the caller should do a full flash).
+  '''
+  with open(fid, 'rb') as ff:
+    data = ff.read()
+  import hashlib
+  nBlk = (len(data)+bs-1)//bs
+  fileMd5s = [hashlib.md5(data[ii*bs:(ii+1)*bs]).hexdigest() for ii in range(0, nBlk)]
+  full = len(data)//bs  # (A partial last block is always written)
+
+  changed = {}  # partFid: list of block numbers to write
+  for pf in partFids:
+    partMd5s = remoteBlockMd5s(pf, list(range(0, full)), bs)
+    if partMd5s is None:
+      logp("    (can't hash "+pf+" blocks on the device, doing a full flash)")
+      return False
+    changed[pf] = [ii for ii in range(0, nBlk) if ii>=full or partMd5s[ii]!=fileMd5s[ii]]
+  blocks = sorted(set(sum(changed.values(), [])))
+  if len(blocks)*2>nBlk:
+    logp("    ("+str(len(blocks))+" of "+str(nBlk)+" blocks differ, doing a full flash)")
+    return False
+  logp("  delta flash "+fid+": "+', '.join([pf+" "+str(len(changed[pf]))+"/"+str(nBlk)
+    for pf in partFids])+" blocks differ")
+
+  if len(blocks)>0:
+    deltaFid = "rmcDelta.bin"
+    with open(deltaFid, 'wb') as ff:
+      for ii in blocks:
+        ff.write(data[ii*bs:(ii+1)*bs])
+    resp, rc = executeAdbLog("push "+deltaFid+" /cache/"+deltaFid)
+    removeFile(deltaFid)
+    if rc!=0:
+      return False
+    # Each partition's blocks are written by a shell loop over 'delta block:partition
+    # block' pairs, any dd that fails echoes the pair
+    where = dict((ii, nn) for nn, ii in enumerate(blocks))  # block: its delta file block
+    failed = []
+    for pf in partFids:
+      for cmd in shellLoops("for p in ", ["%d:%d" % (where[ii], ii) for ii in changed[pf]],
+          "; do dd if=/cache/"+deltaFid+" of="+pf+" bs="+str(bs)+" skip=${p%:*}"
+          " seek=${p#*:} count=1 conv=notrunc 2>/dev/null || echo ddFailed $p; done"):
+        resp, rc = executeAdbLog("shell "+cmd)
+        resp = resp if type(resp)==str else resp.decode("ISO-8859-1")
+        if rc!=0 or resp.find("ddFailed")!=-1:
+          failed.append(pf)
+          break
+    executeAdbLog("shell rm /cache/"+deltaFid+"; sync")
+    if failed:
+      logp("  !! writing the delta blocks to "+', '.join(failed)+" failed")
+      return False
+
+  # Verify the blocks we wrote (all but a partial last block, which can't be hashed alone)
+  for pf in partFids:
+    check = [ii for ii in changed[pf] if ii<full]
+    if len(check)>0:
+      partMd5s = remoteBlockMd5s(pf, check, bs)
+      bad = [ii for ii in check if partMd5s is None or partMd5s[ii]!=fileMd5s[ii]]
+      if len(bad)>0:
+        logp("  !! "+pf+" blocks "+str(bad)+" don't match "+fid+" after the delta flash")
+        return False
+  if full<nBlk:
+    for pf in partFids:
+      partMd5 = remoteMd5(pf, len(data))
+      if partMd5 and partMd5!=md5File(fid):
+        logp("  !! "+pf+" does not match "+fid+" after the delta flash")
+        return False
+  return True
+
+
+def removeFile(fid):
+  try:
+    os.remove(fid)
+  except OSError:
+    pass
+
+
+class adbShell:
+  '''A long lived 'adb shell' process to one device.  Commands are written to its stdin,
+  each one framed by marker lines echoed before and after it, which lets us pick the
+  command's output and exit code out of the shell's stdout.  This avoids starting an adb
+  client (and a device side shell) for every command.
+  '''
+  timeout = 300  # Seconds without any output before a command is given up on
+
+  def __init__(self, host=""):
+    self.host = host
+    self.proc = None
+    self.lines = None
+    self.seq = 0
+    self.lock = threading.Lock()
+
+
+  def start(self):
+    import subprocess
+    cmd = ["adb", "-s", self.host, "shell"] if self.host else ["adb", "shell"]
+    perf.countSpawn(cmd)
+    self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+      stderr=subprocess.STDOUT)
+    # The shell's stdout is read by a thread, so run() can wait for it with a timeout
+    self.lines = queue.Queue()
+    def reader(out, lines):
+      for ln in iter(out.readline, b""):
+        lines.put(ln)
+      lines.put(None)  # (The shell exited)
+    th = threading.Thread(target=reader, args=(self.proc.stdout, self.lines),
+      name="adbShell "+self.host)
+    th.daemon = True
+    th.start()
+
+
+  def readLine(self):
+    '''Return the shell's next output line (bytes), None if it exited, or False if there
+    was no output for timeout seconds (then the shell is killed)'''
+    try:
+      return self.lines.get(timeout=self.timeout)
+    except queue.Empty:
+      self.proc.kill()
+      return False
+
+
+  def close(self):
+    if self.proc and self.proc.poll() is None:
+      try:
+        self.proc.stdin.write(b"exit\n")
+        self.proc.stdin.close()
+        self.proc.wait(5)
+      except Exception:
+        self.proc.kill()
+    self.proc = None
+
+
+  def run(self, cmd):
+    '''Run cmd in the device shell, return (output, rc) like ribou.execute'''
+    with self.lock:
+      for attempt in range(0, 2):  # The device may have rebooted, then restart once
+        if self.proc is None or self.proc.poll() is not None:
+          self.start()
+        self.seq += 1
+        tag = "rmc%d_%d" % (os.getpid(), self.seq)
+        # The '' in the echo args keep a tty echo of this line from matching the markers
+        line = "echo ''%s''S; (%s) 2>&1; echo ''%s''E $?\n" % (tag, cmd, tag)
+        try:
+          self.proc.stdin.write(line.encode("ISO-8859-1"))
+          self.proc.stdin.flush()
+        except (IOError, OSError):
+          pass  # (The shell exited, read whatever it said)
+
+        out, pre = [], []  # Output lines of the command, and any before its S marker
+        started = False
+        while True:
+          ln = self.readLine()
+          if not ln:  # Shell exited (the device rebooted or went away, or has no sh)
+            self.proc = None
+            msg = [] if ln is None else ["error: adb shell to '"+self.host+"' timed out"
+              " after "+str(self.timeout)+"s"]
+            if started:
+              return '\n'.join(out+msg)+'\n', -1
+            if pre or msg:  # (ie "exec '/system/bin/sh' failed: No such file")
+              return '\n'.join(pre+msg)+'\n', -1
+            break
+          ln = ln.decode("ISO-8859-1").rstrip('\r\n')
+          if not started:
+            started = ln.find(tag+'S')!=-1
+            if not started and ln:
+              pre.append(ln)
+          elif ln.find(tag+'E ')!=-1:
+            idx = ln.find(tag+'E ')
+            try:
+              rc = int(ln[idx+len(tag)+2:].split()[0])
+            except (ValueError, IndexError):
+              rc = -1
+            # (Output that didn't end with a newline is on the marker's line)
+            return '\n'.join(out)+('\n' if out else '')+ln[:idx], rc
+          else:
+            out.append(ln)
+    return "error: adb shell session to '"+self.host+"' failed\n", -1
+
+
+adbSessions = {}  # adbShell sessions, by host name ("" is the only attached device)
+def adbSession(host=""):
+  '''Return the adbShell session for a device, starting it if needed'''
+  with adbSessionsLock:
+    if host not in adbSessions:
+      adbSessions[host] = adbShell(host)
+    return adbSessions[host]
+adbSessionsLock = threading.Lock()
+
+
+def closeAdbSessions():
+  for sess in list(adbSessions.values()):
+    sess.close()
+  adbSessions.clear()
+atexit.register(closeAdbSessions)
+
+
+def executeLog(cmd, showErr=True, ignore=None, run=None):
     '''Execute an operating system command and log the command and response'''
     print("    Executing: '" + str(cmd) + "'")
-    ret = execute(cmd, showErr)
+    t0 = time.time()
+    ret = (run or execute)(cmd, showErr)
+    getRunLog().record("cmd", cmd=' '.join(cmd) if type(cmd)==list else str(cmd),
+      rc=ret[1], secs=round(time.time()-t0, 3), bytes=len(ret[0] or ""))
     
     # Ensure ret[0] is a string
     if isinstance(ret[0], bytes):
@@ -344,12 +997,21 @@ def executeLog(cmd, showErr=True, ignore=None):
 
 
 def log(msg, prefix=""):
-  fp = open(logFid, 'ab')
-  if prefix:
-    fp.write(str.encode(prefix))  # Usually used to prefix line with a \n LF
+  # prefix is usually used to prefix line with a \n LF
   ts = datetime.datetime.now().strftime("%y/%m/%d-%H:%M:%S")
-  fp.write(str.encode(ts+" "+msg+'\n'))
-  fp.close()
+  getRunLog().text(prefix+ts+" "+msg+'\n')
+
+
+theRunLog = None
+def getRunLog():
+  '''The runLog (buffered text and JSON lines logs) for this process'''
+  global theRunLog
+  if theRunLog is None:
+    theRunLog = runLog(logFid, logFid[:-4]+".jsonl")
+    theRunLog.context.update(pid=os.getpid(), serial=sysArg('serial') or adbHost())
+    theRunLog.maxBytes = int(float(sysArg('logMax', 10))*1024*1024)
+    installCrashHook(theRunLog)
+  return theRunLog
 
 
 def logp(msg, prefix=""):
@@ -427,14 +1089,9 @@ def dbSetCell(dbFile, tblName, selColName, selColVal, colName, colVal):
   '''Update one column in one row of an SQL DB table.
   ie: dbSetCell(ldb, "allapps", "title", "wPhone", "title", "MC74")
   '''
-  if type(selColVal) == str:
-    selColVal = "'"+selColVal+"'"  # sqlCmd will be wrapped in double quotes
-  if type(colVal) == str:
-    colVal = "'"+colVal+"'"  # sqlCmd will be wrapped in double quotes
-  sqlCmd = "update %s set %s=%s where %s=%s" % (tblName, colName, colVal,
-    selColName, selColVal)
+  sqlCmd = sqlSetCell(tblName, selColName, selColVal, colName, colVal)
   print("-- "+sqlCmd+"; --")
-  resp, rc = executeAdb(["shell", "sqlite3", dbFile, '"'+sqlCmd+'"'])
+  resp, rc = executeAdb(["shell", "sqlite3", dbFile, '"'+shellQuote(sqlCmd)+'"'])
   return resp
 
 
@@ -442,34 +1099,271 @@ def dbAddRow(dbFile, tblName, vals):
   '''Add a row to an SQL DB table, where the values for the row are in a bunch/dict
   ie: dbAddRow(ldb, "allapps", bunch(_id=1, title="Clock", cellX=2, cellY=1))
   '''
-  
-  names = ", ".join(vals.keys())
-  values = []
-  for nm in vals.keys():
-    vv = vals[nm]
-    vv = "'"+str(vv)+"'"
-    values.append(vv)
-  values = ", ".join(values)
-  
-  sqlCmd = "insert into %s (%s) values (%s)" % (tblName, names, values)
+  sqlCmd = sqlAddRow(tblName, vals)
   print("-- "+sqlCmd+"; --")
   
-  resp, rc = executeAdb(["shell", "sqlite3", dbFile, '"'+sqlCmd+'"'])
+  resp, rc = executeAdb(["shell", "sqlite3", dbFile, '"'+shellQuote(sqlCmd)+'"'])
   return resp
 
 
+def sqlValue(vv, quote=False):
+  '''An SQL literal for a value: strings (or anything, if quote) in single quotes'''
+  if type(vv)==str or quote:
+    return "'"+str(vv).replace("'", "''")+"'"
+  return str(vv)
+
+
+def sqlSetCell(tblName, selColName, selColVal, colName, colVal):
+  return "update %s set %s=%s where %s=%s" % (tblName, colName, sqlValue(colVal),
+    selColName, sqlValue(selColVal))
+
+
+def sqlAddRow(tblName, vals):
+  return "insert into %s (%s) values (%s)" % (tblName, ", ".join(vals.keys()),
+    ", ".join([sqlValue(vals[nm], True) for nm in vals.keys()]))
+
+
+def shellQuote(ss):
+  '''Escape a string to go inside "..." on the device's shell command line'''
+  for ch in '\\"$`':
+    ss = ss.replace(ch, '\\'+ch)
+  return ss
+
+
+class dbBatch:
+  '''Collect SQL statements for an android database, then run them all with one sqlite3
+  command, in one transaction: if any statement fails, sqlite3 stops and none of them
+  are applied.
+  ie: bb = dbBatch(ldb);  bb.setCell("favorites", "_id", 1, "hotSeatRank", 0)
+      bb.cmd("delete from favorites where title='Google'");  res = bb.run()
+  '''
+  marker = "#dbBatch"
+
+  def __init__(self, dbFile):
+    self.dbFile = dbFile
+    self.stmts = []  # (sql, params), sql has a '?' for each param
+
+
+  def cmd(self, sqlCmd, params=()):
+    self.stmts.append((sqlCmd, tuple(params)))
+    return len(self.stmts)-1  # The statement's index in run()'s results
+
+
+  def setCell(self, tblName, selColName, selColVal, colName, colVal):
+    return self.cmd("update %s set %s=? where %s=?" % (tblName, colName, selColName),
+      (colVal, selColVal))
+
+
+  def addRow(self, tblName, vals):
+    names = list(vals.keys())
+    return self.cmd("insert into %s (%s) values (%s)" % (tblName, ", ".join(names),
+      ", ".join(['?']*len(names))), [str(vals[nm]) for nm in names])
+
+
+  def text(self, ii):
+    '''Statement ii as SQL text, with its params as literals (for the sqlite3 program)'''
+    sqlCmd, params = self.stmts[ii]
+    if len(params)==0:
+      return sqlCmd
+    parts = sqlCmd.split('?')
+    return parts[0]+''.join([sqlValue(pp)+part for pp, part in zip(params, parts[1:])])
+
+
+  def script(self):
+    '''The SQL for the batch: after each statement, a select prints a marker line with
+    the statement's number and changes() (the rows it changed), and after the COMMIT a
+    '<marker> commit' line'''
+    sql = ["BEGIN"]
+    for ii in range(0, len(self.stmts)):
+      sql.append(self.text(ii))
+      sql.append("select '%s %d '||changes()" % (self.marker, ii))
+    sql.append("COMMIT")
+    sql.append("select '%s commit'" % self.marker)
+    return ";\n".join(sql)+";"
+
+
+  def run(self):
+    '''Run the statements, return a bunch(ok, resp, results), results has a
+    bunch(sql, ok, changes, rows (output lines)) for each statement'''
+    results = [bunch(sql=self.text(ii), ok=False, changes=None, rows=[])
+      for ii in range(0, len(self.stmts))]
+    for res in results:
+      print("-- "+res.sql+"; --")
+    resp, rc = executeAdb(["shell", "sqlite3", "-bail", self.dbFile,
+      '"'+shellQuote(self.script())+'"'])
+    resp = resp if type(resp)==str else resp.decode("ISO-8859-1")
+    rows, errors, committed = [], [], False
+    for ln in resp.replace('\r', '').split('\n'):
+      tok = ln.split(' ')
+      if ln==self.marker+" commit":
+        committed = True
+      elif len(tok)==3 and tok[0]==self.marker:
+        res = results[int(tok[1])]
+        res.ok, res.changes, res.rows = True, int(tok[2]), rows
+        rows = []
+      elif ln[:6]=="Error:":  # (stderr, may come out ahead of the statement's stdout)
+        errors.append(ln)
+      elif ln:
+        rows.append(ln)
+    ok = committed and rc==0 and all(res.ok for res in results)
+    if not ok:
+      # The first statement without a marker failed (sqlite3 stopped there, -bail), or
+      # if they all have one, the COMMIT did (ie 'database is locked')
+      failed = [res for res in results if not res.ok]
+      if failed:
+        failed[0].rows = rows+errors
+      elif results:
+        results[-1].rows = results[-1].rows+rows+errors+["(COMMIT failed, rc=%d)" % rc]
+      for res in results:  # (Nothing was committed, the ones before it were rolled back)
+        res.ok, res.changes = False, None
+      logp("  !! dbBatch on "+self.dbFile+" failed, no changes made: "+' '.join(rows+errors))
+    self.stmts = []
+    return bunch(ok=ok, resp=resp, results=results)
+
+
+  def runLocal(self, conn):
+    '''Run the statements, with their params, in one transaction on a (local) python
+    sqlite3 connection.  Returns a bunch(ok, results) like run()'''
+    import sqlite3
+    results = [bunch(sql=self.text(ii), ok=False, changes=None, rows=[])
+      for ii in range(0, len(self.stmts))]
+    try:
+      with conn:  # Commits, or rolls back on an exception
+        for (sqlCmd, params), res in zip(self.stmts, results):
+          try:
+            cur = conn.execute(sqlCmd, params)
+          except sqlite3.Error as err:
+            res.rows = ["Error: "+str(err)]
+            raise
+          res.rows = ['|'.join(["" if vv is None else str(vv) for vv in row])
+            for row in cur.fetchall()]
+          res.ok, res.changes = True, max(cur.rowcount, 0)
+    except sqlite3.Error as err:
+      logp("  !! dbBatch on "+self.dbFile+" failed, no changes made: "+str(err))
+      for res in results:
+        res.ok, res.changes = False, None
+    self.stmts = []
+    return bunch(ok=all(res.ok for res in results), results=results)
+
+
+def dbOffline(dbFile, batch, golden=None, owner=None):
+  '''Pull an android database, apply a dbBatch to it (or, if the golden JSON file
+  exists, replace the favorites table with golden's rows) with python's sqlite3, then
+  push it back with its owner and mode.  If golden is given but doesn't exist, the
+  patched favorites table is saved to it, to be applied to other phones.  The app
+  using the database should be stopped first.  A -wal file is pulled with the database
+  and checkpointed into it, the device's -wal, -shm and -journal files are removed when
+  the patched database replaces it.  Returns a bunch(ok, results), ok only if the
+  database on the device was replaced.
+  '''
+  import sqlite3, json
+  localFid = os.path.basename(dbFile)+".offline"
+  devOwner, mode = remoteOwnerMode(dbFile)
+  if owner is None:
+    owner = devOwner
+  for fid in (localFid, localFid+"-wal", localFid+"-shm"):
+    removeFile(fid)
+  resp, rc = executeAdbLog("pull "+dbFile+" "+localFid)
+  if not os.path.isfile(localFid):
+    logp("  !! Can't pull "+dbFile)
+    return bunch(ok=False, results=[])
+  # (Committed changes of a WAL mode database may still be in its -wal, if there is one)
+  resp, rc = executeAdb("pull "+dbFile+"-wal "+localFid+"-wal")
+
+  conn = sqlite3.connect(localFid)
+  gold = readGolden(golden) if golden and os.path.isfile(golden) else None
+  if gold:
+    batch.stmts = []
+    batch.cmd("delete from "+gold['table'])
+    for row in gold['rows']:
+      batch.cmd("insert into %s (%s) values (%s)" % (gold['table'], ", ".join(
+        gold['columns']), ", ".join(['?']*len(row))), row)
+    logp("  -- applying "+golden+", "+str(len(gold['rows']))+" "+gold['table']+" rows")
+  res = batch.runLocal(conn)
+  if res.ok and golden and not gold:
+    cur = conn.execute("select * from favorites order by _id")
+    writeGolden(golden, "favorites", [dd[0] for dd in cur.description], cur.fetchall())
+    logp("  -- saved the patched favorites table to "+golden)
+  conn.execute("pragma wal_checkpoint(TRUNCATE)")  # (All of it in localFid, if WAL)
+  conn.close()
+
+  if res.ok:
+    # Push to a new name, then replace the database (and its stale -wal...) in one step
+    newFid = dbFile+".rmcNew"
+    resp, rc = executeAdbLog("push "+localFid+" "+newFid)
+    if rc==0:
+      resp, rc = executeAdbLog("shell rm -f "+dbFile+"-wal "+dbFile+"-shm "+dbFile
+        +"-journal && mv "+newFid+" "+dbFile+(" && chown "+owner+" "+dbFile if owner
+        else "")+" && chmod "+(mode or "660")+" "+dbFile+" && echo rmcReplaced")
+      resp = resp if type(resp)==str else resp.decode("ISO-8859-1")
+      if rc!=0 or resp.find("rmcReplaced")==-1:
+        rc = rc or -1
+    if rc!=0:
+      executeAdb("shell rm -f "+newFid)
+      logp("  !! Can't put the patched "+dbFile+" back on the device, it is unchanged")
+      for rr in res.results:
+        rr.ok, rr.changes = False, None
+      res.ok = False
+  for fid in (localFid, localFid+"-wal", localFid+"-shm"):
+    removeFile(fid)
+  return res
+
+
+def writeGolden(golden, table, columns, rows):
+  '''Save a table's rows as JSON (BLOBs, ie icons, as {"base64": ...}), written to a
+  temp file then renamed, so a failure can't leave half a golden file'''
+  import json, base64
+  rows = [[{"base64": base64.b64encode(bytes(vv)).decode("ascii")}
+    if isinstance(vv, (bytes, bytearray, memoryview)) else vv for vv in row] for row in rows]
+  tmp = golden+".%d.tmp" % os.getpid()
+  with open(tmp, 'w') as ff:
+    json.dump({"table": table, "columns": columns, "rows": rows}, ff, indent=1)
+  os.replace(tmp, golden)
+
+
+def readGolden(golden):
+  '''Return a golden file's {table, columns, rows} (BLOBs back to bytes), or None (and a
+  warning) if it is unreadable or corrupt, then it will be rewritten'''
+  import json, base64
+  try:
+    with open(golden) as ff:
+      gold = json.load(ff)
+    if not all(kk in gold for kk in ("table", "columns", "rows")):
+      raise ValueError("no table, columns or rows")
+    gold['rows'] = [[base64.b64decode(vv["base64"]) if isinstance(vv, dict) else vv
+      for vv in row] for row in gold['rows']]
+    return gold
+  except (IOError, OSError, ValueError, KeyError, TypeError) as err:
+    logp("  -- ignoring corrupt "+golden+" ("+str(err)+"), it will be saved again")
+    return None
+
+
+def remoteOwnerMode(fid):
+  '''Return ('user:group', mode (octal str, ie '660')) of a device file, from 'ls -l'
+  (toolbox's, or toybox's with a link count), or (None, None)'''
+  resp, rc = executeAdb("shell ls -l "+fid)
+  resp = resp if type(resp)==str else resp.decode("ISO-8859-1")
+  tok = resp.split()
+  if rc==0 and len(tok)>4 and tok[0][:1]=='-' and len(tok[0])>=10:
+    ii = 2 if tok[1].isdigit() else 1
+    mode = 0
+    for ch in tok[0][1:10]:
+      mode = mode*2+(ch not in "-ST")
+    return tok[ii]+':'+tok[ii+1], "%o" % mode
+  return None, None
+
+
 ldb = "/data/data/com.teslacoilsw.launcher/databases/launcher.db"  # for testing
 def initLauncher():
   ldb = "/data/data/com.teslacoilsw.launcher/databases/launcher.db"
   mcComp = "revive.MC74/org.linphone.activities.LinphoneLauncherActivity"
   favInt = "#Intent;action=android.intent.action.MAIN;category=android.intent.category.LAUNCHER;launchFlags=0x10200000;component=%s;end"
   # Switch the Phone favorite in the upper right (dock position 0) to reviveMC74
+  batch = dbBatch(ldb)  # All the changes are made at once, or not at all
   print("\nSwitch Phone favorite to reviveMC74")
-  resp = dbSetCell(ldb, "favorites", "title", "Phone", "intent", favInt % mcComp)
-  print(resp)
+  batch.setCell("favorites", "title", "Phone", "intent", favInt % mcComp)
   print("\nMove Show Apps icon to lower right")
-  resp = dbSetCell(ldb, "favorites", "_id", 1, "hotSeatRank", 0)
-  print(resp)
+  batch.setCell("favorites", "_id", 1, "hotSeatRank", 0)
   
   favRow = bunch(flingAsTap= 'false', itemType= '0', appWidgetId= '-1',
     zOrder= '0', iconType= '2', container= '-100', spanX= '1.0', spanY= '1.0',
@@ -478,44 +1372,50 @@ def initLauncher():
   
   logp("phone row: "+str(favRow))
   
-  resp = dbCmd(ldb, "delete from favorites where _id>=12 and _id<=14")
-  print(resp)
+  batch.cmd("delete from favorites where _id>=12 and _id<=14")
   
   print("\nAdd dolphin Browser favorite:")
   dolphComp = "mobi.mgeek.TunnyBrowser/.SplashActivity"
   favRow.update(_id=12, cellX=0.0, title='Browser', intent=favInt % dolphComp, 
     iconResource="mobi.mgeek.TunnyBrowser/.SplashActivity")
-  resp = dbAddRow(ldb, "favorites", favRow)
-  print(resp)
+  batch.addRow("favorites", favRow)
   
   print("\nAdd magicEarth/Map favorite:")
   earthComp = "com.generalmagic.magicearth/com.generalmagic.android.map.MapActivity;l.profile=0"
   favRow.update(_id=13, cellX=1.0, title='Maps', intent=favInt % earthComp,
     iconResource="com.generalmagic.magicearth/com.generalmagic.android.map.MapActivity")
-  resp = dbAddRow(ldb, "favorites", favRow)
-  print(resp)
+  batch.addRow("favorites", favRow)
   
   print("\nAdd riboVideo favorite:")
   VPComp = "ribo.vp/.VPcontrol"
   favRow.update(_id=14, cellX=2.0, title='riboVideo', intent=favInt % VPComp,
     iconResource="ribo.vp/.VPcontrol")
-  resp = dbAddRow(ldb, "favorites", favRow)
-  print(resp)
+  batch.addRow("favorites", favRow)
   
   # Remove the 'Google' and 'Create' folder icons, and the side Google search bar
-  resp = dbCmd(ldb, "delete from favorites where title='Google'")
-  print(resp)
-  resp = dbCmd(ldb, "delete from favorites where title='Create'")
-  print(resp)
-  resp = dbCmd(ldb, "delete from favorites where spanX=5.0")  # The Google search bar, no title
-  print(resp)
+  batch.cmd("delete from favorites where title='Google'")
+  batch.cmd("delete from favorites where title='Create'")
+  batch.cmd("delete from favorites where spanX=5.0")  # The Google search bar, no title
+
+  if sysArg('launcherDb')=="offline":  # Patch a pulled copy of launcher.db with python
+    logp("  Killing com.teslacoilsw.launcher... so it leaves launcher.db alone")
+    executeAdb("shell am force-stop com.teslacoilsw.launcher")
+    res = dbOffline(ldb, batch, sysArg('launcherGolden'))
+  else:
+    res = batch.run()
+  for rr in res.results:
+    print("  %-5s %4s  %s%s" % ("ok" if rr.ok else "FAIL", rr.changes if rr.ok else "",
+      rr.sql[:70], ''.join(["\n        "+ln for ln in rr.rows])))
+  if not res.ok:
+    return False
 
   # Restart the Nova Launcher so it reads the updated database
   logp("  Killing com.teslacoilsw.launcher... to restart it")
   executeAdb("shell am force-stop com.teslacoilsw.launcher")
   logp("Restarting com.teslacoilsw.launcher")
   executeAdb("shell am start com.teslacoilsw.launcher")
- 
+  return True
+
 
 def btest():
   try:
@@ -532,8 +1432,8 @@ def gr(rowNo):
   return dbGetRow(ldb, "favorites", "_id", rowNo)
 
 def cmpb(ba, bb):
-  baNames = ba.keys();  baNames.sort()
-  bbNames = bb.keys();  bbNames.sort()
+  baNames = sorted(ba.keys())
+  bbNames = sorted(bb.keys())
   notInB = []
   
   for nm in baNames:
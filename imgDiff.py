@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+'''imgDiff -- Structural diff of unpacked boot images (img* directories made by
+  'examImg.py <img>'), as text or JSON.
+
+  imgDiff.py [json] [imgDir...]     (default: all img* directories in the cwd)
+
+  Each image is a tree of files: 'img' (the image file itself, rmcBoot.<dir>),
+  'unpack/...' (rmcBootUnpack) and 'ramdisk/...' (rmcBootRamdisk).  The trees of all
+  the images are walked in sorted order at the same time and merged, so only the
+  current path of each tree is in memory, no matter how many images or files.  Each
+  path is compared to the first (reference) image: 'added' (not in the reference),
+  'removed' (not in this image) or 'changed' (different size, md5 or symlink target).
+  For changed text files (default.prop, init.rc...) the changed lines are reported too.
+'''
+import sys, os, stat, json, heapq, difflib
+from ribou import bunch
+
+textMax = 1024*1024  # Bigger files are not line diff'd
+lineMax = 200  # Max changed lines reported per file
+
+
+def imgTree(dir):
+  '''Generate (key, path) for each file (and symlink) of an unpacked image directory,
+  sorted by key, a tuple of path components, ie ('ramdisk', 'sbin', 'adbd')
+  '''
+  name = os.path.basename(os.path.normpath(dir))
+  sub = {"img": os.path.join(dir, "rmcBoot."+name),
+    "ramdisk": os.path.join(dir, "rmcBootRamdisk"),
+    "unpack": os.path.join(dir, "rmcBootUnpack")}
+  for top in sorted(sub):
+    if top=="img":
+      if os.path.isfile(sub[top]):
+        yield ("img",), sub[top]
+    else:
+      for key, path in walkSorted(sub[top], (top,)):
+        yield key, path
+
+
+def walkSorted(dir, key):
+  try:
+    names = sorted(os.listdir(dir))
+  except OSError:
+    return
+  for fn in names:
+    path = os.path.join(dir, fn)
+    if os.path.isdir(path) and not os.path.islink(path):
+      for ent in walkSorted(path, key+(fn,)):
+        yield ent
+    else:
+      yield key+(fn,), path
+
+
+def fileId(path):
+  '''Return a bunch(size, link, md5) describing a file, the md5 is filled in by sameFile
+  only when it's needed'''
+  st = os.lstat(path)
+  link = os.readlink(path) if stat.S_ISLNK(st.st_mode) else None
+  return bunch(size=st.st_size if link is None else len(link), link=link, md5=None,
+    path=path)
+
+
+def md5Of(fid):
+  if fid.md5 is None:
+    import hashlib
+    md5 = hashlib.md5()
+    with open(fid.path, 'rb') as ff:
+      for data in iter(lambda: ff.read(1024*1024), b""):
+        md5.update(data)
+    fid.md5 = md5.hexdigest()
+  return fid.md5
+
+
+def sameFile(aa, bb):
+  if aa.link is not None or bb.link is not None:
+    return aa.link==bb.link
+  return aa.size==bb.size and md5Of(aa)==md5Of(bb)
+
+
+def readText(fid):
+  '''Return a file's lines, or None if it's not a (small enough) text file'''
+  if fid.link is not None or fid.size>textMax:
+    return None
+  with open(fid.path, 'rb') as ff:
+    data = ff.read()
+  if b"\0" in data:
+    return None
+  return data.decode("ISO-8859-1").replace("\r\n", "\n").split("\n")
+
+
+def lineDiff(aa, bb):
+  '''Return the changed lines ('-old', '+new') between two text files, or None'''
+  aLines = readText(aa)
+  bLines = readText(bb) if aLines is not None else None
+  if bLines is None:
+    return None
+  lines = [ln for ln in difflib.unified_diff(aLines, bLines, lineterm="", n=0)
+    if ln[:1] in "-+" and ln[:3] not in ("---", "+++")]
+  return lines[:lineMax]+(["... %d more" % (len(lines)-lineMax)] if len(lines)>lineMax
+    else [])
+
+
+def diffImgs(dirs):
+  '''Generate a bunch(path, changes) for each path that differs between the images in
+  dirs (compared to dirs[0]).  changes has an entry for each image that differs:
+  bunch(img, status ('added', 'removed' or 'changed'), size, refSize, lines)
+  '''
+  names = [os.path.basename(os.path.normpath(dd)) for dd in dirs]
+  trees = [taggedTree(ii, dd) for ii, dd in enumerate(dirs)]
+  merged = heapq.merge(*trees)  # In key order, all the images' copies of a path together
+  cur, paths = None, {}
+  for key, ii, path in merged:
+    if key!=cur:
+      if cur is not None:
+        res = diffPath(cur, paths, names)
+        if res:
+          yield res
+      cur, paths = key, {}
+    paths[ii] = path
+  if cur is not None:
+    res = diffPath(cur, paths, names)
+    if res:
+      yield res
+
+
+def taggedTree(ii, dir):
+  for key, path in imgTree(dir):
+    yield key, ii, path
+
+
+def diffPath(key, paths, names):
+  ids = dict((ii, fileId(pp)) for ii, pp in paths.items())
+  ref = ids.get(0)
+  changes = []
+  for ii in range(1, len(names)):
+    fid = ids.get(ii)
+    if fid is None and ref is None:
+      continue
+    if fid is None:
+      changes.append(bunch(img=names[ii], status="removed", size=None, refSize=ref.size))
+    elif ref is None:
+      changes.append(bunch(img=names[ii], status="added", size=fid.size, refSize=None))
+    elif not sameFile(ref, fid):
+      ch = bunch(img=names[ii], status="changed", size=fid.size, refSize=ref.size)
+      if fid.link is not None or ref.link is not None:
+        ch.link, ch.refLink = fid.link, ref.link
+      else:
+        lines = lineDiff(ref, fid) if key[0]!="img" else None
+        if lines is not None:
+          ch.lines = lines
+      changes.append(ch)
+  if changes:
+    return bunch(path='/'.join(key), changes=changes)
+  return None
+
+
+def writeText(dirs, out=sys.stdout):
+  '''Write the differences as text, return the number of paths that differ'''
+  names = [os.path.basename(os.path.normpath(dd)) for dd in dirs]
+  out.write("Reference: "+names[0]+", compared to: "+', '.join(names[1:])+"\n")
+  cnt = 0
+  for res in diffImgs(dirs):
+    cnt += 1
+    out.write(res.path+"\n")
+    for ch in res.changes:
+      sizes = "" if ch.status!="changed" else " (%s -> %s bytes)" % (ch.refSize, ch.size)
+      if 'link' in ch:
+        sizes = " (-> %s  was -> %s)" % (ch.link, ch.refLink)
+      out.write("  %-10s %s%s\n" % (ch.img, ch.status, sizes))
+      for ln in ch.get('lines', []):
+        out.write("      "+ln+"\n")
+  out.write("%d paths differ\n" % cnt)
+  return cnt
+
+
+def writeJson(dirs, out=sys.stdout):
+  '''Write the differences as a JSON object, {"reference", "images", "diffs": [...],
+  "count"}, one diff at a time.  Returns the number of paths that differ.
+  '''
+  names = [os.path.basename(os.path.normpath(dd)) for dd in dirs]
+  out.write('{"reference": %s,\n "images": %s,\n "diffs": [' % (json.dumps(names[0]),
+    json.dumps(names)))
+  cnt = 0
+  for res in diffImgs(dirs):
+    out.write((",\n  " if cnt else "\n  ")+json.dumps(res, sort_keys=True))
+    cnt += 1
+  out.write('\n ],\n "count": %d}\n' % cnt)
+  return cnt
+
+
+def imgDiff(args):
+  fmt = "text"
+  if len(args)>0 and args[0] in ("json", "text"):
+    fmt = args.pop(0)
+  dirs = args if len(args)>0 else sorted([fn for fn in os.listdir('.')
+    if os.path.isdir(fn) and fn[:3]=="img"])
+  if len(dirs)<2:
+    print("imgDiff needs at least two img* directories")
+    return False
+  (writeJson if fmt=="json" else writeText)(dirs)
+  return True
+
+
+if __name__ == "__main__":
+  imgDiff(sys.argv[1:])
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+'''imgRegions -- Byte level map and diff of raw partition images (rmcBoot.imgOrig,
+  .imgRaw, .img, or system/userdata backups), using numpy.
+
+  imgRegions.py [bs=4096] refImg otherImg...    (or: examImg.py regions ...)
+
+  The images are memory mapped, and compared a block (bs bytes) at a time, a chunk of
+  blocks at a time, with numpy, so multi hundred MB partitions take seconds.  For the
+  reference (first) image it shows each section of the boot image (header, kernel,
+  ramdisk, second, padding; or the whole file if it's not a boot image) with its zero
+  blocks and mean entropy (bits/byte), then for each other image the runs of blocks that
+  differ from the reference, and which sections they fall in.
+
+  numpy is only needed for this (pip install numpy), the rest of reviveMC74 doesn't use it.
+'''
+import sys, os
+from ribou import bunch
+from bootImg import isBootImg, parseBootImg
+
+chunkBytes = 64*1024*1024  # Compare this much at a time, to bound memory use
+entropyBytes = 1024*1024  # (blockEntropy's sub-chunk, its temporaries are ~16x this)
+
+
+def loadNumpy():
+  try:
+    import numpy
+    return numpy
+  except ImportError:
+    print("imgRegions needs numpy, do: pip install numpy")
+    return None
+
+
+def sections(mm, size):
+  '''Return a list of bunch(name, start, end) for the parts of an image'''
+  if size<8 or not isBootImg(mm[:8]):
+    return [bunch(name="data", start=0, end=size)]
+  try:
+    img = parseBootImg(mm)
+  except ValueError:
+    return [bunch(name="data", start=0, end=size)]
+  secs = [bunch(name="header", start=0, end=img.pagesize)]
+  offset = img.pagesize
+  for name in ("kernel", "ramdisk", "second"):
+    length = len(img[name])
+    if length>0:
+      secs.append(bunch(name=name, start=offset, end=offset+length))
+    offset += (length+img.pagesize-1)//img.pagesize*img.pagesize
+  secs.append(bunch(name="padding", start=secs[-1].end, end=size))
+  return secs
+
+
+def runs(np, flags):
+  '''Return [[start, end]...] index ranges where a bool array is True'''
+  edges = np.diff(np.concatenate(([0], flags.view(np.int8), [0])))
+  return np.stack((np.flatnonzero(edges==1), np.flatnonzero(edges==-1)), axis=1)
+
+
+def blockEntropy(np, blk):
+  '''Return the entropy (bits/byte) of each row of a (blocks, bs) uint8 array.  The
+  byte values are counted entropyBytes of rows at a time, the bincount index array is 8
+  times the size of the rows it counts.'''
+  nBlk, bs = blk.shape
+  entropy = np.zeros(nBlk)
+  step = max(entropyBytes//bs, 1)
+  for r0 in range(0, nBlk, step):
+    sub = blk[r0:r0+step]
+    nn = len(sub)
+    idx = sub.astype(np.int64)+(np.arange(nn, dtype=np.int64)*256)[:, None]
+    pp = np.bincount(idx.ravel(), minlength=nn*256).reshape(nn, 256)/float(bs)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      entropy[r0:r0+nn] = -np.where(pp>0, pp*np.log2(pp), 0.0).sum(axis=1)
+  return entropy
+
+
+def blockStats(np, mm, bs):
+  '''Return (zero, entropy) arrays, one entry per block of a memmap'd image'''
+  nBlk = (len(mm)+bs-1)//bs
+  zero = np.zeros(nBlk, dtype=bool)
+  entropy = np.zeros(nBlk)
+  step = max(chunkBytes//bs, 1)
+  for b0 in range(0, nBlk, step):
+    blk = padBlocks(np, mm, b0, min(b0+step, nBlk), bs)
+    zero[b0:b0+len(blk)] = ~blk.any(axis=1)
+    entropy[b0:b0+len(blk)] = blockEntropy(np, blk)
+  return zero, entropy
+
+
+def padBlocks(np, mm, b0, b1, bs):
+  '''Return blocks b0..b1 of mm as a (blocks, bs) array, a short last block 0 padded'''
+  data = mm[b0*bs:b1*bs]
+  if len(data)<(b1-b0)*bs:
+    data = np.concatenate((data, np.zeros((b1-b0)*bs-len(data), dtype=np.uint8)))
+  return data.reshape(b1-b0, bs)
+
+
+def diffBlocks(np, ref, other, bs):
+  '''Return a bool array, True for each block that differs (blocks past the end of the
+  shorter image differ)'''
+  nBlk = (max(len(ref), len(other))+bs-1)//bs
+  diff = np.ones(nBlk, dtype=bool)
+  common = min(len(ref), len(other))
+  cBlk = (common+bs-1)//bs
+  step = max(chunkBytes//bs, 1)
+  for b0 in range(0, cBlk, step):
+    b1 = min(b0+step, cBlk)
+    diff[b0:b1] = (padBlocks(np, ref[:common], b0, b1, bs)
+      != padBlocks(np, other[:common], b0, b1, bs)).any(axis=1)
+  if len(ref)!=len(other) and common%bs:
+    diff[cBlk-1] = True  # One image ends part way through this block, the other doesn't
+  return diff
+
+
+def secNames(secs, start, end):
+  return ','.join([ss.name for ss in secs if ss.start<end and ss.end>start]) or "(past end)"
+
+
+def imgRegions(args):
+  np = loadNumpy()
+  if np is None:
+    return False
+  bs = 4096
+  fids = []
+  for tok in args:
+    if tok[:3]=="bs=":
+      bs = int(tok[3:])
+    else:
+      fids.append(tok)
+  if len(fids)==0:
+    print("imgRegions needs the names of one or more partition images")
+    return False
+
+  mms = [np.memmap(fid, dtype=np.uint8, mode='r') if os.path.getsize(fid)>0
+    else np.zeros(0, dtype=np.uint8) for fid in fids]
+  ref = mms[0]
+  secs = sections(ref, len(ref))
+  zero, entropy = blockStats(np, ref, bs)
+  print("%s: %d bytes, %d blocks of %d" % (fids[0], len(ref), len(zero), bs))
+  print("  %-8s %10s %10s %8s %8s" % ("section", "start", "end", "zeroBlk", "entropy"))
+  for ss in secs:
+    b0, b1 = ss.start//bs, (ss.end+bs-1)//bs
+    if b1>b0:
+      print("  %-8s %10x %10x %8d %8.2f" % (ss.name, ss.start, ss.end,
+        zero[b0:b1].sum(), entropy[b0:b1].mean()))
+
+  for fid, mm in zip(fids[1:], mms[1:]):
+    diff = diffBlocks(np, ref, mm, bs)
+    rr = runs(np, diff)
+    print("\n%s: %d bytes, %d of %d blocks differ from %s, in %d regions" % (fid, len(mm),
+      diff.sum(), len(diff), fids[0], len(rr)))
+    if len(rr)==0:
+      continue
+    oZero, oEntropy = blockStats(np, mm, bs)
+    print("  %10s %10s %7s %-22s %s" % ("start", "end", "blocks", "sections",
+      "entropy ref->this, zero blocks ref->this"))
+    for b0, b1 in rr:
+      start, end = b0*bs, b1*bs
+      refE = entropy[b0:b1].mean() if b0<len(entropy) else 0.0
+      othE = oEntropy[b0:b1].mean() if b0<len(oEntropy) else 0.0
+      print("  %10x %10x %7d %-22s %.2f->%.2f, %d->%d" % (start, end, b1-b0,
+        secNames(secs, start, end), refE, othE, zero[b0:b1].sum(), oZero[b0:b1].sum()))
+  return True
+
+
+if __name__ == "__main__":
+  imgRegions(sys.argv[1:])
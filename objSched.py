@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+'''objSched -- Runs a reviveMC74 objective and its prerequisites, from a declared graph.
+
+  Each node is a bunch(name, func, needs (names of the objectives that must be done
+  first), done (a probe, returns True if the objective was already achieved on an
+  earlier run, or None), host (True if the objective only works on this computer's
+  files, never the device)).
+
+  plan() walks the needs depth first, in the order they are listed, skipping (with all
+  of their needs) the ones whose done probe says they are already achieved; the target
+  itself is always done.  run() prints the plan, then does it: device objectives one at a
+  time, in plan order, on this thread (there is one device), and host objectives in a
+  thread pool, as soon as their needs are done, so they overlap the device work.  Probe
+  and objective results are remembered for the run, so each is done at most once.  The
+  first objective that fails stops the run.  Each objective's function runs inside
+  runLog.objective(name), so the log records it makes (commands...) name it.
+
+  With a checkpoint (checkpoint.py), an objective recorded there as done on an earlier
+  run is skipped without running its probe, and each objective's result is recorded.
+'''
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ribou import bunch
+from runLog import objective
+
+
+class objSched:
+  def __init__(self, nodes, log=print, jobs=4, checkpoint=None):
+    self.nodes = nodes  # name: bunch(name, func, needs, done, host)
+    self.log = log
+    self.jobs = jobs
+    self.checkpoint = checkpoint
+    self.checkpointed = []  # Names found done in the checkpoint
+    self.probes = {}  # name: result of its done probe
+    self.results = {}  # name: result of its func
+    self.failed = threading.Event()
+
+
+  def isDone(self, name):
+    '''Return the (remembered) result of an objective's done probe'''
+    if name not in self.probes:
+      if self.checkpoint and self.checkpoint.isDone(name):
+        self.checkpointed.append(name)
+        self.probes[name] = True
+        return True
+      probe = self.nodes[name].done
+      try:
+        self.probes[name] = bool(probe()) if probe else False
+      except Exception as err:
+        self.log("  -- "+name+" done probe failed: "+str(err)+", (will do it)")
+        self.probes[name] = False
+      if self.probes[name] and self.checkpoint:
+        self.checkpoint.done(name, True)
+    return self.probes[name]
+
+
+  def plan(self, target):
+    '''Return bunch(order (names, needs first), skipped (names already done))'''
+    order, skipped = [], []
+    def visit(name, path):
+      if name in order or name in skipped:
+        return
+      if name in path:
+        raise ValueError("objective "+name+" needs itself: "+' -> '.join(path+[name]))
+      if name!=target and self.isDone(name):
+        skipped.append(name)
+        return
+      for nn in self.nodes[name].needs:
+        visit(nn, path+[name])
+      order.append(name)
+    visit(target, [])
+    return bunch(order=order, skipped=skipped)
+
+
+  def run(self, target):
+    '''Print the plan for target, then do it, return True if every objective succeeded'''
+    pl = self.plan(target)
+    self.log("plan for '"+target+"':\n"+'\n'.join(["  %2d %-16s %s" % (ii+1, nn,
+      "host" if self.nodes[nn].host else "device") for ii, nn in enumerate(pl.order)])
+      +("\n  (already done: "+', '.join([nn+(" (checkpoint)" if nn in self.checkpointed
+      else "") for nn in pl.skipped])+")" if pl.skipped else ""))
+
+    futures = {}
+    with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+      for name in pl.order:
+        self.startHost(pool, pl.order, futures)
+        if self.failed.is_set():
+          break
+        if not self.nodes[name].host:
+          self.runNode(name, futures)
+      self.startHost(pool, pl.order, futures)
+    for name in pl.order:
+      if name in futures and not futures[name].cancelled():
+        futures[name].result()  # (Raise any exception from a host objective here)
+    return not self.failed.is_set() and self.results.get(target)!=False
+
+
+  def startHost(self, pool, order, futures):
+    '''Start each host objective whose needs are started host objectives, or are done'''
+    for name in order:
+      node = self.nodes[name]
+      if node.host and name not in futures and not self.failed.is_set() and all(
+          nn in futures or nn in self.results or nn not in order for nn in node.needs):
+        futures[name] = pool.submit(self.runNode, name, futures)
+
+
+  def runNode(self, name, futures):
+    '''Wait for the needs of an objective, then do it (unless one of them failed)'''
+    node = self.nodes[name]
+    for nn in node.needs:
+      if nn in futures:
+        futures[nn].result()
+      if self.results.get(nn)==False:
+        self.log("  -- not doing "+name+", "+nn+" failed")
+        self.results[name] = False
+        self.failed.set()
+        return False
+    if self.failed.is_set():
+      return False
+    with objective(name):
+      res = node.func()
+    self.results[name] = res!=False
+    if self.checkpoint:
+      self.checkpoint.done(name, res!=False)
+    if res==False:
+      self.log("  -- "+name+" failed")
+      self.failed.set()
+    return res
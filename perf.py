@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+'''perf -- Timing spans for reviveMC74 runs.
+
+  A span is a named, timed piece of work (an objective function, an execute or
+  executeAdb call...).  Spans nest: one that starts while another is open, in the same
+  thread, is its child.  The first maxSpans finished spans are kept in memory, and
+  writeTrace saves them in the Chrome trace event format (load the file in
+  chrome://tracing or https://ui.perfetto.dev), where the slow steps of a run stand out.
+  Every span, kept or not, is summed into the counters as it finishes.
+
+    with span("unpack", "work"):  ...
+    func = timed("backupPart", "objective")(func)
+    wrapCalls([module...], ["execute"], "exec", argsOf)  # Replace module.execute's
+
+  count() adds to counters of the current objective (bytes pushed/pulled), countSpawn
+  counts a program started, sleep() sleeps in a span, and metrics() sums it all up per
+  objective (each 'exec' span counts as a program started).  Only this repo's own calls
+  are timed and counted, nothing is replaced in time or subprocess.
+'''
+import os, time, json, threading
+from functools import wraps
+
+spans = []  # Finished spans: [name, cat, start, secs, thread id, depth, args, objective]
+maxSpans = 20000  # (A long fleet or polling run would grow spans without a limit)
+dropped = 0  # Spans finished after spans was full, only counted
+spansLock = threading.Lock()
+local = threading.local()  # .depth, the number of open spans in this thread, .objs
+t0 = time.time()
+counters = {}  # (objective, counter name): count, ie ('backupPart', 'pulled'): bytes,
+  # ('backupPart', 'secs'), ('backupPart', 'sleep'): seconds, ('', 'spawn:adb'): runs
+
+
+class span:
+  def __init__(self, name, cat="", **args):
+    self.name, self.cat, self.args = name, cat, args
+
+  def __enter__(self):
+    self.depth = getattr(local, 'depth', 0)
+    local.depth = self.depth+1
+    self.obj = objective()
+    if self.cat=="objective":
+      local.objs = getattr(local, 'objs', [])+[self.name]
+    self.start = time.time()
+    return self
+
+  def __exit__(self, tp, val, tb):
+    secs = time.time()-self.start
+    local.depth = self.depth
+    if self.cat=="objective":
+      local.objs = local.objs[:-1]
+    if tp is not None:
+      self.args['error'] = tp.__name__
+    global dropped
+    with spansLock:
+      tally(self.name, self.cat, secs, self.args, self.obj)
+      if len(spans)<maxSpans:
+        spans.append([self.name, self.cat, self.start, secs,
+          threading.current_thread().ident, self.depth, self.args, self.obj])
+      else:
+        dropped += 1
+    return False
+
+
+def tally(name, cat, secs, args, obj):
+  '''Sum a finished span into the counters (with spansLock held): an objective's secs,
+  the current objective's sleep secs, and an 'exec' span as a program started'''
+  if cat=="objective":
+    key = (name, "secs")
+  elif cat=="sleep":
+    key = (obj, "sleep")
+  elif cat=="exec" and args.get("cmd"):
+    key, secs = (obj, "spawn:"+progName(args["cmd"])), 1
+  else:
+    return
+  counters[key] = counters.get(key, 0)+secs
+
+
+def objective():
+  '''The name of the innermost objective span open in this thread, or ""'''
+  objs = getattr(local, 'objs', [])
+  return objs[-1] if objs else ""
+
+
+def count(name, nn=1):
+  '''Add nn to a counter (ie 'pushed' bytes) of the current objective'''
+  key = (objective(), name)
+  with spansLock:
+    counters[key] = counters.get(key, 0)+nn
+
+
+def countSpawn(cmd):
+  '''Count a program started (by its name), where this repo starts one itself (execute
+  calls are counted by tally(), from their 'exec' spans)'''
+  count("spawn:"+progName(cmd))
+
+
+def progName(cmd):
+  '''The program name of a command (a str, or a list of args), ie adb'''
+  prog = cmd if isinstance(cmd, str) else cmd[0]
+  prog = os.path.basename(str(prog).split(' ')[0])
+  return prog[:-4] if prog[-4:].lower()==".exe" else prog
+
+
+def sleep(secs):
+  '''time.sleep, in a 'sleep' span (the waits for boots, polls...)'''
+  with span("sleep", "sleep"):
+    time.sleep(secs)
+
+
+def timed(name, cat="", argsOf=None):
+  '''Decorator, run the function in a span (argsOf(*args) gives the span's args)'''
+  def deco(func):
+    if getattr(func, 'perfTimed', False):
+      return func  # (Already wrapped)
+    @wraps(func)
+    def wrapper(*args, **kwds):
+      with span(name, cat, **(argsOf(*args) if argsOf else {})):
+        return func(*args, **kwds)
+    wrapper.perfTimed = True
+    return wrapper
+  return deco
+
+
+def wrapCalls(modules, names, cat, argsOf=None):
+  '''Replace the named functions in each module with timed versions (each module's own
+  binding, since 'from x import *' copies them)'''
+  for mod in modules:
+    for nn in names:
+      func = getattr(mod, nn, None)
+      if callable(func):
+        setattr(mod, nn, timed(nn, cat, argsOf)(func))
+
+
+def cmdArgs(cmd, *rest):
+  '''Span args for an execute(cmd...) call'''
+  cmd = ' '.join(cmd) if type(cmd)==list else str(cmd)
+  return {"cmd": cmd[:200]}
+
+
+def writeTrace(fid):
+  '''Write the spans to fid, as Chrome trace events'''
+  pid = os.getpid()
+  with spansLock:
+    events = [{"name": name, "cat": cat, "ph": "X", "ts": int((start-t0)*1e6),
+      "dur": int(secs*1e6), "pid": pid, "tid": tid, "args": args}
+      for name, cat, start, secs, tid, depth, args, obj in spans]
+    other = {"droppedSpans": dropped}
+  with open(fid, 'w') as ff:
+    json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": other}, ff)
+  return len(events)
+
+
+def metrics():
+  '''Summarize the counters (the spans are all summed in them): returns a dict with the run's wall and sleep
+  seconds, and per objective: secs (including prerequisite objectives it ran), sleep
+  secs, spawns (by program), pushed and pulled bytes'''
+  with spansLock:
+    cnts = dict(counters)
+  objs = {}
+  def objOf(name):
+    if name not in objs:
+      objs[name] = {"secs": 0.0, "sleep": 0.0, "spawns": {}, "pushed": 0, "pulled": 0}
+    return objs[name]
+  for (obj, name), nn in cnts.items():
+    if name[:6]=="spawn:":
+      sp = objOf(obj)["spawns"]
+      sp[name[6:]] = sp.get(name[6:], 0)+nn
+    else:
+      objOf(obj)[name] = objOf(obj).get(name, 0)+nn
+  return {"wall": round(time.time()-t0, 3), "sleep": round(sum(oo["sleep"]
+    for oo in objs.values()), 3), "objectives": objs}
+
+
+def metricsTable(mm):
+  '''The metrics as a compact text table'''
+  progs = sorted(set(pp for oo in mm["objectives"].values() for pp in oo["spawns"]))
+  lines = ["  %-14s %8s %8s %9s %9s" % ("objective", "secs", "sleep", "pushedKB",
+    "pulledKB")+''.join([" %8s" % pp[:8] for pp in progs])]
+  for name, oo in sorted(mm["objectives"].items(), key=lambda kv: -kv[1]["secs"]):
+    lines.append("  %-14s %8.1f %8.1f %9d %9d" % (name or "(none)", oo["secs"],
+      oo["sleep"], oo["pushed"]//1024, oo["pulled"]//1024)+''.join([" %8s" %
+      (oo["spawns"].get(pp, "") or "") for pp in progs]))
+  lines.append("  run: %.1fs, %.1fs sleeping/polling, %.1fs working" % (mm["wall"],
+    mm["sleep"], mm["wall"]-mm["sleep"]))
+  return '\n'.join(lines)
@@ -16,9 +16,17 @@ the Meraki apps and to install reviveMC74.apk
 
 # python reviveMC74.py installApps host=phCom
 
-import sys, os, time, datetime, shutil
+import sys, os, time, datetime, shutil, io, gzip
 from ribou import *
 from examImg import * # Utilities for reviveMC74
+from bootImg import parseBootImg, buildBootImg, unpackBootFile, packBootFile
+from cpioNewc import readEntries, cpioWriter
+from bootCache import bootCache, defaultMaxMB
+from backupStore import backupStore
+import perf
+from objSched import objSched
+from checkpoint import checkpoint
+from runLog import objective
 
 installFilesDir = "installFiles"
 filesPresentFid = "filesPresent.flag"
@@ -28,13 +36,7 @@ neededProgs = bunch(  # These are commands that demonstrate that needed programs
   # PATH and that they execute (ie not just the filename of the program
   adb = ["adb version", "adbNeeded"],   
   fastboot = ["fastboot", "adbNeeded"],
-  unpackbootimg = ["unpackbootimg", "unpNeeded"],
-  mkbootimg = ["mkbootimg", "unpNeeded"],
-  chmod = ["chmod --version", "unpNeeded"],
-  cpio = ["cpio --version", "unpNeeded"],
-  gzip = ["gzip -V", "gzipNeeded"], 
-  gunzip = ["gunzip -V", "gzipNeeded"], 
-)
+)  # (boot images and ramdisks are unpacked/packed by bootImg.py and cpioNewc.py)
 
 neededFiles = bunch(
   recoveryClockImg = "recovery-clockwork-touch-6.0.4.7-mc74v2.img",
@@ -81,6 +83,37 @@ sys.arg = arg  # Make it universal (not just global (to reviveMC74)) so examImg.
 # Options:
 #   part  -- specify which parition to read or write(flash) data to
 #   img   -- full filename of disk image to write/flash in flashPart objective
+#   adb   -- how adb commands reach the device: 'native' (talk to the adb server socket,
+#            the default if the server is running), 'session' (one long lived adb shell
+#            per device) or 'exec' (run the adb program for every command)
+#   stream -- 'stream=0' copies partitions through /cache on the device in backupPart and
+#             flashPart, rather than streaming them straight to/from this computer
+#   delta -- 'delta=0' makes flashPart write the whole image, rather than just the blocks
+#            that differ from the partition's current contents
+#   fix   -- 'fix=dir' makes fixPart pack the rmcBootRamdisk directory (with any changes
+#            made there by hand), rather than patching the ramdisk from .imgRaw in memory
+#   cache -- directory of the cache of patched boot images (default ~/.reviveMC74/bootCache),
+#            'cache=0' to always patch
+#   cacheMax -- MB the boot image cache may use before old images are removed (default 256)
+#   store -- directory of the deduplicating partition backup store (default
+#            ~/.reviveMC74/backupStore), 'store=0' to not add backups to it
+#   which -- which backup restorePart writes: 'orig' (the first), 'latest' or a timestamp
+#   launcherDb -- 'launcherDb=offline' makes installApps pull launcher.db and patch it with
+#            python's sqlite3, rather than running sqlite3 on the device
+#   launcherGolden -- JSON file of a patched favorites table: if it exists, the offline
+#            launcher.db patch copies it to the phone, if not, it's saved there
+#   logMax -- MB reviveMC74.log (and reviveMC74.jsonl) may grow to before being rotated
+#            to .1, .2 (default 10)
+#   trace -- 'trace=out.json' writes the timing of each objective and command run, in
+#            Chrome trace event format (view with chrome://tracing or ui.perfetto.dev)
+#   metrics -- file the run's metrics (time, sleep, programs run, bytes pushed/pulled per
+#            objective) are appended to (default reviveMC74.metrics.jsonl, 'metrics=0': none)
+#   verify -- 'verify=full' reassesses every objective on the device, rather than trusting
+#            the device's checkpoint (checkpoints/<serial>.json) of what earlier runs did
+#   serial -- adb/fastboot serial number of the device to work on (if several are attached)
+#   files -- path of the installFiles directory
+#   obj   -- objective the 'fleet' objective runs on each device (default: revive)
+#   jobs  -- number of devices the 'fleet' objective works on at once (default: 4)
 
 
 def reviveMain(args):
@@ -128,13 +161,15 @@ def reviveMain(args):
   for tok in args:
     tok = tok.split('=')
     arg[tok[0]] = tok[1] if len(tok)==2 else True
+  if 'files' in arg:  # (fleet gives each device its own directory, but shares files)
+    installFilesDir = arg.files
   
   if target=='listObjectives':
     listObjectivesFunc()
     return
 
   # Connect to the requested host if needed (device must be rooted/revived first)
-  if 'host' in arg:
+  if 'host' in arg and 'serial' not in arg:
     resp, rc = executeAdb("shell getprop ro.serialno")
     if resp.find("error:") == 0:  # Resp probably: "error: device 'xxx:5555' not found\r\n"
       if arg.host.find(':') == -1: arg.host += ":5555"
@@ -155,44 +190,10 @@ def reviveMain(args):
         print("  Did you do: git clone https://github.com/reviveMC74/reviveMC74.git")
         return False
 
-  if os.path.isfile(filesPresentFid) == False:
-    if checkFilesFunc():
-      writeFile(filesPresentFid, "ok")
-    else:
-      print("Not all needed programs are in the 'PATH' or not all files are"
-        +" present in this directory:")
-      for line in state.error:
-        print("  --"+line)
-
-      if "adbNeeded" in state.needed:
-        print("\nADB/FASTBOOT programs needed.  See:\n"
-          +"  https://www.xda-developers.com/install-adb-windows-macos-linux/\n"
-          +"  for instructions.  If you have adb and fastboot, make sure they"
-          +" are in the 'path'"
-          +"\n  (For experts, see: reviveMC74.py  neededProgs.adb[0] for the"
-          +" command we use to test.)"
-        )
-        
-      if "unpNeeded" in state.needed:
-        print("\nUNPACKBOOTIMG/MKBOOTIMG/CPIO/CHMOD programs needed.  To download, see:\n"
-          +"  https://forum.xda-developers.com/showthread.php?t=2073775\n"
-          +"  or: https://github.com/huaixzk/android_win_tool   for precompiled"
-          +" windows version\n"
-          +"  or: https://github.com/osm0sis/mkbootimg   for the source code.\n"
-          +"  Make sure that 'unpackbootimg', 'mkbootimg', 'chmod' and 'cpio' are in"
-          +" the 'path'."
-        )
-        
-      if "gzipNeeded" in state.needed:
-        print("\nGZIP/GUNZIP programs needed.  To for windows, see:\n"
-          +"  https://sourceforge.net/projects/unxutils/files/unxutils/current/UnxUtils.zip/download"
-          +"To get 'UnxUtil.zip.  From that file extract: 'usr/local/wbin/gunzip.exe' "
-          +"and 'usr/local/wbin/gzip.exe' to a directory that is in your PATH." 
-        )
-        
-      return
-
-  # Execute the target objective's 'func', it will call it's prerequisites
+  # (checkFiles is done, once, as a prerequisite of the objectives that need the files)
+
+  # Execute the target objective's 'func', after the prerequisites it needs
+  instrument()
   try:
     func = eval(target+"Func")
   except: 
@@ -205,8 +206,17 @@ def reviveMain(args):
     return
 
   print(target+" Function: "+' '.join(args))  
+  getRunLog().context.update(serial=sysArg('serial') or adbHost())
+  getRunLog().record("start", target=target, args=args)
   log(target+' '.join(args)+"===================================================================", prefix="\n")
-  if func():
+  if target in [ob[0] for ob in objectives]:
+    sched = objectiveSched()
+    ok = sched.run(target)  # (Prints the plan: the objectives it needs, in order)
+    sched.checkpoint.save()  # (The final state)
+  else:
+    with objective(target):
+      ok = func()
+  if ok:
     print("Acheived objective '"+target+"'")
   else:
     print(target+" failed:")
@@ -214,6 +224,102 @@ def reviveMain(args):
       print("  --"+line)
 
   log(rformat(state))  # Log the state of the operation on completion
+  getRunLog().record("end", target=target, ok=bool(ok), errors=state.error)
+  writeMetrics(ok)
+  if 'trace' in arg:
+    logp("  wrote "+str(perf.writeTrace(arg.trace))+" timing spans to "+arg.trace
+      +" (open it in chrome://tracing or ui.perfetto.dev)")
+  return ok
+
+
+def objectiveSched():
+  '''Return an objSched for the objectives: each one's needs, and host flag, are in the
+  objectives list, its done probe is <objectiveName>Done (if there is one)'''
+  glb = globals()
+  nodes = bunch()
+  for ob in objectives:
+    nodes[ob[0]] = bunch(name=ob[0], func=glb[ob[0]+"Func"],
+      needs=ob[2] if len(ob)>2 else [], host=len(ob)>3 and ob[3]=='host',
+      done=glb.get(ob[0]+"Done"))
+  ckpt = checkpoint(checkpointSerial, checkpointInputs, checkpointArgs, state=state,
+    trust=arg.get('verify')!='full', log=logp)
+  if not ckpt.trust:
+    logp("  (verify=full: reassessing every objective, not trusting the checkpoint)")
+  return objSched(nodes, logp, checkpoint=ckpt)
+
+
+def checkpointSerial():
+  '''The serial of the device, for its checkpoint file: serial=, or the only device in
+  'adb devices'/'fastboot devices' (None if there are several, or none)'''
+  if 'serial' in arg:
+    return arg.serial
+  devices = listDevices()
+  return devices[0][0] if len(devices)==1 else None
+
+
+def checkpointArgs():
+  '''The args that choose the objectives' inputs, recorded in the checkpoint'''
+  return {"part": arg.part, "img": arg.get('img'), "extra": bool(options.extra[0])}
+
+
+def partFids():
+  '''bunch(part, raw (the image backupPart makes), img (the image flashPart writes)) for
+  the part= (and img=) args'''
+  partName = arg.part if arg.part!="both" else "boot"
+  img = arg.img if 'img' in arg else 'rmc'+partName[:1].upper()+partName[1:]+".img"
+  return bunch(part=partName, img=img, raw=img+"Raw" if partName[:4]=='boot' else img)
+
+
+def installFids():
+  '''The local files (programs and apks) installApps puts on the device'''
+  fids = []
+  for inst in (installFiles, installApps):
+    if options.extra[0]:
+      inst = dict(inst, **(installFilesExtra if inst is installFiles else installAppsExtra))
+    for id in sorted(inst):
+      fids.append(installFilesDir+("/extra/" if id[0:5]=="EXTRA" else "/")+inst[id][0])
+  return fids
+
+
+checkpointInputs = bunch(  # Objectives kept in the device's checkpoint: the files they use
+  replaceRecovery = lambda: [installFilesDir+"/"+neededFiles.recoveryClockImg],
+  backupPart = lambda: [partFids().raw],
+  fixPart = lambda: [partFids().raw, partFids().img],
+  flashPart = lambda: [partFids().img],
+  installApps = installFids,
+)
+
+
+def instrument():
+  '''Time every objective function, and execute/executeAdb call, in perf spans'''
+  import ribou, examImg
+  glb = globals()
+  for nn in list(glb.keys()):
+    if nn[-4:]=="Func" and nn!="listObjectivesFunc" and callable(glb[nn]):
+      glb[nn] = perf.timed(nn[:-4], "objective")(glb[nn])
+  mods = [ribou, examImg, sys.modules[__name__]]
+  perf.wrapCalls(mods, ["execute"], "exec", perf.cmdArgs)
+  perf.wrapCalls(mods, ["executeAdb", "executeFastbootLog"], "adb", perf.cmdArgs)
+  perf.wrapCalls([examImg], ["streamPartBackup", "streamPartFlash", "deltaPartFlash",
+    "remoteMd5"], "adb")
+
+
+def writeMetrics(ok):
+  '''Print the run's metrics (perf.metrics) table, and append them, as a JSON line, to
+  the metrics file (metrics=..., default reviveMC74.metrics.jsonl, metrics=0 for none)'''
+  import json
+  mm = perf.metrics()
+  logp("\nrun metrics:\n"+perf.metricsTable(mm))
+  fid = arg.get('metrics', "reviveMC74.metrics.jsonl")
+  if fid=='0':
+    return
+  mm.update(time=time.strftime("%Y-%m-%d %H:%M:%S"), objective=target, ok=bool(ok),
+    serial=sysArg('serial') or adbHost(), python=sys.version.split()[0])
+  try:
+    with open(fid, 'a') as ff:
+      ff.write(json.dumps(mm, sort_keys=True)+"\n")
+  except IOError as err:
+    logp("  -- can't append to "+fid+": "+str(err))
 
 
 
@@ -253,19 +359,7 @@ def chkFile(fid):
 
 # FUNCTIONS FOR CARRYING OUT OBJECTIVES ----------------------------------------
 def reviveFunc():
-  logp("--(reviveFunc)") 
-  #if adbModeFunc("normal") == False:
-  if flashPartFunc()==False:
-    print("flashPartFunc failed")  
-    return False
-
-  if installAppsFunc()==False:
-    print("installAppsFunc failed")  
-    return False
-
-  if startPhoneFunc()==False:
-    print("startPhoneFunc failed")  
-    return False
+  logp("--(reviveFunc)")  # (flashPart, installApps and startPhone were done first)
   return True
 
 
@@ -282,14 +376,14 @@ def replaceRecoveryFunc():
 
   # Has the recovery partition already been replaced?
   isReplaced = False
-  resp, rc = executeAdbLog("shell grep secure default.prop")
+  facts = deviceFacts()  # (ie 'shell grep secure default.prop')
   
-  if findLine(resp, "ro.secure=0"):
+  if facts.secure=="0":
     # This phone already has had the recovery replaced (ie shell cmd worked)
     # ro.secure has already been changed to '0', boot partition already fixed
     pass
 
-  elif findLine(resp, "failed: No such file"):
+  elif stockRecovery(facts):
     # The recovery partition has not been replaced, do it now
     # Switch to fastboot mode
     if state.adbMode != 'fastboot':
@@ -313,7 +407,7 @@ def replaceRecoveryFunc():
       return False
 
     logp("  --Writng revovery partition image:  "+neededFiles.recoveryClockImg)
-    resp, rc = executeLog("fastboot flash recovery "+installFilesDir+"/"+neededFiles.recoveryClockImg)
+    resp, rc = executeFastbootLog("flash recovery "+installFilesDir+"/"+neededFiles.recoveryClockImg)
     # IF this hangs on Linux, the problem may be that 'fastboot devices'
     # returns 'no permissions  fastboot', meaning that the user needs to be root to write to 
     # the USB device.    Try doing the fastboot commands as root, ie with sudo?
@@ -328,13 +422,11 @@ def replaceRecoveryFunc():
       that display.)
 
     ''')
-    try: 
-      resp = input()  # Wait for the user to hold mute down and press enter
-    except: 
-      pass
+    if not operatorStep("hold mute while it reboots into recovery"):
+      return False
 
     print("    --Rebooting")
-    resp, rc = executeLog("fastboot reboot")
+    resp, rc = executeFastbootLog("reboot")
     bootWaitLoop("adb")  # Wait for reboot to finish before letting backupPartFunc continue
 
   state.replaceRecovery = True
@@ -351,12 +443,8 @@ def backupPartFunc():
   Other partitions are backedup to rmcXXXX.img.
   '''
 
-  if replaceRecoveryFunc()==False:
-    return False
-
-  # Verify that the adb connection is in root mode
-  resp, rc = executeAdbLog("shell id")
-  if resp.find("(root)")==-1:
+  # Verify that the adb connection is in root mode (replaceRecovery was done first)
+  if not deviceFacts().root:  # (ie 'shell id' shows uid 0(root))
     logp("!! MC74 adbd is not in 'root' mode, can't continue")
     return False
 
@@ -374,13 +462,15 @@ def backupPartFunc():
     imgFn += "Raw"  # Backing up boot produces .imgRaw, fixPartFunc uses this to create .img
 
   logp("backupPart "+partName+" partition: "+partFid)
-  resp, rc = executeAdbLog("shell dd if="+partFid+" of=/cache/"+imgFn+" ibs=4096")
-  resp, rc = executeAdb("pull /cache/"+imgFn+" .")
-  resp, rc = executeAdbLog("shell rm /cache/"+imgFn)
+  if arg.get('stream')=='0' or streamPartBackup(partFid, imgFn)==False:
+    resp, rc = executeAdbLog("shell dd if="+partFid+" of=/cache/"+imgFn+" ibs=4096")
+    resp, rc = executeAdb("pull /cache/"+imgFn+" .")
+    resp, rc = executeAdbLog("shell rm /cache/"+imgFn)
 
   if os.path.isfile(imgFn)==False:
     logp("!!Can't find "+imgFn+" after pulling it")
     return False
+  storeBackup(imgFn, partName)
 
   if partName[:4]!='boot':  # For non boot partitions we are done, success
     return True
@@ -391,8 +481,12 @@ def backupPartFunc():
     return False
     
   print("  --unpack "+imgFn+" and unpack the ramdisk")
-  resp, rc = executeLog(sys.executable+' '+installFilesDir+"/packBoot.py unpack "+imgFn)
-  # sys.executable is the name of the python interpreter we are running
+  try:
+    res = unpackBootFile(imgFn)
+    log("  unpacked to "+res.unpackDir+" and "+res.ramdiskDir+", ramdisk:\n"
+      +prefix("  |", '\n'.join(res.entries)))
+  except ValueError as err:
+    logp("  !! "+imgFn+": "+str(err))
 
   if os.path.isfile(imgFn[:-3]+"Orig")==False:  # If no .imgOrig file, make it now
     # We should never overwrite this copy, the original copy from the phone
@@ -403,67 +497,165 @@ def backupPartFunc():
   return True
 
 
+def backupPartDone():
+  '''The partition was backed up before (so fixPart/flashPart need not do it again)'''
+  return os.path.isfile(partFids().raw)
+
+
+def storeBackup(imgFn, partName):
+  '''Add a partition backup to the deduplicating backup store (unless 'store=0')'''
+  if arg.get('store')=='0':
+    return
+  try:
+    store = backupStore(arg.get('store'))
+    man = store.put(imgFn, deviceSerial(), partName)
+    logp("  -- stored "+imgFn+" for "+man.serial+", "+str(len(man.chunks))+" chunks, "
+      +str(man.added)+" new bytes in "+store.dir)
+  except (IOError, OSError) as err:
+    logp("  -- can't add "+imgFn+" to the backup store: "+str(err))
+
+
+def deviceSerial():
+  '''The serial number of the device we're working on (for the backup store)'''
+  if 'serial' in arg:
+    return arg.serial
+  resp, rc = executeAdb("shell getprop ro.serialno")
+  resp = resp if type(resp)==str else resp.decode("ISO-8859-1")
+  resp = resp.strip()
+  if rc==0 and resp and ' ' not in resp:
+    return resp
+  return adbHost() or "unknown"
+
+
 def fixPartFunc():
-  ''' Edit default.prop file (and perhaps other) from rmcBootRamdisk directory, then pack the 
-      ramdisk back into a rmcBoot.img file
+  ''' Edit default.prop file (and perhaps other) in the ramdisk of rmcBoot.imgRaw, and write
+      the result to a rmcBoot.img file.  The ramdisk is patched in memory, nothing is unpacked
+      to disk (unless 'fix=dir', which packs the rmcBootRamdisk directory as before).
   '''
   partName = arg.part  # Get name of partition to backup, defaults to 'boot'
   if partName=="both":
     partName = "boot"
   imgId = 'rmc'+partName[:1].upper()+partName[1:]
   rawFid = imgId+".imgRaw" if partName=="boot" else imgId+".img"
-  rawImgExists = os.path.isfile(rawFid)
-
-  if rawImgExists==False:
-    if backupPartFunc()==False:
-      return False
+  # (backupPart was done first, if there was no rawFid)
 
   if partName[:4]!="boot":  # Only the boot[2] partition needs to be 'fixed'
     return True
 
-  if target!="fixPart" and os.path.isfile(imgId+".img")==True:
-    print("  --skipping fixPart for "+imgId+".img partition, already done")
-    return True  # For normal revive, if boot is fixed, skip it
-    # If this is an explicit request to fixPart, do it
-
   logp("fixPartFunc "+imgId+".imgRaw to make it rooted.")
   try:
     os.remove(imgId+'.img')
   except:  pass
 
+  if arg.get('fix')=='dir':  # Pack the (perhaps hand edited) Ramdisk directory instead
+    return fixPartDir(imgId)
+
+  try:
+    raw = readFile(rawFid, ascii=False)
+    cache = openBootCache()
+    key = cache.key(raw, bootPatchVersion) if cache else None
+    data = cache.get(key) if cache else None
+    if data:
+      logp("  -- "+rawFid+" was patched before, using cached image "+key[:16]+"...")
+    else:
+      data = fixBootImg(raw)
+      if cache:
+        cache.put(key, data)
+  except (IOError, ValueError) as err:
+    logp("  !! Can't fix "+rawFid+": "+str(err)+"\n  !! Rerun the 'fixPart' objective.")
+    state.error.append("fixPart: "+rawFid+": "+str(err))
+    return False
+  with open(imgId+".img", 'wb') as ff:
+    ff.write(data)
+  logp("  -- wrote "+imgId+".img, "+str(len(data))+" bytes")
+  return True
+
+
+def fixPartDone():
+  '''The boot image was fixed before (or flashPart was given its img=, or the partition
+  isn't a boot partition, which needs no fixing).  An explicit fixPart is always done.'''
+  partName = arg.part if arg.part!="both" else "boot"
+  if 'img' in arg or partName[:4]!="boot":
+    return True
+  return os.path.isfile('rmc'+partName[:1].upper()+partName[1:]+".img")
+
+
+bootPatchVersion = 1  # Change this when fixBootImg's edits change (it's in the cache key)
+def openBootCache():
+  '''Return the bootCache for patched boot images, or None if cache=0 was given'''
+  if arg.get('cache')=='0':
+    return None
+  try:
+    return bootCache(arg.get('cache'), int(arg.get('cacheMax', defaultMaxMB))*1024*1024)
+  except (OSError, ValueError) as err:
+    logp("  -- can't use the boot image cache: "+str(err))
+    return None
+
+
+def fixBootImg(raw):
+  """Return a rooted copy of a boot image (the bytes of rmcBoot.imgRaw), all done in
+  memory: in the ramdisk, default.prop gets ro.secure=0 and persist.meraki.usb_debug=1
+  (and is made not group/other writable, or init ignores it) and init.rc gets a /ssm
+  symlink.  Other ramdisk entries are copied as is.
+  """
+  img = parseBootImg(raw)
+  out = io.BytesIO()
+  with gzip.GzipFile(filename="", mode='wb', fileobj=out, mtime=0) as gz:
+    wr = cpioWriter(gz)
+    for ent in readEntries(gzip.GzipFile(fileobj=io.BytesIO(img.ramdisk))):
+      if ent.name=="default.prop":
+        prop = ent.data.decode("ISO-8859-1")
+        log("  default.prop:\n"+prefix('__', prop))
+        prop = setProps(prop, {"ro.secure": "0", "persist.meraki.usb_debug": "1"})
+        log("    fixed default.prop:\n"+prefix('__', prop))
+        ent.data = prop.encode("ISO-8859-1")
+        ent.mode &= ~0o022  # ie chmod go-w
+      elif ent.name=="init.rc":
+        # in /init.rc after 'symlink /system/etc /etc' insert symlink /storage/emulated/legacy/ssm /ssm
+        lines, found = editLines(ent.data.decode("ISO-8859-1").split('\n'),
+          "symlink /system/etc", insert="    symlink /storage/emulated/legacy/ssm /ssm")
+        if not found:
+          logp("  !! Failed to find 'symlink /system/etc' in init.rc")
+        ent.data = '\n'.join(lines).encode("ISO-8859-1")
+      wr.addEntry(ent)
+    wr.close()
+  return buildBootImg(img.kernel, out.getvalue(), cmdline=img.cmdline, base=img.base,
+    pagesize=img.pagesize, second=img.second, name=img.name, kernelOff=img.kernelOff,
+    ramdiskOff=img.ramdiskOff, secondOff=img.secondOff, tagsOff=img.tagsOff)
+
+
+def setProps(prop, vals):
+  """Set name=value lines in a .prop file's text, dropping \r's and blank lines"""
+  pp = []
+  for ln in prop.split('\n'):
+    if ln[-1:]=='\r':  ln = ln[:-1]
+    name = ln.split('=', 1)[0].strip()
+    if name in vals:
+      ln = name+'='+vals.pop(name)
+    if len(ln)>0:
+      pp.append(ln)
+  for name in vals:
+    logp("  --failed to find/replace '"+name+"' in default.prop")
+  return '\n'.join(pp)
+
+
+def fixPartDir(imgId):
+  """The fixPart edits done on the unpacked rmcBootRamdisk directory, then packed with
+  packBootFile, so hand made changes to the ramdisk files are included (fix=dir arg)
+  """
   # Edit default.props, change 'ro.secure=1' to 'ro.secure=0'
   # and: persist.meraki.usb_debug=0 to ...=1
   logp("  -- edit default.prop to change ro.secure to = 0")
-  try:
-    fn = imgId+"Ramdisk/default.prop"
-    prop = readFile(fn)
-    log("  default.prop:\n"+prefix('__', prop))
-
-    try:
-      ii = prop.index('secure=')+7
-      prop = prop[:ii]+'0'+prop[ii+1:] # Change '1' to '0'
-    except:  print("  --failed to find/replace 'secure=1'")
-    try:
-      ii = prop.index('usb_debug=')+10
-      prop = prop[:ii]+'1'+prop[ii+1:] # Change '0' to '1'
-    except:  print("  --failed to find/replace 'secure=1'")
-    #log("itermediate default.prop:\n"++prefix('--', prop))
-
-    # Remove \r from \r\n on windows systems
-    pp = []
-    for ln in prop.split('\n'):
-      if ln[-1:]=='\r':  ln = ln[:-1]
-      if len(ln)>0:
-        #print("      .."+ln)
-        pp.append(ln)
-    writeFile(imgId+"Ramdisk/default.prop", '\n'.join(pp))
-    # /default.prop will be ignored by system/core/init/init.c if writable by
-    # group/other
-    resp, rc = executeLog("chmod go-w "+imgId+"Ramdisk/default.prop")
-    log("    fixed "+partName+" default.prop:\n"+prefix('__', '\n'.join(pp)))
-  except IOError as err:
+  fn = imgId+"Ramdisk/default.prop"
+  report = editFileMulti(fn, [bunch(find="ro.secure=", replace="ro.secure=0"),
+    bunch(find="persist.meraki.usb_debug=", replace="persist.meraki.usb_debug=1")])
+  if report==False:
     logp("  !! Can't find: "+fn+" in "+os.getcwd()+"\n  !! Rerun the 'fixPart' objective.")
     return False
+  # /default.prop will be ignored by system/core/init/init.c if writable by
+  # group/other
+  os.chmod(fn, os.stat(fn).st_mode & 0o755)  # ie chmod go-w
+  log("    fixed "+imgId+" default.prop:\n"+prefix('__', readFile(fn)))
 
   # Add symlink to /ssm
   # in /init.rc after 'symlink /system/etc /etc' insert symlink /storage/emulated/legacy/ssm /ssm
@@ -472,25 +664,13 @@ def fixPartFunc():
     insert="    symlink /storage/emulated/legacy/ssm /ssm")
 
   logp("  -- repack ramdisk, repack "+imgId+".img")
-  resp, rc = executeLog(sys.executable+' '+installFilesDir+"/packBoot.py pack "+imgId+".img")
-  # sys.executable is the name of the python interpreter we are running
-  #logp(prefix("  __|", '\n'.join(listDir(os.getcwd(), False, 'rmcBoot.img'))))
-  if os.path.isfile(imgId+".img"):  # Make sure no .img file, we will rename
-    hndExcept()
-  
-
-  # Rename the new file, rmcBoot.img2xxxxxxxxxxx (2... is the first digit in decade timestamp)
-  for fid in os.listdir('.'):
-    if fid[:len(imgId)+5] == imgId+'.img2':
-      os.rename(fid, imgId+'.img')
-      break
-  log(prefix("  ..|", '\n'.join(listDir(os.getcwd(), False, 'rmcBoot.img'))))
-
-  if os.path.isfile(imgId+".img"):  # Did packBoot succeed in creating .img file?
-    return True
-  else:
-    state.error.append("fixPart: Can't find file '"+imgId+".img' after packBoot returned.")
+  try:
+    res = packBootFile(imgId+"Unpack", imgId+"Ramdisk", imgId+".img")
+  except (IOError, OSError, ValueError) as err:
+    state.error.append("fixPart: Can't pack "+imgId+"Ramdisk into "+imgId+".img: "+str(err))
     return False
+  log("  packed "+str(res.entries)+" ramdisk entries, "+res.imgFid+" "+str(res.size)+" bytes")
+  return True
 
 
 def flashPartFunc():
@@ -510,59 +690,35 @@ def flashPartFunc():
   else:
     imgFn = 'rmc'+partName[:1].upper()+partName[1:]+".img"
 
-  # If flashPart was not explicitly called, test to see if it has been done
-  if target != "flashPart":
-    # Check timestamp of rmcBoot.img with copy stored in /data/boot.versionDate
-    if os.path.isfile(imgFn):
-      imgDt, imgTm, imgSz = fileDtTm(imgFn)  # Get timestamp of the local boot.img
-      print("    local "+imgFn+" timestamp: "+imgDt+' '+imgTm+' '+str(imgSz))
-      resp, rc = executeAdbLog("shell mount /data")
-      resp, rc = executeAdb("pull /data/"+partName+".versionDate .")
-      try:
-        vDate = readFile(partName+".versionDate").split(' ')
-        instDt, instTm, instSz = vDate[:3]
-        print("    remote "+partName+".versionDate timestamp: "+instDt+' '+instTm+' '+str(instSz))
-
-        if imgDt==instDt and imgTm==instTm:
-          logp("    ("+imgFn+" timestamp matches installed versionDate, skipping flash of "
-            +partName+")")
-          return True
-      except:
-        pass  # parname.versionDate file won't exist before recovery was installed, okay.
-    else:
-      pass  # rmcBoot.img doesn't exist, backupPar and fixPart etc need to be run...
-
-  # If the partition image file doesn't exist, run the fixPartFunc
-  if os.path.isfile(imgFn)==False and partName[:4]=='boot':
-    logp("    ("+imgFn+" not found, calling fixPart to create it)")
-    if fixPartFunc()==False:
-      return False
-
   logp("  flashPartFunc, writing "+imgFn+" to "+partFid)
-  resp, rc = executeAdbLog("push "+imgFn+" /cache/"+imgFn)
-  if rc!=0:
-    state.error.append("Writing "+imgFn+" on device failed")
-    return False
+  partFids = [partFid, partFid+'2'] if doBoth else [partFid]
+  # Try writing just the blocks that changed, then streaming, then the /cache copy
+  flashed = arg.get('delta')!='0' and deltaPartFlash(imgFn, partFids)
+  if not flashed and (arg.get('stream')=='0' or streamPartFlash(imgFn, partFids)==False):
+    resp, rc = executeAdbLog("push "+imgFn+" /cache/"+imgFn)
+    if rc!=0:
+      state.error.append("Writing "+imgFn+" on device failed")
+      return False
 
-  resp, rc = executeAdbLog("shell dd if=/cache/"+imgFn+" of="+partFid
-    +" ibs=4096")
-  if rc!=0:
-    state.error.append("Copying "+imgFn+" on device, to "+partName+" failed")
-    return False
-  if doBoth:
-    resp, rc = executeAdbLog("shell dd if=/cache/"+imgFn+" of="+partFid+'2'
+    resp, rc = executeAdbLog("shell dd if=/cache/"+imgFn+" of="+partFid
       +" ibs=4096")
     if rc!=0:
-      state.error.append("Copying "+imgFn+" on device, to "+partName+"2 failed")
+      state.error.append("Copying "+imgFn+" on device, to "+partName+" failed")
       return False
+    if doBoth:
+      resp, rc = executeAdbLog("shell dd if=/cache/"+imgFn+" of="+partFid+'2'
+        +" ibs=4096")
+      if rc!=0:
+        state.error.append("Copying "+imgFn+" on device, to "+partName+"2 failed")
+        return False
 
-  resp, rc = executeAdbLog("shell rm /cache/"+imgFn)
+    resp, rc = executeAdbLog("shell rm /cache/"+imgFn)
 
   # Record timestamp and size of partition image file to allow for flashPart
   # verification above
   partDate = fileDtTm(imgFn) 
   try:
-    md5 = execute('md5 '+imgFn)[0].split()[0][:8]  # record part of the md5sum of the file
+    md5 = md5File(imgFn)[:8]  # record part of the md5sum of the file
   except:
     md5 = "(noMD5)"
   partDate = partDate[0]+' '+partDate[1]+' '+str(partDate[2])+' '+imgFn+" "+md5
@@ -577,20 +733,56 @@ def flashPartFunc():
   logp("setting perist.meraki.usb_debug: %d %s" % (rc, resp))
   resp, rc = executeAdbLog("shell sync")
   resp, rc = executeAdbLog("shell umount /data")
+  forgetFacts()  # (The partition and versionDate changed)
 
   return True
-  
+
+
+def flashPartDone():
+  '''The local partition image's timestamp matches the one recorded on the device (in
+  /data/<part>.versionDate) when it was flashed, so it needn't be flashed again'''
+  partName, imgFn = partFids().part, partFids().img
+  # Check timestamp of rmcBoot.img with copy stored in /data/boot.versionDate
+  if os.path.isfile(imgFn)==False:
+    return False  # rmcBoot.img doesn't exist, backupPart and fixPart etc need to be run...
+  imgDt, imgTm, imgSz = fileDtTm(imgFn)  # Get timestamp of the local boot.img
+  print("    local "+imgFn+" timestamp: "+imgDt+' '+imgTm+' '+str(imgSz))
+  vDate = deviceFacts().versionDate.get(partName)  # (/data/<part>.versionDate)
+  if vDate is None or len(vDate)<3:
+    return False  # parname.versionDate file won't exist before recovery was installed, okay.
+  instDt, instTm, instSz = vDate[:3]
+  print("    remote "+partName+".versionDate timestamp: "+instDt+' '+instTm+' '+str(instSz))
+
+  if imgDt==instDt and imgTm==instTm:
+    logp("    ("+imgFn+" timestamp matches installed versionDate, skipping flash of "
+      +partName+")")
+    return True
+  return False
+
+
+def appInfoFunc():
+  '''Read the date and size of each app (apk) to be installed, for installApps (this
+  only reads local files, so it's done while the device is being worked on)'''
+  if options.extra[0]:  # Was the -x option specified
+    # Add the extra files and apps to the install lists
+    installFiles.update(installFilesExtra)
+    installApps.update(installAppsExtra)
+
+  state.appInfo = bunch()
+  for id in installApps:
+    dir = installFilesDir+("/extra" if id[0:5]=="EXTRA" else "")
+    state.appInfo[id] = fileDtTm(dir+"/"+installApps[id][0])
+  return True
+
 
 def installAppsFunc():
   if adbModeFunc("normal")==False:  # Get into normal operation
     return False
 
   # TTD:  change telsacoilsw launcher DB
-  if options.extra[0]:  # Was the -e option specified 
-    # Add the extra files and apps to the install lists
-    installFiles.update(installFilesExtra)
-    installApps.update(installAppsExtra)
+  # (appInfo was done first, it adds the extra (-x) files and apps to the install lists)
 
+  facts = deviceFacts()  # (The installed apps, clickOrig, mac address)
   logp("installAppsFunc, uninstall dialer2, droidNode, droidNodeSystemSvc, if not already done")
 
   # Uninstall apps.  Ignore errors where the file to remove is already not there.
@@ -615,8 +807,7 @@ def installAppsFunc():
       resp, rc = executeAdbLog("shell "+instFl[2]+" "+instFl[1]+'/'+instFl[0])
 
   # Replace click with sockSvr to disable Mtunnel, first save a backup
-  resp, rc = executeAdb("shell ls /system/bin/clickOrig")
-  if resp.find("No such file")>0:
+  if not facts.clickOrig:
     resp, rc = executeAdbLog("shell mv /system/bin/click /system/bin/clickOrig")
   resp, rc = executeAdbLog("shell ln -s /system/bin/sockSvr /system/bin/click",
     ignore="File exists")
@@ -631,11 +822,11 @@ def installAppsFunc():
     if isExtra:  # If this is an extra file, read it from the .../extra dir
       dir += "/extra"
 
-    newDt, newTm, newSz = fileDtTm(dir+"/"+fid)
+    newDt, newTm, newSz = state.appInfo[id]  # (Read by appInfoFunc)
 
     # If app is already installed see if we have a newer version
     doInstall = True
-    instDt, instTm, instSz = remoteFileDtTm("/data/app/"+appTag+"*", appTag)
+    instDt, instTm, instSz = lsDtTm('\n'.join(facts.apps), appTag)  # (ls -l /data/app)
     if instDt != None:
       logp("    installed copy of "+id+":   "+instDt+" "+instTm+"  size: "+str(instSz))
       # Is the installed apk, instDt the same or new?
@@ -667,9 +858,10 @@ def installAppsFunc():
   # 'ip addr | grep \ eth0:' look like:
   # 3: eth0: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 qdisc pfifo_fast state UP qlen 512
   #     link/ether e0:55:3d:50:56:10 brd ff:ff:ff:ff:ff:ff
-  resp, rc = executeAdb("shell ip addr |grep -A1 eth0: | grep ether")
-  state.mac = resp.strip().split(' ')[1]
-  print("  (mac "+state.mac+")");
+  if facts.mac:  # (From 'shell ip addr |grep -A1 eth0: | grep ether')
+    state.mac = facts.mac
+    print("  (mac "+state.mac+")");
+  forgetFacts()  # (Apps were installed, click replaced)
   
   state.installApps = True
   return True
@@ -691,7 +883,27 @@ def checkFilesFunc():
     succeeded &= chkFile(installApps[id][0]) # (Apps are also in installFiles dir)
 
   state.checkFiles = succeeded
+  if succeeded:
+    writeFile(filesPresentFid, "ok")
+  else:
+    print("Not all needed programs are in the 'PATH' or not all files are"
+      +" present in this directory:")
+    for line in state.error:
+      print("  --"+line)
+
+    if "adbNeeded" in state.needed:
+      print("\nADB/FASTBOOT programs needed.  See:\n"
+        +"  https://www.xda-developers.com/install-adb-windows-macos-linux/\n"
+        +"  for instructions.  If you have adb and fastboot, make sure they"
+        +" are in the 'path'"
+        +"\n  (For experts, see: reviveMC74.py  neededProgs.adb[0] for the"
+        +" command we use to test.)"
+      )
   return succeeded
+
+
+def checkFilesDone():
+  return os.path.isfile(filesPresentFid)  # (Written when checkFiles succeeds)
  
 
 def adbModeFunc(targetMode="adb"):
@@ -705,27 +917,20 @@ def adbModeFunc(targetMode="adb"):
   isNormal = False  # Normal is: booted into normal dev operation, not recovery mode
   
  
-  # Figure out what mode we are currently in
-  currentMode = "unknown"
-  resp, rc = executeLog("adb devices")
-  if findLine(resp, "\trecovery"):
-    currentMode = "recovery"
+  # Figure out what mode we are currently in ('adb devices', then 'fastboot devices')
+  currentMode = deviceFacts().mode
+  if currentMode == "recovery":
     isAdb = True
-  if findLine(resp, "\tdevice"):
-    currentMode = "normal"
+  if currentMode == "normal":
     isNormal = True
     isAdb = True  # Normal mode (after fixing) should also adb enabled.
-  else:
-    resp, rc = executeLog("fastboot devices")
-    ln = findLine(resp, "\tfastboot")
-    if ln:
-      currentMode = "fastboot"
-      state.serialNo = ln.split('\t')[0]
-      # Note: state.serialNo may be 'no permissions' if in Linux and not root!
-      if targetMode=="fastboot":  # We are in fastboot, and that is the target mode
-        state.adbMode = "fastboot"
-        return True
-      isFastboot = True
+  elif currentMode == "fastboot":
+    state.serialNo = deviceFacts().serialNo
+    # Note: state.serialNo may be 'no permissions' if in Linux and not root!
+    if targetMode=="fastboot":  # We are in fastboot, and that is the target mode
+      state.adbMode = "fastboot"
+      return True
+    isFastboot = True
   
   logp("  --adbModeFunc, currentMode: "+currentMode+", targetMode: "+targetMode
     +(" adb" if isAdb else "")+(" normal" if isNormal else "")
@@ -736,7 +941,7 @@ def adbModeFunc(targetMode="adb"):
   
   elif isAdb and targetMode=="fastboot":
     print("    --Changing from adb mode to fastboot mode")
-    resp, rc = executeLog("adb reboot bootloader")
+    resp, rc = executeAdbLog("reboot bootloader")
   
   elif isAdb and targetMode=="adb":
     currentMode = targetMode  # normal mode should be eqivalent to adb after fixing
@@ -759,22 +964,20 @@ def adbModeFunc(targetMode="adb"):
       -- Press enter on the computer keyboard.
       -- (in about 15 sec, Windows should make the  'usb device attached' sound.)
     ''')
-    try:
-      resp = input()
-    except:
-      pass
+    if not operatorStep("power it up into recovery, holding mute"):
+      return False
     
   elif isNormal==False and targetMode=="normal":
     print("    --Changing from "+currentMode+" mode to normal device mode")
     if isFastboot:
-      resp, rc = executeLog("fastboot reboot")
+      resp, rc = executeFastbootLog("reboot")
       
     else:
       #resp, rc = executeLog("adb reboot")  --This seems to hang in clockwork recovery mode
       # Per https://opensource.com/article/19/7/reboot-linux  reboot can be forced with:
       #   echo b > /proc/sysrq-trigger
       # (if /proc/sys/kernel/sysrq is set to '1', which seems to be the case in clockwork recovery)
-      resp, rc = executeLog(['adb', 'shell', "echo b >/proc/sysrq-trigger"])
+      resp, rc = executeLog(adbArgs()+['shell', "echo b >/proc/sysrq-trigger"])
       log("reboot by sysrq, rc="+str(rc)+": "+resp)
     
   else:
@@ -789,17 +992,34 @@ def adbModeFunc(targetMode="adb"):
   return True
 
 
+def operatorStep(what):
+  '''Wait for the operator to do a manual step at the device (as just printed) and press
+  enter.  A device's reviveMC74 run by fleet (unattended=1) has no console, then it fails
+  instead, so that device can be done alone.'''
+  if arg.get('unattended')=='1':
+    state.error.append("The operator is needed at the device ("+what+"), run reviveMC74"
+      " on "+str(arg.get('serial'))+" alone")
+    state.needed.append("operator")
+    return False
+  try:
+    resp = input()
+  except:
+    pass
+  return True
+
+
 def bootWaitLoop(tMode):
   '''Loop for a while waiting for the MC74 to finish booting into fastboot or adb mode
   '''
   cmd = "fastboot" if tMode=="fastboot" else "adb"
+  forgetFacts()  # (The device is rebooting)
   print("  --loop running '"+cmd+" devices' until we see a device")
   searchStr = "\trecovery" if tMode=='adb' else "\tfastboot"
   if tMode == "normal":   searchStr = "\tdevice"
 
   for ii in range(0, 12):
     resp, rc = executeLog(cmd+" devices")
-    ln = findLine(resp, searchStr)
+    ln = findDevLine(resp, searchStr)
     if ln:
       state.serialNo = ln.split('\t')[0]
       print("      found device with serial number: "+state.serialNo)
@@ -807,7 +1027,7 @@ def bootWaitLoop(tMode):
       return True
 
     print("--Waiting for reboot "+str(12-ii)+"/12: "+resp.replace('\n', ' '))
-    time.sleep(5)
+    perf.sleep(5)
   state.adbMode = "unknown"
   return False
 
@@ -977,6 +1197,232 @@ def pushFunc():
   print("Execute: git push")
 
 
+fleetModes = ("device", "recovery", "fastboot")  # The 'adb devices' states fleet can use
+operatorRc = 2  # reviveMC74's exit code when it needed the operator (unattended=1)
+def fleetFunc():
+  '''Run an objective (obj=..., default 'revive') on every attached device (and any
+  network devices listed in hosts=a,b...), up to jobs=N devices at a time.  Each device
+  gets its own reviveMC74 process and working directory, fleet/<serial>, with its own
+  state, backed up images and reviveMC74.log (the console output goes to fleet.log).
+  Devices that can't be used ('unauthorized', 'offline'...) are skipped.  Nobody sees a
+  device's console, so a step that needs the operator (holding mute while it reboots...)
+  fails that device, which is then reported as needing the operator.
+  '''
+  import subprocess
+  from concurrent.futures import ThreadPoolExecutor
+  obj = arg.get('obj', 'revive')
+  jobs = int(arg.get('jobs', 4))
+  fleetDir = os.path.abspath(arg.get('fleetDir', 'fleet'))
+
+  for host in arg.get('hosts', '').split(','):
+    if host:
+      resp, rc = execute("adb connect "+(host if ':' in host else host+":5555"))
+      logp("  connecting to "+host+": "+str(resp))
+  devices = listDevices()
+  skipped = [dd for dd in devices if dd[1] not in fleetModes]
+  for serial, mode in skipped:  # (ie 'unauthorized' or 'offline', nothing can reach it)
+    logp("  fleet: skipping "+serial+", it is '"+mode+"'")
+  devices = [dd for dd in devices if dd[1] in fleetModes]
+  if len(devices)==0:
+    state.error.append("fleet: No usable devices found by 'adb devices' or 'fastboot"
+      " devices'"+(" ("+str(len(skipped))+" skipped)" if skipped else ""))
+    return False
+  logp("fleet: '"+obj+"' on "+str(len(devices))+" devices, "+str(jobs)+" at a time")
+
+  # Pass our args on to each device's reviveMC74, except the ones for fleet itself
+  passArgs = [nn+'='+str(vv) for nn, vv in arg.items()
+    if nn not in ('obj', 'jobs', 'fleetDir', 'hosts', 'serial', 'host', 'files',
+    'unattended')]
+  pyFile = os.path.abspath(__file__)
+  opts = ['-x'] if options.extra[0] else []
+
+  def reviveOne(serial, mode):
+    devDir = fleetDir+'/'+serial.replace(':', '_')
+    if not os.path.isdir(devDir):
+      os.makedirs(devDir)
+    if checkFilesDone():  # (fleet needs checkFiles, it passed here, once for them all)
+      writeFile(devDir+'/'+filesPresentFid, "ok")
+    cmd = [sys.executable, pyFile]+opts+[obj, "serial="+serial,
+      "files="+os.path.abspath(installFilesDir), "unattended=1"]+passArgs
+    t0 = time.time()
+    with open(devDir+"/fleet.log", 'ab') as out:
+      perf.countSpawn(cmd)
+      rc = subprocess.call(cmd, cwd=devDir, stdin=subprocess.DEVNULL, stdout=out,
+        stderr=subprocess.STDOUT)
+    res = bunch(serial=serial, mode=mode, ok=rc==0, rc=rc, secs=time.time()-t0)
+    logp("  fleet: "+serial+(" done" if res.ok else " needs the operator, do it alone"
+      if rc==operatorRc else " FAILED, see "+devDir+"/fleet.log")+" (%.0fs)" % res.secs)
+    return res
+
+  t0 = time.time()
+  with ThreadPoolExecutor(max_workers=jobs) as pool:
+    results = list(pool.map(lambda dev: reviveOne(*dev), devices))
+
+  summary = ["  "+"serial".ljust(22)+"mode".ljust(10)+"result".ljust(8)+"seconds"]
+  for res in results:
+    summary.append("  "+res.serial.ljust(22)+res.mode.ljust(10)
+      +("ok" if res.ok else "operator" if res.rc==operatorRc else "rc="+str(res.rc))
+      .ljust(8)+"%7.0f" % res.secs)
+  summary.append("  %d of %d devices ok, %.0fs total" % (len([rr for rr in results
+    if rr.ok]), len(results), time.time()-t0))
+  logp("\nfleet summary:\n"+'\n'.join(summary))
+  state.fleet = results
+  return all(rr.ok for rr in results)
+
+
+def backupStoreFunc():
+  '''List the partition backups in the backup store, and its dedup stats'''
+  store = backupStore(arg.get('store') if arg.get('store')!='0' else None)
+  for man in store.manifests(arg.get('serial'), arg.get('part') if 'part' in arg
+      and arg.part!='both' else None):
+    logp("  %-20s %-10s %s %10d %s" % (man.serial, man.partition, man.time, man.size,
+      os.path.basename(man.fid)[len(man.partition)+1:-5]))
+  st = store.stats()
+  logp("backupStore: "+st.dir+"\n  %d backups of %d devices, %.1f MB backed up, %.1f MB"
+    " distinct (dedup %.1f:1), stored in %d chunks, %.1f MB (compression %.1f:1, %.1f:1"
+    " overall)" % (st.manifests, st.devices, st.logical/1048576.0, st.unique/1048576.0,
+    st.dedup, st.chunks, st.stored/1048576.0, st.compression, st.ratio))
+  return True
+
+
+def restorePartFunc():
+  '''Write a device's partition backup from the backup store to a file (serial=...,
+  part=..., which=orig|latest|<yymmddHHMMSS>, default orig, img=<output file>), which
+  flashPart (img=...) can then write back to the device.
+  '''
+  partName = arg.part if arg.part!='both' else 'boot'
+  serial = arg.get('serial') or deviceSerial()
+  store = backupStore(arg.get('store') if arg.get('store')!='0' else None)
+  manFid = store.find(serial, partName, arg.get('which', 'orig'))
+  if manFid is None:
+    state.error.append("restorePart: No "+partName+" backup of "+serial+" in "+store.dir)
+    return False
+  outFid = arg.get('img', 'rmc'+partName[:1].upper()+partName[1:]+".imgRestored")
+  try:
+    man = store.restore(manFid, outFid)
+  except (IOError, OSError, ValueError) as err:
+    state.error.append("restorePart: "+str(err))
+    return False
+  logp("restorePart: wrote "+outFid+", "+str(man.size)+" bytes, the "+partName
+    +" backup of "+serial+" from "+man.time+"\n  (to write it to the device: "
+    "reviveMC74.py flashPart part="+partName+" img="+outFid+")")
+  return True
+
+
+def bootCacheFunc():
+  '''Show the patched boot image cache's stats (or empty it, 'bootCache clear')'''
+  cache = openBootCache()
+  if cache is None:
+    state.error.append("bootCache: the cache is off (cache=0)")
+    return False
+  if arg.get('clear'):
+    cache.clear()
+    logp("bootCache: emptied "+cache.dir)
+  st = cache.stats()
+  logp("bootCache: "+st.dir+"\n  %d images, %.1f of %.0f MB\n  %d hits, %d misses (%.0f%% hit"
+    " rate), %d stored, %d evicted" % (st.entries, st.bytes/1048576.0,
+    st.maxBytes/1048576.0, st.hits, st.misses, st.hitRate*100, st.stores, st.evictions))
+  return True
+
+
+def listDevices():
+  '''Return a list of [serial, mode] for devices in 'adb devices' and 'fastboot devices'
+  '''
+  devices = []
+  for cmd in ["adb devices", "fastboot devices"]:
+    resp, rc = executeLog(cmd)
+    for ln in linesToList(resp):
+      tok = ln.split('\t')
+      if len(tok)==2 and tok[0] not in [dd[0] for dd in devices]:
+        devices.append([tok[0], tok[1].strip()])
+  return devices
+
+
+# The device side half of deviceFacts, one sh command line: the output of each command
+# follows an @@<fact> line
+factScript = ' ; '.join([
+  "echo @@secure", "grep secure /default.prop 2>&1",
+  "echo @@id", "id 2>&1",
+  "echo @@mountData", "mount /data 2>&1",
+  "echo @@versionDate", "(cd /data && for ff in *.versionDate; do echo $ff `cat $ff`; done"
+    " 2>/dev/null)",
+  "echo @@apps", "ls -l /data/app 2>&1",
+  "echo @@clickOrig", "ls /system/bin/clickOrig 2>&1",
+  "echo @@mac", "ip addr 2>&1 | grep -A1 eth0: | grep ether",
+  "echo @@end"])
+
+devFacts = None  # The last deviceFacts, until the device is rebooted or changed
+def deviceFacts(refresh=False):
+  '''Assess the device in one round trip: 'adb devices' (or 'fastboot devices' if the
+  device isn't in adb), then, if it's in adb, one 'adb shell' of factScript.  Returns
+  (and keeps, until forgetFacts) a bunch: mode ('normal', 'recovery', 'fastboot' or
+  'unknown'), serialNo, raw (the shell output), shell (False if the device has no sh,
+  ie the stock recovery), secure (ro.secure in /default.prop), root, versionDate
+  ({part: [date, time, size, imgFn, md5]} from /data/<part>.versionDate), apps (the
+  ls -l /data/app lines), clickOrig (True if /system/bin/clickOrig exists), mac
+  '''
+  global devFacts
+  if devFacts is not None and not refresh:
+    return devFacts
+  facts = bunch(mode="unknown", serialNo=None, raw="", shell=False, secure=None,
+    root=False, versionDate={}, apps=[], clickOrig=False, mac=None)
+  resp, rc = executeLog("adb devices")
+  ln = findDevLine(resp, "\tdevice") or findDevLine(resp, "\trecovery")
+  if ln is None:
+    resp, rc = executeLog("fastboot devices")
+    ln = findDevLine(resp, "\tfastboot")
+  if ln:
+    facts.serialNo, facts.mode = ln.split('\t')[0], ln.split('\t')[1].strip()
+    facts.mode = "normal" if facts.mode=="device" else facts.mode
+
+  if facts.mode in ("normal", "recovery"):
+    resp, rc = executeAdb("shell "+factScript)
+    facts.raw = resp if type(resp)==str else resp.decode("ISO-8859-1")
+    log("  device facts:\n"+prefix("  |", facts.raw))
+    sec, name = {}, None
+    for ln in facts.raw.replace('\r', '').split('\n'):
+      if ln[:2]=="@@":
+        name = ln[2:].strip()
+        sec[name] = []
+      elif name:
+        sec[name].append(ln)
+    facts.shell = "end" in sec
+    for ln in sec.get("secure", []):
+      if ln.strip()[:10]=="ro.secure=":
+        facts.secure = ln.strip()[10:]
+    facts.root = "(root)" in ' '.join(sec.get("id", []))
+    for ln in sec.get("versionDate", []):
+      tok = ln.split()
+      if len(tok)>=4 and tok[0][-12:]==".versionDate":
+        facts.versionDate[tok[0][:-12]] = tok[1:]
+    facts.apps = [ln for ln in sec.get("apps", []) if ln.strip()]
+    click = ' '.join(sec.get("clickOrig", []))
+    facts.clickOrig = facts.shell and "clickOrig" in click and "No such file" not in click
+    for ln in sec.get("mac", []):
+      tok = ln.split()
+      if len(tok)>1 and tok[0]=="link/ether":
+        facts.mac = tok[1]
+  logp("  --device facts: "+facts.mode+(" "+facts.serialNo if facts.serialNo else "")
+    +(", secure="+str(facts.secure)+(" root" if facts.root else "")+", versionDate: "
+    +(','.join(sorted(facts.versionDate)) or "none")+", "+str(len(facts.apps))+" apps"
+    +(", clickOrig" if facts.clickOrig else "") if facts.shell else ""))
+  devFacts = facts
+  return facts
+
+
+def stockRecovery(facts):
+  '''Is the device in the MC74's own recovery (not yet replaced by replaceRecovery)?  It
+  shows as 'recovery' in 'adb devices', but has no sh, so factScript didn't run (however
+  the adb transport reported that)'''
+  return facts.mode=="recovery" and not facts.shell
+
+
+def forgetFacts():
+  '''The device changed (rebooted, flashed, apps installed), deviceFacts must reassess it'''
+  global devFacts
+  devFacts = None
+
+
 def listObjectivesFunc():
   print("\nList of objectives (phases or operations needed for revival) Case sensitive:")
   for ob in objectives:
@@ -995,17 +1441,32 @@ state = bunch( # Attributes are added here to indicate state or progress in obje
 
 # Collection of all defined objectives
 #  Note: If 'func' attribute is missing, the function is:  <objectiveName>Func
+#  [name, description, [objectives needed first], 'host' if it only works on local files]
+#  If there is a <objectiveName>Done function, it tells if the objective was achieved
+#  before (then it, and what it needs, are skipped, unless it's the objective asked for)
 objectives = [
   ['listObjectives', "(optional) Lists all objectives"],
-  ['checkFiles', "Verifies that you have the needed files, apps, images, and programs."],
+  ['checkFiles', "Verifies that you have the needed files, apps, images, and programs.",
+    [], 'host'],
   ['adbMode', "Gets device into 'adb' mode, or 'fastboot' or 'normal' operation."],
-  ['replaceRecovery', "Replace the recovery partition with a full featured recovery program"], 
-  ['backupPart', "Backs up boot (or other specified partition)."],
-  ['fixPart', "Changes default.prop file on the ramdisk to allow rooting."],
-  ['flashPart', "Rewrites the (boot) partition image "],
-  ['installApps', "Install VOIP phone app, uninstall old Meraki phone apps"],
-  ['revive', "<--Install reviveMC74 apps --this is the principal objective--"],
-  ['version', "Find and record some software version info"],
+  ['replaceRecovery', "Replace the recovery partition with a full featured recovery program",
+    ['checkFiles', 'adbMode']],
+  ['backupPart', "Backs up boot (or other specified partition).", ['replaceRecovery']],
+  ['fixPart', "Changes default.prop file on the ramdisk to allow rooting.", ['backupPart'],
+    'host'],
+  ['flashPart', "Rewrites the (boot) partition image ", ['fixPart']],
+  ['appInfo', "!Reads the dates and sizes of the apps to install", ['checkFiles'], 'host'],
+  ['installApps', "Install VOIP phone app, uninstall old Meraki phone apps",
+    ['checkFiles', 'appInfo']],
+  ['startPhone', "!Starts the SSM service and the reviveMC74 app"],
+  ['revive', "<--Install reviveMC74 apps --this is the principal objective--",
+    ['flashPart', 'installApps', 'startPhone']],
+  ['version', "Find and record some software version info", ['checkFiles']],
+  ['backupStore', "List the partition backups in the backup store, and its dedup stats"],
+  ['restorePart', "Write a device's (serial=) partition backup from the backup store to a file"],
+  ['bootCache', "Show stats of the patched boot image cache ('bootCache clear' empties it)"],
+  ['fleet', "Do an objective (obj=, default revive) on all attached devices, jobs= at a time",
+    ['checkFiles']],
   ['manual', "Place to manually invoke reviveMC74 functions (advanced users)"],
   ['resetBFF', "(manual step) Reset the 'Boot partion Fixed Flag'"],
   ['push', '(for developers only) Update the local repo then push changes to github'],
@@ -1016,7 +1477,9 @@ objectives = [
 
 if __name__ == "__main__":
   try:
-    reviveMain(sys.argv[1:])
+    if reviveMain(sys.argv[1:])==False:
+      # (fleet uses the exit code to report each device's result)
+      sys.exit(operatorRc if "operator" in state.needed else 1)
   except Exception as xx:
     import traceback
     logp("reviveMC74 exception: "+rformat(xx))
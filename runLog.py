@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+'''runLog -- Buffered run log for reviveMC74: the text log (reviveMC74.log) plus a JSON
+  lines log (reviveMC74.jsonl) of structured records (time, device serial, objective,
+  and for commands: the command, rc, seconds and bytes of output).
+
+  Callers just queue lines and records; a background thread writes them to the files,
+  which stay open, and flushes them when the queue is idle.  Everything queued is
+  written at exit (or when the program dies of an uncaught exception, which is also
+  logged).  When a log grows past maxBytes it is rotated: .log -> .log.1 -> .log.2...
+
+  The objective of a record is the one being done by the thread that made it: objSched
+  runs each objective's function inside 'with objective(name):'.
+'''
+import sys, os, time, json, threading, atexit, contextlib, queue
+
+maxBytes = 10*1024*1024
+keep = 3  # Rotated copies kept
+local = threading.local()  # .objective: the objective this thread is doing
+
+
+class runLog:
+  def __init__(self, textFid, jsonFid):
+    self.fids = {"text": os.path.abspath(textFid), "json": os.path.abspath(jsonFid)}
+    self.files = {}
+    self.context = {}  # Fields added to every record (pid, serial...)
+    self.queue = queue.Queue()
+    self.thread = None
+    self.lock = threading.Lock()
+    self.atexit = False
+    self.maxBytes = maxBytes
+
+
+  def start(self):
+    with self.lock:
+      if self.thread is None:
+        self.thread = threading.Thread(target=self.writer, name="runLog")
+        self.thread.daemon = True
+        self.thread.start()
+        if not self.atexit:
+          atexit.register(self.close)
+          self.atexit = True
+
+
+  def text(self, line):
+    '''Queue a line (str) for the text log'''
+    self.start()
+    self.queue.put(("text", line))
+
+
+  def record(self, kind, **fields):
+    '''Queue a structured record for the JSON lines log'''
+    self.start()
+    rec = {"ts": round(time.time(), 3), "kind": kind}
+    rec.update(self.context)
+    if currentObjective():
+      rec["objective"] = currentObjective()
+    rec.update(fields)
+    self.queue.put(("json", json.dumps(rec, default=str)+"\n"))
+
+
+  def writer(self):
+    while True:
+      item = self.queue.get()
+      try:
+        if item is None:
+          return
+        self.write(*item)
+        if self.queue.empty():
+          for ff in self.files.values():
+            ff.flush()
+      finally:
+        self.queue.task_done()
+
+
+  def write(self, which, line):
+    ff = self.files.get(which)
+    if ff is None:
+      ff = self.files[which] = open(self.fids[which], 'ab')
+    ff.write(line.encode("utf-8", "replace"))
+    if ff.tell()>self.maxBytes:
+      ff.close()
+      del self.files[which]
+      rotate(self.fids[which])
+
+
+  def flush(self):
+    '''Wait until everything queued so far is written (and flushed)'''
+    if self.thread is not None:
+      self.queue.join()
+
+
+  def close(self):
+    with self.lock:
+      if self.thread is not None and self.thread.is_alive():
+        self.queue.put(None)
+        self.thread.join(10)
+      self.thread = None  # (A later message starts a new writer)
+      for ff in self.files.values():
+        ff.close()
+      self.files = {}
+
+
+@contextlib.contextmanager
+def objective(name):
+  '''Records made by this thread in the with are for objective name'''
+  old = currentObjective()
+  local.objective = name
+  try:
+    yield
+  finally:
+    local.objective = old
+
+
+def currentObjective():
+  return getattr(local, 'objective', None)
+
+
+def rotate(fid):
+  for nn in range(keep-1, 0, -1):
+    if os.path.exists(fid+"."+str(nn)):
+      os.replace(fid+"."+str(nn), fid+"."+str(nn+1))
+  os.replace(fid, fid+".1")
+
+
+def installCrashHook(lg):
+  '''Log uncaught exceptions (then let the usual hook print them)'''
+  oldHook = sys.excepthook
+  def hook(tp, val, tb):
+    lg.record("crash", error=tp.__name__+": "+str(val))
+    lg.close()
+    oldHook(tp, val, tb)
+  sys.excepthook = hook
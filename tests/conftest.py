@@ -0,0 +1,30 @@
+'''Shared test helpers: the repo's modules are flat files in the parent directory'''
+import sys, os, stat
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def inTmpDir(tmp_path, monkeypatch):
+  '''Run each test in its own directory (reviveMC74 writes its logs, images... in the cwd)'''
+  monkeypatch.chdir(tmp_path)
+
+
+@pytest.fixture
+def fakeAdb(tmp_path, monkeypatch):
+  '''Return a function that puts an 'adb' program (a sh script body) first in the PATH.
+  The default fake runs shell commands with the local sh, like a device would.'''
+  if os.name=="nt":
+    pytest.skip("the fake adb is a sh script")
+  def make(body=None):
+    fid = tmp_path/"bin"/"adb"
+    fid.parent.mkdir(exist_ok=True)
+    fid.write_text("#!/bin/sh\n"+(body or
+      '[ "$1" = "-s" ] && shift 2\n'
+      'if [ "$1" = "shell" ]; then shift; [ $# -eq 0 ] && exec sh; exec sh -c "$*"; fi\n'
+      'echo "fake adb $*"\n'))
+    fid.chmod(fid.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv("PATH", str(fid.parent)+os.pathsep+os.environ["PATH"])
+    return str(fid)
+  return make
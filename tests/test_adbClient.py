@@ -0,0 +1,80 @@
+'''adbClient's shell, exec and sync services, against an adbStandIn server'''
+import os, io, hashlib
+import pytest
+from adbClient import adbClient, adbStandIn, adbError, syncChunk
+
+
+@pytest.fixture
+def standIn(request, tmp_path):
+  '''Start an adbStandIn (its 'device' files are in tmp_path/root), return a client'''
+  root = tmp_path/"root"
+  root.mkdir()
+  srv = adbStandIn(root=str(root)).start()
+  request.addfinalizer(srv.stop)
+  return adbClient(port=srv.port)
+
+
+def test_devices(standIn):
+  assert standIn.devices() == [["standIn0", "device"]]
+
+
+def test_shell(standIn):
+  assert standIn.shell("echo hello; echo there") == ("hello\nthere\n", 0)
+  assert standIn.shell("echo oops >&2; exit 3") == ("oops\n", 3)
+  assert standIn.shell("printf abc") == ("abc", 0)
+
+
+def test_shell_wrong_serial(standIn):
+  with pytest.raises(adbError):
+    adbClient("nosuch", port=standIn.port).shell("true")
+
+
+def test_shell_no_sh(request, tmp_path):
+  srv = adbStandIn(root=str(tmp_path), state="recovery", shell=False).start()
+  request.addfinalizer(srv.stop)
+  out, rc = adbClient(port=srv.port).shell("id")
+  assert rc == -1 and "failed: No such file" in out
+
+
+def test_exec(standIn, tmp_path):
+  data = os.urandom(3*65536+17)  # (Binary, every byte value, more than one recv)
+  sent, out = standIn.execIn("cat >blob.bin; md5sum blob.bin", io.BytesIO(data))
+  assert sent == len(data)
+  assert out.split()[0] == hashlib.md5(data).hexdigest()
+
+  back = io.BytesIO()
+  assert standIn.execOut("cat blob.bin", back) == len(data)
+  assert back.getvalue() == data
+
+
+def test_sync(standIn, tmp_path):
+  data = os.urandom(2*syncChunk+100)
+  with open("local.bin", 'wb') as ff:
+    ff.write(data)
+  (tmp_path/"root"/"cache").mkdir()
+  assert standIn.push("local.bin", "/cache/") == len(data)  # (Into the directory)
+  mode, size, mtime = standIn.stat("/cache/local.bin")
+  assert size == len(data) and mtime == int(os.path.getmtime("local.bin"))
+  assert standIn.stat("/cache/nosuch")[0] == 0
+
+  assert standIn.pull("/cache/local.bin", "back.bin") == len(data)
+  with open("back.bin", 'rb') as ff:
+    assert ff.read() == data
+
+  with pytest.raises(adbError):
+    standIn.pull("/cache/nosuch", "nosuch.bin")
+  assert not os.path.exists("nosuch.bin") and not os.path.exists("nosuch.bin.part")
+
+
+def test_native_push_pull_args(standIn, tmp_path, monkeypatch):
+  import examImg
+  monkeypatch.setattr(examImg, 'adbClient', lambda serial: adbClient(serial,
+    port=standIn.port))
+  (tmp_path/"root"/"data.txt").write_bytes(b"abc\n")
+  resp, rc = examImg.adbNative("standIn0", ["pull", "/data.txt"])
+  assert rc == 0 and "4 bytes" in resp
+  with open("data.txt", 'rb') as ff:  # (Into the current directory, like adb pull)
+    assert ff.read() == b"abc\n"
+  assert examImg.adbNative("standIn0", ["push", "data.txt"])[1] == 1
+  assert examImg.adbNative("standIn0", ["push", "-p", "data.txt", "/new.txt"])[1] == 0
+  assert (tmp_path/"root"/"new.txt").read_bytes() == b"abc\n"
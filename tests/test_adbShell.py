@@ -0,0 +1,53 @@
+import examImg
+from examImg import adbShell
+
+
+def test_output_and_rc(fakeAdb):
+  fakeAdb()
+  sh = adbShell()
+  try:
+    assert sh.run("echo one; echo two") == ("one\ntwo\n", 0)
+    assert sh.run("false") == ("", 1)
+  finally:
+    sh.close()
+
+
+def test_output_without_newline(fakeAdb):
+  fakeAdb()
+  sh = adbShell()
+  try:
+    assert sh.run("printf abc") == ("abc", 0)
+    assert sh.run("echo x; printf yz") == ("x\nyz", 0)
+  finally:
+    sh.close()
+
+
+def test_shell_fails_before_start(fakeAdb):
+  # The stock recovery has no sh, adb prints why and exits
+  fakeAdb("echo \"- exec '/system/bin/sh' failed: No such file or directory (2) -\"\n")
+  resp, rc = adbShell().run("id")
+  assert rc == -1
+  assert "failed: No such file" in resp
+
+
+def test_timeout(fakeAdb, monkeypatch):
+  fakeAdb()
+  sh = adbShell()
+  monkeypatch.setattr(sh, "timeout", 1)
+  resp, rc = sh.run("echo started; sleep 30")
+  assert rc == -1
+  assert resp.startswith("started\n") and "timed out" in resp
+  assert sh.proc is None
+
+
+def test_transport_chosen_once(monkeypatch):
+  import reviveMC74 as R
+  monkeypatch.delitem(R.arg, 'adb', raising=False)
+  monkeypatch.setattr(examImg, 'adbServerSeen', None)
+  answers = [False, True]
+  monkeypatch.setattr(examImg, 'adbServerUp', lambda: answers.pop(0))
+  assert examImg.adbTransport() == "session"
+  assert examImg.adbTransport() == "session"  # (An adb server started later is ignored)
+  assert answers == [True]
+  monkeypatch.setitem(R.arg, 'adb', 'exec')
+  assert examImg.adbTransport() == "exec"
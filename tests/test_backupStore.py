@@ -0,0 +1,36 @@
+'''backupStore: dedup and compression are reported separately, and restore'''
+import os
+from backupStore import backupStore, chunkSize
+
+
+def test_stats(tmp_path):
+  store = backupStore(str(tmp_path/"store"))
+  noise = os.urandom(chunkSize)  # (Doesn't compress)
+  with open("a.img", 'wb') as ff:  # A chunk of noise, then a zero chunk and a half
+    ff.write(noise+b"\0"*(chunkSize+chunkSize//2))
+  with open("b.img", 'wb') as ff:  # The same noise chunk, then a different zero tail
+    ff.write(noise+b"\0"*(chunkSize//4))
+  store.put("a.img", "MC74A", "boot")
+  store.put("b.img", "MC74B", "boot")
+
+  st = store.stats()
+  assert (st.manifests, st.devices, st.chunks) == (2, 2, 4)
+  assert st.logical == 3*chunkSize+chunkSize//2+chunkSize//4
+  assert st.unique == 2*chunkSize+chunkSize//2+chunkSize//4  # (noise is stored once)
+  assert abs(st.dedup-float(st.logical)/st.unique) < 1e-9
+  # (The zero chunks compress to almost nothing, the noise chunk is nearly all that's
+  # stored, so compression is close to unique/noise)
+  assert 2.5 < st.compression <= float(st.unique)/chunkSize
+  assert abs(st.ratio-st.dedup*st.compression) < 1e-9
+
+
+def test_restore(tmp_path):
+  store = backupStore(str(tmp_path/"store"))
+  data = os.urandom(chunkSize//3)*5
+  with open("a.img", 'wb') as ff:
+    ff.write(data)
+  man = store.put("a.img", "MC74A", "recovery")
+  assert store.find("MC74A", "recovery") == man.fid
+  store.restore(man.fid, "back.img")
+  with open("back.img", 'rb') as ff:
+    assert ff.read() == data
@@ -0,0 +1,30 @@
+'''bootCache: hits, misses, least recently used eviction, and a hit whose file goes away'''
+import os, time
+import bootCache as B
+
+
+def test_get_put_evict(tmp_path):
+  cache = B.bootCache(str(tmp_path/"cache"), maxBytes=2500)
+  keys = [cache.key(b"raw%d" % ii, 1) for ii in range(0, 3)]
+  assert cache.get(keys[0]) is None
+  cache.put(keys[0], b"a"*1000)
+  cache.put(keys[1], b"b"*1000)
+  old = time.time()-100  # (Make keys[0] the least recently used, then hit it)
+  for kk in keys[:2]:
+    os.utime(cache.path(kk), (old, old))
+  assert cache.get(keys[0]) == b"a"*1000
+  cache.put(keys[2], b"c"*1000)  # (3000 bytes, over maxBytes: keys[1] goes)
+  assert [ee.key for ee in cache.entries()] == [keys[0], keys[2]]
+  st = cache.stats()
+  assert (st.hits, st.misses, st.stores, st.evictions) == (1, 1, 3, 1)
+
+
+def test_hit_evicted_meanwhile(tmp_path, monkeypatch):
+  cache = B.bootCache(str(tmp_path/"cache"))
+  key = cache.key(b"raw", 1)
+  cache.put(key, b"img")
+  def gone(path, times):
+    raise OSError(2, "No such file or directory", path)
+  monkeypatch.setattr(B.os, 'utime', gone)
+  assert cache.get(key) == b"img"
+  assert cache.stats().hits == 1
@@ -0,0 +1,108 @@
+'''bootImg: parse -> build -> re-parse, and unpack -> pack of an image file'''
+import os, io, gzip, stat, hashlib, struct
+import pytest
+from bootImg import parseBootImg, buildBootImg, unpackBootFile, packBootFile
+from cpioNewc import cpioWriter, readEntries
+
+
+def ramdisk(secure):
+  cpio = io.BytesIO()
+  cw = cpioWriter(cpio)
+  cw.add("sbin", stat.S_IFDIR|0o755)
+  cw.add("default.prop", stat.S_IFREG|0o644, "ro.secure=%d\n" % secure)
+  cw.add("init", stat.S_IFREG|0o750, b"\x7fELF"+bytes(range(256)))
+  cw.close()
+  return gzip.compress(cpio.getvalue(), mtime=0)
+
+
+def test_build_parse_rebuild():
+  kernel, rd, second = os.urandom(5000), ramdisk(1), b"2nd"*10
+  cmdline = "console=ttyS0 "+"x"*600  # (Longer than the 512 byte cmdline field)
+  data = buildBootImg(kernel, rd, cmdline, base=0x80000000, pagesize=4096,
+    second=second, name="mc74")
+  img = parseBootImg(data)
+  assert (bytes(img.kernel), bytes(img.ramdisk), bytes(img.second)) == (kernel, rd, second)
+  assert (img.cmdline, img.name, img.base, img.pagesize) == (cmdline, "mc74", 0x80000000,
+    4096)
+  sha = hashlib.sha1()
+  for part in (kernel, rd, second):
+    sha.update(part+struct.pack("<I", len(part)))
+  assert img.id[:20] == sha.digest()
+  assert img.size == len(data) and len(data)%4096 == 0
+
+  again = buildBootImg(bytes(img.kernel), bytes(img.ramdisk), img.cmdline, img.base,
+    img.pagesize, bytes(img.second), img.name, img.kernelOff, img.ramdiskOff,
+    img.secondOff, img.tagsOff)
+  assert again == data
+  padded = parseBootImg(data+b"\0"*8192)  # (A partition backup, padded past the image)
+  assert padded.size == len(data) and bytes(padded.kernel) == kernel
+
+
+def test_bad_images():
+  with pytest.raises(ValueError):
+    parseBootImg(b"NOTANDROID"+b"\0"*4096)
+  data = buildBootImg(os.urandom(5000), ramdisk(1))
+  with pytest.raises(ValueError):
+    parseBootImg(data[:4000])  # (The kernel runs past the end)
+
+
+def test_unpack_pack():
+  kernel = os.urandom(3000)
+  with open("rmcBoot.imgRaw", 'wb') as ff:
+    ff.write(buildBootImg(kernel, ramdisk(1), "console=ttyS0", base=0x10000000))
+  res = unpackBootFile("rmcBoot.imgRaw")
+  assert os.path.isdir("rmcBootUnpack") and os.path.isdir("rmcBootRamdisk")
+  assert len(res.entries) == 3
+  with open("rmcBootRamdisk/default.prop", 'w') as ff:  # (What fixPart does)
+    ff.write("ro.secure=0\n")
+
+  packed = packBootFile("rmcBootUnpack", "rmcBootRamdisk", "rmcBoot.img")
+  assert packed.entries == 3
+  with open("rmcBoot.img", 'rb') as ff:
+    img = parseBootImg(ff.read())
+  assert bytes(img.kernel) == kernel
+  assert (img.cmdline, img.base, img.pagesize) == ("console=ttyS0", 0x10000000, 2048)
+  ents = dict((ent.name, ent) for ent in readEntries(io.BytesIO(gzip.decompress(
+    bytes(img.ramdisk)))))
+  assert ents["default.prop"].data == b"ro.secure=0\n"
+  assert ents["init"].data == b"\x7fELF"+bytes(range(256))
+  assert stat.S_ISDIR(ents["sbin"].mode)
+
+
+def test_fixBootImg():
+  import reviveMC74 as R
+  cpio = io.BytesIO()
+  cw = cpioWriter(cpio)
+  cw.add("sbin", stat.S_IFDIR|0o750, mtime=1400000000)
+  cw.add("default.prop", stat.S_IFREG|0o664,
+    "ro.secure=1\r\n\r\npersist.meraki.usb_debug=0\r\nro.debuggable=0\r\n")
+  cw.add("init", stat.S_IFREG|0o750, b"\x7fELF"+bytes(range(256)))
+  cw.add("init.rc", stat.S_IFREG|0o640, "on init\n    symlink /system/etc /etc\n"
+    "    mkdir /mnt 0775\n")
+  cw.add("sbin/adbd", stat.S_IFLNK|0o777, "/init")
+  cw.close()
+  kernel, second = os.urandom(5000), b"2nd"*10
+  raw = buildBootImg(kernel, gzip.compress(cpio.getvalue(), mtime=0), "console=ttyS0",
+    base=0x80000000, pagesize=4096, second=second, name="mc74", kernelOff=0x10008000,
+    ramdiskOff=0x11000000, secondOff=0x10f00000, tagsOff=0x10000100)
+
+  fixed = R.fixBootImg(raw)
+  img, orig = parseBootImg(fixed), parseBootImg(raw)
+  for key in ("cmdline", "name", "base", "pagesize", "kernelOff", "ramdiskOff",
+      "secondOff", "tagsOff"):
+    assert getattr(img, key) == getattr(orig, key), key
+  assert (bytes(img.kernel), bytes(img.second)) == (kernel, second)
+  ents = dict((ent.name, ent) for ent in readEntries(io.BytesIO(gzip.decompress(
+    bytes(img.ramdisk)))))
+  assert ents["default.prop"].data == (b"ro.secure=0\npersist.meraki.usb_debug=1\n"
+    b"ro.debuggable=0")
+  assert ents["default.prop"].mode == stat.S_IFREG|0o644  # (go-w, or init ignores it)
+  assert ents["init.rc"].data == (b"on init\n    symlink /system/etc /etc\n"
+    b"    symlink /storage/emulated/legacy/ssm /ssm\n    mkdir /mnt 0775\n")
+  assert ents["init.rc"].mode == stat.S_IFREG|0o640
+  assert (ents["sbin"].mode, ents["sbin"].mtime) == (stat.S_IFDIR|0o750, 1400000000)
+  assert ents["init"].mode == stat.S_IFREG|0o750
+  assert ents["init"].data == b"\x7fELF"+bytes(range(256))
+  assert (ents["sbin/adbd"].mode, ents["sbin/adbd"].data) == (stat.S_IFLNK|0o777,
+    b"/init")
+  assert R.fixBootImg(fixed) == fixed  # (Fixing it again changes nothing)
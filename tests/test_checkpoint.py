@@ -0,0 +1,78 @@
+'''checkpoint: reruns skip recorded objectives until their inputs change, verify=full'''
+import os, json
+from ribou import bunch
+from checkpoint import checkpoint
+from objSched import objSched
+
+
+def nodes(ran):
+  def node(name, needs):
+    def func():
+      ran.append(name)
+      return True
+    return bunch(name=name, func=func, needs=needs, done=None, host=False)
+  return {"fixPart": node("fixPart", []), "flashPart": node("flashPart", ["fixPart"])}
+
+
+def ckpt(args=None, trust=True, state=None):
+  return checkpoint(lambda: "MC74A", {"fixPart": lambda: ["rmcBoot.imgRaw"],
+    "flashPart": lambda: ["rmcBoot.img"]}, lambda: args or {"part": "boot"},
+    state=state, trust=trust, log=lambda msg: None)
+
+
+def rerun(**kw):
+  ran = []
+  sched = objSched(nodes(ran), log=lambda msg: None, checkpoint=ckpt(**kw))
+  assert sched.run("flashPart")
+  return ran
+
+
+def test_rerun_skips_until_input_changes():
+  for fid in ("rmcBoot.imgRaw", "rmcBoot.img"):
+    with open(fid, 'wb') as ff:
+      ff.write(b"x"*1000)
+  state = bunch(mac="00:18:0a:01:02:03", error=["old"])
+  ran = []
+  cp = ckpt(state=state)
+  assert objSched(nodes(ran), log=lambda msg: None, checkpoint=cp).run("flashPart")
+  assert ran == ["fixPart", "flashPart"]
+  data = json.load(open("checkpoints/MC74A.json"))
+  assert sorted(data["objectives"]) == ["fixPart", "flashPart"]
+  assert data["state"] == {"mac": "00:18:0a:01:02:03"}  # (Not the errors)
+  assert ckpt().isDone("fixPart")
+
+  assert rerun() == ["flashPart"]  # (fixPart is in the checkpoint, the target is redone)
+
+  os.utime("rmcBoot.imgRaw", ns=(1, 1))  # (A new mtime, same contents: still done)
+  assert rerun() == ["flashPart"]
+  with open("rmcBoot.imgRaw", 'r+b') as ff:
+    ff.write(b"y")  # (Same size, new contents)
+  assert not ckpt().isDone("fixPart")
+  assert rerun() == ["fixPart", "flashPart"]
+  assert rerun(args={"part": "recovery"}) == ["fixPart", "flashPart"]
+  os.remove("rmcBoot.imgRaw")
+  assert not ckpt().isDone("fixPart")
+
+
+def test_verify_full():
+  with open("rmcBoot.imgRaw", 'wb') as ff:
+    ff.write(b"x"*1000)
+  assert rerun() == ["fixPart", "flashPart"]
+  assert rerun() == ["flashPart"]
+  assert not ckpt(trust=False).isDone("fixPart")
+  assert rerun(trust=False) == ["fixPart", "flashPart"]  # (Reassessed, not trusted)
+  assert rerun() == ["flashPart"]  # (But still recorded, for the next run)
+
+
+def test_failed_is_forgotten():
+  with open("rmcBoot.imgRaw", 'wb') as ff:
+    ff.write(b"x"*1000)
+  cp = ckpt()
+  cp.done("fixPart", True)
+  assert ckpt().isDone("fixPart")
+  cp.done("fixPart", False)
+  assert not ckpt().isDone("fixPart")
+  noSerial = checkpoint(lambda: None, {"fixPart": lambda: []}, lambda: {},
+    log=lambda msg: None)
+  noSerial.done("fixPart", True)
+  assert not noSerial.isDone("fixPart") and os.listdir("checkpoints") == ["MC74A.json"]
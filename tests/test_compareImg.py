@@ -0,0 +1,35 @@
+'''compareImg: the signature columns of two unpacked boot images'''
+import os, io, gzip, stat
+import examImg
+from bootImg import buildBootImg
+from cpioNewc import cpioWriter
+
+
+def makeImg(fid, secure):
+  '''Write a small boot image whose ramdisk has a default.prop with ro.secure=secure'''
+  cpio = io.BytesIO()
+  cw = cpioWriter(cpio)
+  cw.add("default.prop", stat.S_IFREG|0o644, "ro.secure=%d\n" % secure)
+  cw.add("init.rc", stat.S_IFREG|0o750, "on boot\n")
+  cw.close()
+  with open(fid, 'wb') as ff:
+    ff.write(buildBootImg(b"kernel"*100, gzip.compress(cpio.getvalue(), mtime=0),
+      "console=ttyS0"))
+
+
+def test_compare_two_images(capsys):
+  makeImg("orig.img", 1)
+  makeImg("fixed.img", 0)
+  assert examImg.unpackImg("orig.img", "imgOrig") is not None
+  assert examImg.unpackImg("fixed.img", "imgFixed") is not None
+  capsys.readouterr()
+  examImg.compareImg([])
+  out = capsys.readouterr().out
+  lines = [ln for ln in out.split('\n') if "default.prop" in ln]
+  assert len(lines) == 1
+  assert lines[0].count('*') == 1  # (imgFixed, the reference, vs imgOrig's changed file)
+  assert "init.rc" in out and "ramdisk.gz" in out
+
+  sig = examImg.makeSignature(examImg.analyzeDir("imgFixed"), examImg.analyzeDir("imgOrig"))
+  assert [ln.split()[0] for ln in sig if ln.startswith("  ")][-2:] == ["default.prop",
+    "init.rc"]
@@ -0,0 +1,84 @@
+'''cpioNewc: write -> read round trips, and extract -> re-archive of a directory'''
+import os, io, stat
+import pytest
+from cpioNewc import cpioWriter, readEntries, extractEntries, dirEntries
+
+
+def archive(entries):
+  buf = io.BytesIO()
+  cw = cpioWriter(buf)
+  for ent in entries:
+    cw.add(*ent)
+  cw.close()
+  return buf.getvalue()
+
+
+def test_write_read():
+  data = archive([("sbin", stat.S_IFDIR|0o755, b"", 1600000000),
+    ("sbin/adbd", stat.S_IFREG|0o750, bytes(range(256))*3, 1600000001),
+    ("init.rc", stat.S_IFREG|0o644, "on boot\n"),  # (str data, sizes not a multiple of 4)
+    ("empty", stat.S_IFREG|0o600, b""),
+    ("charger", stat.S_IFLNK|0o777, "/sbin/healthd")])
+  assert len(data)%4 == 0
+  ents = list(readEntries(io.BytesIO(data)))
+  assert [ee.name for ee in ents] == ["sbin", "sbin/adbd", "init.rc", "empty", "charger"]
+  assert ents[1].data == bytes(range(256))*3 and ents[1].mtime == 1600000001
+  assert ents[1].mode == stat.S_IFREG|0o750 and (ents[1].uid, ents[1].gid) == (0, 0)
+  assert ents[0].nlink == 2 and ents[1].nlink == 1
+  assert ents[2].data == b"on boot\n" and ents[3].data == b""
+  assert ents[4].data == b"/sbin/healthd"
+
+  again = io.BytesIO()  # Writing the entries read gives the same archive
+  cw = cpioWriter(again)
+  for ent in ents:
+    cw.addEntry(ent)
+  cw.close()
+  assert again.getvalue() == data
+
+
+def test_empty_and_truncated():
+  assert list(readEntries(io.BytesIO(archive([])))) == []  # (Just the trailer)
+  data = archive([("init.rc", stat.S_IFREG|0o644, "on boot\n")])
+  with pytest.raises(ValueError):
+    list(readEntries(io.BytesIO(data[:-20])))
+  with pytest.raises(ValueError):
+    list(readEntries(io.BytesIO(b"070707"+data[6:])))  # (Old binary cpio magic)
+
+
+def test_extract_rearchive():
+  data = archive([("sbin", stat.S_IFDIR|0o755, b"", 1600000000),
+    ("default.prop", stat.S_IFREG|0o644, "ro.secure=1\n", 1600000002),
+    ("sbin/adbd", stat.S_IFREG|0o750, b"\x7fELF", 1600000001),
+    ("sbin/sh", stat.S_IFLNK|0o777, "adbd")])
+  os.mkdir("rd")
+  lines = extractEntries(readEntries(io.BytesIO(data)), "rd")
+  assert lines[2].startswith("-rwxr-x---") and lines[3].endswith("sbin/sh -> adbd")
+  assert os.path.getmtime("rd/sbin/adbd") == 1600000001
+  assert os.path.getmtime("rd/sbin") == 1600000000  # (Set after its files were written)
+  assert os.readlink("rd/sbin/sh") == "adbd"
+
+  ents = list(dirEntries("rd"))
+  assert [ee.name for ee in ents] == ["default.prop", "sbin", "sbin/adbd", "sbin/sh"]
+  buf = io.BytesIO()
+  cw = cpioWriter(buf)
+  for ent in ents:
+    cw.addEntry(ent)
+  cw.close()
+  back = dict((ee.name, ee) for ee in readEntries(io.BytesIO(buf.getvalue())))
+  assert back["default.prop"].data == b"ro.secure=1\n"
+  assert back["sbin/adbd"].mode == stat.S_IFREG|0o750
+  assert back["sbin/adbd"].mtime == 1600000001
+  assert stat.S_ISLNK(back["sbin/sh"].mode) and back["sbin/sh"].data == b"adbd"
+
+
+def test_extract_read_only_dir():
+  data = archive([("res", stat.S_IFDIR|0o555, b"", 1600000000),
+    ("res/images", stat.S_IFDIR|0o555, b"", 1600000001),
+    ("res/images/charger.png", stat.S_IFREG|0o444, b"\x89PNG", 1600000002)])
+  os.mkdir("rd")
+  extractEntries(readEntries(io.BytesIO(data)), "rd")
+  assert stat.S_IMODE(os.stat("rd/res/images").st_mode) == 0o555
+  assert (os.path.getmtime("rd/res"), os.path.getmtime("rd/res/images")) == (1600000000,
+    1600000001)
+  with open("rd/res/images/charger.png", 'rb') as ff:
+    assert ff.read() == b"\x89PNG"
@@ -0,0 +1,131 @@
+'''dbOffline (its golden favorites file, putting the database back on the device) and
+dbBatch failures'''
+import os, stat, shutil, sqlite3
+import examImg
+from examImg import dbBatch, dbOffline
+
+# A fake adb whose pull/push just copy (the 'device' files are local files), a FAILPUSH
+# file makes push fail
+copyAdb = '''[ "$1" = "-s" ] && shift 2
+if [ "$1" = "push" ] && [ -f FAILPUSH ]; then echo "error: device offline"; exit 1; fi
+if [ "$1" = "pull" ] || [ "$1" = "push" ]; then cp "$2" "$3"; exit $?; fi
+if [ "$1" = "shell" ]; then shift; [ $# = 0 ] && exec sh; exec sh -c "$*"; fi
+'''
+
+
+def makeDb(fid):
+  conn = sqlite3.connect(fid)
+  conn.execute("create table favorites (_id integer primary key, title text, icon blob)")
+  conn.execute("insert into favorites values (1, 'Phone', ?)", (b"\x89PNG\x00\xff",))
+  conn.execute("insert into favorites values (2, 'Google', NULL)")
+  conn.commit()
+  conn.close()
+
+
+def rows(fid):
+  conn = sqlite3.connect(fid)
+  try:
+    return conn.execute("select * from favorites order by _id").fetchall()
+  finally:
+    conn.close()
+
+
+def test_golden_with_blobs(fakeAdb):
+  fakeAdb(copyAdb)
+  makeDb("phone1.db")
+  bb = dbBatch(os.path.abspath("phone1.db"))
+  bb.cmd("delete from favorites where title='Google'")
+  assert dbOffline(os.path.abspath("phone1.db"), bb, "golden.json", owner="").ok
+  assert rows("phone1.db") == [(1, "Phone", b"\x89PNG\x00\xff")]
+  assert os.path.isfile("golden.json")
+
+  makeDb("phone2.db")  # The golden rows replace phone2's favorites, BLOBs and all
+  assert dbOffline(os.path.abspath("phone2.db"), dbBatch(os.path.abspath("phone2.db")),
+    "golden.json", owner="").ok
+  assert rows("phone2.db") == [(1, "Phone", b"\x89PNG\x00\xff")]
+
+
+def test_corrupt_golden(fakeAdb):
+  fakeAdb(copyAdb)
+  with open("golden.json", 'w') as ff:
+    ff.write('{"table": "favorites", "columns": ["_id"], "rows": [[1')  # (Cut short)
+  makeDb("phone.db")
+  bb = dbBatch(os.path.abspath("phone.db"))
+  bb.cmd("delete from favorites where title='Google'")
+  assert dbOffline(os.path.abspath("phone.db"), bb, "golden.json", owner="").ok
+  assert rows("phone.db") == [(1, "Phone", b"\x89PNG\x00\xff")]
+  assert examImg.readGolden("golden.json")["rows"] == [[1, "Phone", b"\x89PNG\x00\xff"]]
+
+
+def test_batch_failure_marks_all(fakeAdb):
+  '''A failed batch is rolled back, so no statement in it is reported ok'''
+  fakeAdb(copyAdb)
+  makeDb("phone.db")
+  for run in ("device", "local"):
+    bb = dbBatch(os.path.abspath("phone.db"))
+    bb.cmd("delete from favorites where title='Google'")
+    bb.cmd("insert into nosuchtable values (1)")
+    if run=="device":
+      res = bb.run()
+    else:
+      conn = sqlite3.connect("phone.db")
+      res = bb.runLocal(conn)
+      conn.close()
+    assert not res.ok
+    assert [rr.ok for rr in res.results] == [False, False]
+    assert [rr.changes for rr in res.results] == [None, None]
+    assert any("nosuchtable" in ln for ln in res.results[1].rows)
+    assert len(rows("phone.db")) == 2
+
+
+def test_push_fails(fakeAdb):
+  fakeAdb(copyAdb)
+  makeDb("phone.db")
+  open("FAILPUSH", 'w').close()
+  bb = dbBatch(os.path.abspath("phone.db"))
+  bb.cmd("delete from favorites where title='Google'")
+  res = dbOffline(os.path.abspath("phone.db"), bb, owner="")
+  assert not res.ok and not any(rr.ok for rr in res.results)
+  assert len(rows("phone.db")) == 2  # (Unchanged)
+
+
+def test_mode_and_wal(fakeAdb):
+  '''The database's mode is kept, and changes only in its -wal file aren't lost'''
+  fakeAdb(copyAdb)
+  makeDb("wal.db")
+  conn = sqlite3.connect("wal.db")
+  conn.execute("pragma journal_mode=wal")
+  conn.execute("pragma wal_autocheckpoint=0")
+  conn.execute("insert into favorites values (3, 'Clock', NULL)")
+  conn.commit()
+  shutil.copy("wal.db", "phone.db")  # (The 'device' database, row 3 only in its -wal)
+  shutil.copy("wal.db-wal", "phone.db-wal")
+  conn.close()
+  os.chmod("phone.db", 0o640)
+
+  bb = dbBatch(os.path.abspath("phone.db"))
+  bb.cmd("delete from favorites where title='Google'")
+  assert dbOffline(os.path.abspath("phone.db"), bb).ok
+  assert not os.path.exists("phone.db-wal")
+  assert stat.S_IMODE(os.stat("phone.db").st_mode) == 0o640
+  assert [rr[:2] for rr in rows("phone.db")] == [(1, "Phone"), (3, "Clock")]
+
+
+def test_batch_commit_fails(fakeAdb):
+  '''A COMMIT that fails (another connection is reading) leaves every statement not ok'''
+  fakeAdb(copyAdb)
+  makeDb("phone.db")
+  reader = sqlite3.connect("phone.db", isolation_level=None)
+  reader.execute("begin")
+  reader.execute("select * from favorites").fetchall()  # (Holds a SHARED lock)
+  try:
+    bb = dbBatch(os.path.abspath("phone.db"))
+    bb.cmd("delete from favorites where title='Google'")
+    res = bb.run()
+  finally:
+    reader.execute("rollback")
+    reader.close()
+  assert not res.ok
+  assert not res.results[0].ok and res.results[0].changes is None
+  assert any("locked" in ln for ln in res.results[0].rows)
+  assert len(rows("phone.db")) == 2
@@ -0,0 +1,48 @@
+'''deltaPartFlash: its shell commands stay under adbd's limit, and dd failures count'''
+import os
+import examImg
+import reviveMC74 as R
+from examImg import deltaPartFlash
+
+# adb push copies into ./cache, which stands in for the device's /cache, shell runs the
+# command locally, and (like adbd) refuses one longer than 4096 bytes
+cacheAdb = '''[ "$1" = "-s" ] && shift 2
+CACHE="$PWD/cache"
+if [ "$1" = "push" ]; then cp "$2" "$CACHE/$(basename "$3")"; exit $?; fi
+if [ "$1" = "shell" ]; then shift; cmd="$*"
+  if [ ${#cmd} -gt 4096 ]; then echo "error: command too long"; exit 1; fi
+  exec sh -c "$(printf '%s' "$cmd" | sed "s#/cache/#$CACHE/#g")"; fi
+echo "fake adb $*"
+'''
+bs = 512
+
+
+def setup(fakeAdb, monkeypatch):
+  fakeAdb(cacheAdb)
+  monkeypatch.setitem(R.arg, 'adb', 'exec')
+  os.mkdir("cache")
+
+
+def test_delta_flash_many_blocks(fakeAdb, monkeypatch):
+  setup(fakeAdb, monkeypatch)
+  old = os.urandom(bs*1000+100)
+  new = bytearray(old)
+  for ii in range(0, 1000, 3):  # (334 blocks differ, too many for one dd loop command)
+    new[ii*bs] ^= 0xff
+  with open("part.img", 'wb') as ff:
+    ff.write(old)
+  with open("new.img", 'wb') as ff:
+    ff.write(new)
+  assert deltaPartFlash("new.img", [os.path.abspath("part.img")], bs)
+  with open("part.img", 'rb') as ff:
+    assert ff.read() == bytes(new)
+  assert os.listdir("cache") == []
+
+
+def test_delta_flash_dd_fails(fakeAdb, monkeypatch):
+  setup(fakeAdb, monkeypatch)
+  new = bytearray(bs*20)  # /dev/full reads as zeros, but every write to it fails
+  new[bs*3] = 1
+  with open("new.img", 'wb') as ff:
+    ff.write(new)
+  assert not deltaPartFlash("new.img", ["/dev/full"], bs)
@@ -0,0 +1,67 @@
+'''deviceFacts, and replaceRecovery's stock recovery check, through each adb transport'''
+import pytest
+import examImg, adbClient
+import reviveMC74 as R
+
+stockAdb = '''[ "$1" = "-s" ] && shift 2
+if [ "$1" = "devices" ]; then printf "List of devices attached\\nMC74A\\trecovery\\n\\n"; exit 0; fi
+if [ "$1" = "shell" ]; then
+  echo "- exec '/system/bin/sh' failed: No such file or directory (2) -"; exit 255; fi
+echo "fake adb $*"
+'''
+cwmAdb = '''[ "$1" = "-s" ] && shift 2
+if [ "$1" = "devices" ]; then printf "List of devices attached\\nMC74A\\trecovery\\n\\n"; exit 0; fi
+if [ "$1" = "shell" ]; then shift; [ $# -eq 0 ] && exec sh; exec sh -c "$*"; fi
+echo "fake adb $*"
+'''
+
+
+@pytest.fixture
+def transport(request, monkeypatch, tmp_path):
+  '''Set the adb= transport; for 'native' start an adbStandIn (hasSh says if it has sh)'''
+  def use(name, hasSh):
+    monkeypatch.setitem(R.arg, 'adb', name)
+    monkeypatch.setattr(examImg, 'adbSessions', {})
+    if name=="native":
+      srv = adbClient.adbStandIn(root=str(tmp_path), state="recovery", shell=hasSh).start()
+      request.addfinalizer(srv.stop)
+      monkeypatch.setattr(examImg, 'adbClient',
+        lambda host: adbClient.adbClient(host, port=srv.port))
+  return use
+
+
+@pytest.mark.parametrize("name", ["exec", "session", "native"])
+def test_stock_recovery(fakeAdb, transport, name):
+  fakeAdb(stockAdb)
+  transport(name, False)
+  facts = R.deviceFacts(refresh=True)
+  assert facts.mode == "recovery"
+  assert not facts.shell
+  assert R.stockRecovery(facts)
+
+
+@pytest.mark.parametrize("name", ["exec", "session", "native"])
+def test_replaced_recovery(fakeAdb, transport, name):
+  fakeAdb(cwmAdb)
+  transport(name, True)
+  facts = R.deviceFacts(refresh=True)
+  assert facts.mode == "recovery"
+  assert facts.shell
+  assert not R.stockRecovery(facts)
+
+
+def test_parse_facts(monkeypatch):
+  raw = ("@@secure\r\nro.secure=0\r\n@@id\r\nuid=0(root) gid=0(root)\r\n@@mountData\r\n"
+    "@@versionDate\r\nboot.versionDate 2024-01-02 03:04:05 8388608 rmcBoot.img ab12cd34\r\n"
+    "@@apps\r\n-rw-r--r-- system   system    1234 2021-05-01 12:00 revive.MC74-1.apk\r\n"
+    "@@clickOrig\r\n/system/bin/clickOrig\r\n"
+    "@@mac\r\n    link/ether e0:55:3d:50:56:10 brd ff:ff:ff:ff:ff:ff\r\n@@end\r\n")
+  monkeypatch.setattr(R, 'executeLog', lambda cmd: ("List\nX1\tdevice\n", 0))
+  monkeypatch.setattr(R, 'executeAdb', lambda cmd: (raw, 0))
+  facts = R.deviceFacts(refresh=True)
+  assert (facts.mode, facts.serialNo, facts.secure, facts.root) == ("normal", "X1", "0", True)
+  assert facts.versionDate == {"boot": ["2024-01-02", "03:04:05", "8388608", "rmcBoot.img",
+    "ab12cd34"]}
+  assert R.lsDtTm('\n'.join(facts.apps), "revive.MC74") == ["2021-05-01", "12:00", 1234]
+  assert facts.clickOrig and facts.mac == "e0:55:3d:50:56:10"
+  assert not R.stockRecovery(facts)
@@ -0,0 +1,36 @@
+'''editLinesMulti and editFileMulti: edited, already done, and not found edits'''
+from ribou import bunch
+from examImg import editLinesMulti, editFileMulti
+
+
+def test_edit_statuses():
+  lines = ["ro.secure=1", "ro.debuggable=0", "symlink /system/etc /etc"]
+  edits = [bunch(find="ro.secure=", replace="ro.secure=0"),
+    bunch(find="symlink /system/etc", insert="symlink /ssm"),
+    bunch(find="ro.adb.secure=", replace="ro.adb.secure=0")]
+  new, report = editLinesMulti(lines, edits)
+  assert new == ["ro.secure=0", "ro.debuggable=0", "symlink /system/etc /etc",
+    "symlink /ssm"]
+  assert [rr.status for rr in report] == ["edited", "edited", "notFound"]
+  again, report = editLinesMulti(new, edits)
+  assert again == new
+  assert [rr.status for rr in report] == ["already", "already", "notFound"]
+
+
+def test_replacement_elsewhere_is_not_found():
+  lines = ["reg_expires=1200", "#reg_expires=600", "symlink /ssm", "symlink /system/etc"]
+  new, report = editLinesMulti(lines, [
+    bunch(find="reg_expires=3600", replace="#reg_expires=600"),
+    bunch(find="symlink /system/etc", insert="symlink /ssm")])
+  assert [rr.status for rr in report] == ["notFound", "edited"]
+  assert new == lines+["symlink /ssm"]
+
+
+def test_edit_file():
+  with open("default.prop", 'w') as ff:
+    ff.write("ro.secure=1\r\npersist.meraki.usb_debug=0\r\n")
+  report = editFileMulti("default.prop", [bunch(find="ro.secure=", replace="ro.secure=0"),
+    bunch(find="persist.meraki.usb_debug=", replace="persist.meraki.usb_debug=1")])
+  assert [rr.status for rr in report] == ["edited", "edited"]
+  assert open("default.prop").read() == "ro.secure=0\npersist.meraki.usb_debug=1\n"
+  assert editFileMulti("missing.prop", [bunch(find="x")]) == False
@@ -0,0 +1,47 @@
+'''fleet: which devices it uses, and a device that needs the operator'''
+import os, subprocess
+import reviveMC74 as R
+
+
+def test_operator_step_unattended(monkeypatch):
+  monkeypatch.setitem(R.arg, 'unattended', '1')
+  monkeypatch.setitem(R.arg, 'serial', 'MC74A')
+  monkeypatch.setitem(R.state, 'error', [])
+  monkeypatch.setitem(R.state, 'needed', [])
+  assert not R.operatorStep("hold mute")
+  assert "operator" in R.state.needed
+  assert "MC74A" in R.state.error[0]
+
+
+def test_fleet_devices(monkeypatch):
+  monkeypatch.setattr(R, 'listDevices', lambda: [["MC74A", "recovery"],
+    ["MC74B", "unauthorized"], ["MC74C", "device"], ["MC74D", "offline"]])
+  ran = {}
+  def call(cmd, **kw):
+    serial = [aa for aa in cmd if aa.startswith("serial=")][0][7:]
+    ran[serial] = cmd
+    return R.operatorRc if serial=="MC74C" else 0
+  monkeypatch.setattr(subprocess, 'call', call)
+  monkeypatch.setitem(R.state, 'error', [])
+  monkeypatch.setitem(R.state, 'fleet', None)
+  assert not R.fleetFunc()
+  assert sorted(ran) == ["MC74A", "MC74C"]
+  assert all("unattended=1" in cmd for cmd in ran.values())
+  assert [(rr.serial, rr.ok, rr.rc) for rr in R.state.fleet] == [("MC74A", True, 0),
+    ("MC74C", False, R.operatorRc)]
+
+
+def test_fleet_needs_checkFiles(monkeypatch):
+  monkeypatch.setitem(R.arg, 'serial', 'MC74A')
+  assert R.objectiveSched().plan("fleet").order == ["checkFiles", "fleet"]
+
+
+def test_fleet_flag_only_after_checkFiles(monkeypatch):
+  monkeypatch.setattr(R, 'listDevices', lambda: [["MC74A", "recovery"]])
+  monkeypatch.setattr(subprocess, 'call', lambda cmd, **kw: 0)
+  monkeypatch.setitem(R.state, 'fleet', None)
+  assert R.fleetFunc()
+  assert not os.path.exists("fleet/MC74A/"+R.filesPresentFid)  # (checkFiles didn't pass)
+  R.writeFile(R.filesPresentFid, "ok")
+  assert R.fleetFunc()
+  assert os.path.isfile("fleet/MC74A/"+R.filesPresentFid)
@@ -0,0 +1,71 @@
+'''imgDiff: the merged walk of img* trees, and the text and JSON reports'''
+import os, io, json
+from imgDiff import diffImgs, writeText, writeJson, imgDiff
+
+
+def makeImg(name, files, links={}):
+  '''An unpacked image directory: files is {path below the img dir: data}'''
+  os.makedirs(os.path.join(name, "rmcBootRamdisk"))
+  os.makedirs(os.path.join(name, "rmcBootUnpack"))
+  for path, data in files.items():
+    fid = os.path.join(name, path)
+    if not os.path.isdir(os.path.dirname(fid)):
+      os.makedirs(os.path.dirname(fid))
+    with open(fid, 'wb') as ff:
+      ff.write(data)
+  for path, target in links.items():
+    os.symlink(target, os.path.join(name, path))
+
+
+def test_diff():
+  makeImg("imgA", {"rmcBoot.imgA": b"A"*100, "rmcBootUnpack/cmdline": b"console=ttyS0\n",
+    "rmcBootRamdisk/default.prop": b"ro.secure=1\r\nro.debuggable=0\r\n",
+    "rmcBootRamdisk/sbin/adbd": b"\x7fELF\0"*10, "rmcBootRamdisk/old.rc": b"x\n"},
+    {"rmcBootRamdisk/sbin/sh": "adbd"})
+  makeImg("imgB", {"rmcBoot.imgB": b"B"*120, "rmcBootUnpack/cmdline": b"console=ttyS0\n",
+    "rmcBootRamdisk/default.prop": b"ro.secure=0\nro.debuggable=0\n",
+    "rmcBootRamdisk/sbin/adbd": b"\x7fELF\0"*10, "rmcBootRamdisk/new.rc": b"y\n"},
+    {"rmcBootRamdisk/sbin/sh": "toybox"})
+  makeImg("imgC", {"rmcBoot.imgC": b"A"*100, "rmcBootUnpack/cmdline": b"console=ttyS0\n",
+    "rmcBootRamdisk/default.prop": b"ro.secure=1\nro.debuggable=0\n",
+    "rmcBootRamdisk/sbin/adbd": b"\x7fELF\0"*11, "rmcBootRamdisk/old.rc": b"x\n"},
+    {"rmcBootRamdisk/sbin/sh": "adbd"})
+
+  diffs = dict((dd.path, dict((ch.img, ch) for ch in dd.changes))
+    for dd in diffImgs(["imgA", "imgB", "imgC"]))
+  assert sorted(diffs) == ["img", "ramdisk/default.prop", "ramdisk/new.rc",
+    "ramdisk/old.rc", "ramdisk/sbin/adbd", "ramdisk/sbin/sh"]
+  assert (diffs["img"]["imgB"].status, diffs["img"]["imgB"].size,
+    diffs["img"]["imgB"].refSize) == ("changed", 120, 100)
+  assert "imgC" not in diffs["img"]
+  assert diffs["ramdisk/default.prop"]["imgB"].lines == ["-ro.secure=1", "+ro.secure=0"]
+  assert diffs["ramdisk/default.prop"]["imgC"].lines == []  # (Only the line ends differ)
+  assert diffs["ramdisk/new.rc"]["imgB"].status == "added"
+  assert diffs["ramdisk/old.rc"]["imgB"].status == "removed"
+  assert list(diffs["ramdisk/new.rc"]) == ["imgB"]
+  adbd = diffs["ramdisk/sbin/adbd"]["imgC"]
+  assert (adbd.status, adbd.size) == ("changed", 55) and 'lines' not in adbd  # (Binary)
+  sh = diffs["ramdisk/sbin/sh"]["imgB"]
+  assert (sh.link, sh.refLink) == ("toybox", "adbd")
+
+  out = io.StringIO()
+  assert writeText(["imgA", "imgB", "imgC"], out) == 6
+  text = out.getvalue()
+  assert "ramdisk/default.prop\n  imgB       changed (30 -> 28 bytes)\n" in text
+  assert "      -ro.secure=1\n      +ro.secure=0\n" in text
+  assert "(-> toybox  was -> adbd)" in text and text.endswith("6 paths differ\n")
+
+  out = io.StringIO()
+  assert writeJson(["imgA", "imgB"], out) == 5
+  res = json.loads(out.getvalue())
+  assert res["reference"] == "imgA" and res["count"] == 5
+  assert [dd["path"] for dd in res["diffs"]] == ["img", "ramdisk/default.prop",
+    "ramdisk/new.rc", "ramdisk/old.rc", "ramdisk/sbin/sh"]
+
+
+def test_same_and_too_few():
+  makeImg("imgA", {"rmcBootRamdisk/init.rc": b"on init\n"})
+  makeImg("imgB", {"rmcBootRamdisk/init.rc": b"on init\n"})
+  assert list(diffImgs(["imgA", "imgB"])) == []
+  assert imgDiff([])  # (All the img* directories in the cwd)
+  assert not imgDiff(["imgA"])
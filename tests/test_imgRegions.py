@@ -0,0 +1,38 @@
+'''imgRegions: block entropy (in bounded memory), zero blocks and differing blocks'''
+import os, tracemalloc
+import pytest
+np = pytest.importorskip("numpy")
+import imgRegions as IR
+
+
+def test_block_entropy():
+  blk = np.zeros((3, 4096), dtype=np.uint8)
+  blk[1] = np.arange(4096) % 256  # (Every byte value equally often: 8 bits/byte)
+  blk[2, :2048] = 1  # (Two values, half each: 1 bit/byte)
+  assert np.allclose(IR.blockEntropy(np, blk), [0.0, 8.0, 1.0])
+
+
+def test_block_entropy_memory():
+  '''A 16MB chunk is counted 1MB at a time, not through one 128MB int64 index'''
+  blk = np.frombuffer(os.urandom(16*1024*1024), dtype=np.uint8).reshape(-1, 4096)
+  tracemalloc.start()
+  try:
+    entropy = IR.blockEntropy(np, blk)
+    peak = tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+  assert peak < 32*1024*1024
+  assert entropy.shape == (4096,) and (entropy > 7.9).all()
+
+
+def test_stats_and_diff(monkeypatch):
+  monkeypatch.setattr(IR, 'chunkBytes', 4*4096)  # (Several chunks)
+  ref = np.zeros(10*4096+100, dtype=np.uint8)
+  ref[4096:2*4096] = 7
+  other = ref.copy()
+  other[5*4096+3] = 1
+  other[9*4096] = 1
+  zero, entropy = IR.blockStats(np, ref, 4096)
+  assert list(zero) == [True, False]+[True]*9
+  diff = IR.diffBlocks(np, ref, other, 4096)
+  assert IR.runs(np, diff).tolist() == [[5, 6], [9, 10]]
@@ -0,0 +1,67 @@
+'''md5Files (a thread pool of hashlib md5s) and the .md5Index.json index of img* dirs'''
+import os, json, hashlib
+import examImg
+from examImg import md5Files, indexedMd5s
+
+
+def makeFiles(dir, sizes):
+  fids = []
+  for ii, size in enumerate(sizes):
+    fid = os.path.join(dir, "f%d.bin" % ii)
+    with open(fid, 'wb') as ff:
+      ff.write(os.urandom(size))
+    fids.append(fid)
+  return fids
+
+
+def md5Of(fid):
+  with open(fid, 'rb') as ff:
+    return hashlib.md5(ff.read()).hexdigest()
+
+
+def test_md5Files():
+  fids = makeFiles(".", [0, 1, 1024*1024+3, 3*1024*1024, 100])
+  os.mkdir("adir")
+  os.symlink("nosuch", "dangling")
+  want = dict((fid, md5Of(fid)) for fid in fids)
+  assert md5Files(fids+["adir", "dangling", "missing"]) == want
+  assert md5Files(fids, threads=1) == want
+  assert md5Files(fids[::-1], threads=8) == want
+  assert want["./f0.bin"] == hashlib.md5(b"").hexdigest()
+  assert md5Files([]) == {} and md5Files(["adir"]) == {}
+
+
+def test_index_reuse_and_invalidation(monkeypatch):
+  os.mkdir("imgA")
+  fids = makeFiles("imgA", [100, 200, 300])
+  hashed = []
+  def counting(fids, threads=None):
+    hashed.extend(fids)
+    return md5Files(fids, threads)
+  monkeypatch.setattr(examImg, 'md5Files', counting)
+  want = dict((fid, md5Of(fid)) for fid in fids)
+
+  assert indexedMd5s("imgA", fids) == want and sorted(hashed) == sorted(fids)
+  index = json.load(open("imgA/.md5Index.json"))
+  st = os.stat(fids[0])
+  assert index["f0.bin"] == [100, st.st_mtime_ns, want[fids[0]]]
+  del hashed[:]
+  assert indexedMd5s("imgA", fids) == want and hashed == []  # (All from the index)
+
+  os.utime(fids[0], ns=(st.st_atime_ns, st.st_mtime_ns+1))  # (Only mtime_ns changed)
+  st1 = os.stat(fids[1])
+  with open(fids[1], 'ab') as ff:
+    ff.write(b"x")
+  os.utime(fids[1], ns=(st1.st_atime_ns, st1.st_mtime_ns))  # (Only the size changed)
+  want[fids[1]] = md5Of(fids[1])
+  assert indexedMd5s("imgA", fids) == want
+  assert sorted(hashed) == sorted(fids[:2])
+
+  os.remove(fids[2])
+  del hashed[:], want[fids[2]]
+  assert indexedMd5s("imgA", fids) == want and hashed == []
+  assert sorted(json.load(open("imgA/.md5Index.json"))) == ["f0.bin", "f1.bin"]
+
+  with open("imgA/.md5Index.json", 'w') as ff:
+    ff.write("{not json")
+  assert indexedMd5s("imgA", fids) == want and sorted(hashed) == sorted(fids[:2])
@@ -0,0 +1,90 @@
+'''objSched: plan order, skipping done objectives, probes, failures and host objectives'''
+import threading
+import pytest
+from ribou import bunch
+from objSched import objSched
+
+
+def graph(ran, done=(), fail=(), host=(), probed=None):
+  '''A: needs B and C, B: needs D, C: needs D.  Each func appends its name to ran.'''
+  def node(name, needs):
+    def func():
+      ran.append(name)
+      return name not in fail
+    def probe():
+      if probed is not None:
+        probed.append(name)
+      return name in done
+    return bunch(name=name, func=func, needs=needs, done=probe, host=name in host)
+  return {"A": node("A", ["B", "C"]), "B": node("B", ["D"]), "C": node("C", ["D"]),
+    "D": node("D", [])}
+
+
+def test_plan_order():
+  sched = objSched(graph([]), log=lambda msg: None)
+  pl = sched.plan("A")
+  assert (pl.order, pl.skipped) == (["D", "B", "C", "A"], [])
+  assert sched.plan("C").order == ["D", "C"]
+  nodes = graph([])
+  nodes["D"].needs = ["A"]
+  with pytest.raises(ValueError):
+    objSched(nodes, log=lambda msg: None).plan("A")
+
+
+def test_skip_done():
+  ran = []
+  sched = objSched(graph(ran, done=("B",)), log=lambda msg: None)
+  pl = sched.plan("A")
+  assert (pl.order, pl.skipped) == (["D", "C", "A"], ["B"])
+  ran2 = []
+  sched = objSched(graph(ran2, done=("B", "C")), log=lambda msg: None)
+  assert sched.run("A")
+  assert ran2 == ["A"]  # (D is only needed by done objectives, so it's skipped too)
+  ran3 = []
+  assert objSched(graph(ran3, done=("A",)), log=lambda msg: None).run("A")
+  assert ran3 == ["D", "B", "C", "A"]  # (The target itself is always done)
+
+
+def test_probe_memoized():
+  probed = []
+  sched = objSched(graph([], probed=probed), log=lambda msg: None)
+  sched.plan("A")
+  sched.plan("A")
+  assert sorted(probed) == ["B", "C", "D"]
+  def broken():
+    raise IOError("no device")
+  nodes = graph([])
+  nodes["B"].done = broken
+  logged = []
+  assert objSched(nodes, log=logged.append).plan("A").order == ["D", "B", "C", "A"]
+  assert any("B done probe failed" in ll for ll in logged)
+
+
+def test_stop_on_failure():
+  ran = []
+  sched = objSched(graph(ran, fail=("B",)), log=lambda msg: None)
+  assert not sched.run("A")
+  assert ran == ["D", "B"]
+  assert sched.results == {"D": True, "B": False}
+
+
+def test_host_pool():
+  ran = []
+  both = threading.Barrier(2, timeout=10)
+  nodes = graph(ran, host=("B", "C"))
+  for name in ("B", "C"):
+    func = nodes[name].func
+    def hostFunc(func=func):
+      threads.add(threading.current_thread().name)
+      both.wait()  # (B and C run at once, or this times out)
+      return func()
+    nodes[name].func = hostFunc
+  threads = set()
+  assert objSched(nodes, log=lambda msg: None).run("A")
+  assert ran[0] == "D" and sorted(ran[1:3]) == ["B", "C"] and ran[3] == "A"
+  assert threading.current_thread().name not in threads and len(threads) == 2
+
+  ran = []
+  nodes = graph(ran, fail=("B",), host=("B",))
+  assert not objSched(nodes, log=lambda msg: None).run("A")
+  assert "A" not in ran
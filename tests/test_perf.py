@@ -0,0 +1,40 @@
+'''perf: spans and metrics, without replacing anything in time or subprocess'''
+import time, subprocess
+import perf, ribou
+import reviveMC74 as R
+
+
+def test_instrument_leaves_stdlib_alone():
+  sleep, popen = time.sleep, subprocess.Popen
+  R.instrument()
+  assert time.sleep is sleep and subprocess.Popen is popen
+  assert getattr(ribou.execute, 'perfTimed', False)
+
+
+def test_metrics(monkeypatch):
+  monkeypatch.setattr(perf, 'spans', [])
+  monkeypatch.setattr(perf, 'counters', {})
+  monkeypatch.setattr(perf, 'dropped', 0)
+  with perf.span("backupPart", "objective"):
+    with perf.span("execute", "exec", cmd="adb -s X shell id"):
+      pass
+    perf.sleep(0.01)
+    perf.countSpawn(["/usr/bin/fastboot.exe", "devices"])
+    perf.count("pulled", 4096)
+  oo = perf.metrics()["objectives"]["backupPart"]
+  assert oo["spawns"] == {"adb": 1, "fastboot": 1}
+  assert oo["sleep"] >= 0.01 and oo["pulled"] == 4096
+
+
+def test_spans_capped(monkeypatch):
+  monkeypatch.setattr(perf, 'spans', [])
+  monkeypatch.setattr(perf, 'counters', {})
+  monkeypatch.setattr(perf, 'dropped', 0)
+  monkeypatch.setattr(perf, 'maxSpans', 10)
+  with perf.span("installApps", "objective"):
+    for ii in range(0, 50):
+      with perf.span("execute", "exec", cmd="adb shell ls"):
+        pass
+  assert len(perf.spans) == 10 and perf.dropped == 41
+  assert perf.metrics()["objectives"]["installApps"]["spawns"] == {"adb": 50}  # (All)
+  assert perf.writeTrace("trace.json") == 10
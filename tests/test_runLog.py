@@ -0,0 +1,34 @@
+'''runLog: each record names the objective its thread was doing'''
+import json, threading
+from ribou import bunch
+from runLog import runLog, objective
+from objSched import objSched
+
+
+def test_objective_per_thread():
+  lg = runLog("rl.log", "rl.jsonl")
+  lg.context.update(serial="MC74A")
+  started = threading.Barrier(2, timeout=10)
+  def work(name, host):
+    def func():
+      if host:
+        started.wait()  # (Both host objectives are running at once)
+      lg.record("cmd", cmd=name+" cmd")
+    return bunch(name=name, func=func, needs=[], done=None, host=host)
+  nodes = {"a": work("a", True), "b": work("b", True), "c": work("c", False)}
+  nodes["c"].needs = ["a", "b"]
+  with objective("top"):
+    assert objSched(nodes, log=lambda msg: None).run("c")
+    lg.record("end")
+  lg.close()
+  recs = [json.loads(line) for line in open("rl.jsonl")]
+  assert sorted((rr["cmd"], rr["objective"]) for rr in recs if rr["kind"]=="cmd") == [
+    ("a cmd", "a"), ("b cmd", "b"), ("c cmd", "c")]
+  assert recs[-1]["objective"] == "top" and recs[-1]["serial"] == "MC74A"
+
+
+def test_no_objective():
+  lg = runLog("rl.log", "rl.jsonl")
+  lg.record("start", target="x")
+  lg.close()
+  assert "objective" not in json.loads(open("rl.jsonl").read())
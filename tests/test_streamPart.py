@@ -0,0 +1,91 @@
+'''streamPartBackup and streamPartFlash on a device without md5sum: sizes are checked'''
+import os
+import examImg
+import reviveMC74 as R
+from examImg import streamPartBackup, streamPartFlash
+
+# The 'device' is this computer, with ./sys standing in for /sys/class/block, and a
+# TRUNCATE file making exec-out stop early (a stream cut off part way)
+deviceAdb = '''[ "$1" = "-s" ] && shift 2
+if [ "$1" = "exec-out" ]; then
+  if [ -f TRUNCATE ]; then sh -c "$2" | head -c 1000; else exec sh -c "$2"; fi; exit 0; fi
+if [ "$1" = "exec-in" ]; then
+  if [ -f TRUNCATE ]; then head -c 1000 | sh -c "$2"; else exec sh -c "$2"; fi; exit 0; fi
+if [ "$1" = "shell" ]; then shift
+  exec sh -c "$(printf '%s' "$*" | sed "s#/sys/class/block/#$PWD/sys/#g")"; fi
+echo "fake adb $*"
+'''
+
+
+def makePart(size):
+  '''A 'partition' mmcblk0p8 with its by-name/boot link and sysfs size, returns the link'''
+  with open("mmcblk0p8", 'wb') as ff:
+    ff.write(os.urandom(size))
+  os.makedirs("sys/mmcblk0p8")
+  with open("sys/mmcblk0p8/size", 'w') as ff:
+    ff.write(str(size//512)+"\n")
+  os.mkdir("by-name")
+  os.symlink(os.path.abspath("mmcblk0p8"), "by-name/boot")
+  return os.path.abspath("by-name/boot")
+
+
+def setup(fakeAdb, monkeypatch):
+  fakeAdb(deviceAdb)
+  monkeypatch.setitem(R.arg, 'adb', 'exec')
+  monkeypatch.setattr(examImg, 'remoteMd5', lambda fid, size=None: None)  # (No md5sum)
+
+
+def test_backup_size_checked(fakeAdb, monkeypatch):
+  setup(fakeAdb, monkeypatch)
+  partFid = makePart(512*64)
+  assert examImg.remotePartSize(partFid) == 512*64
+  assert streamPartBackup(partFid, "boot.img")
+  with open("boot.img", 'rb') as ff, open("mmcblk0p8", 'rb') as pp:
+    assert ff.read() == pp.read()
+
+
+def test_backup_truncated(fakeAdb, monkeypatch):
+  setup(fakeAdb, monkeypatch)
+  partFid = makePart(512*64)
+  open("TRUNCATE", 'w').close()
+  assert not streamPartBackup(partFid, "boot.img")
+  assert not os.path.exists("boot.img") and not os.path.exists("boot.img.part")
+
+
+def test_flash_size_checked(fakeAdb, monkeypatch):
+  setup(fakeAdb, monkeypatch)
+  partFid = makePart(512*64)
+  with open("new.img", 'wb') as ff:
+    ff.write(os.urandom(512*64))
+  assert streamPartFlash("new.img", [partFid])
+  with open("new.img", 'rb') as ff, open("mmcblk0p8", 'rb') as pp:
+    assert ff.read() == pp.read()
+
+
+def test_flash_truncated(fakeAdb, monkeypatch):
+  setup(fakeAdb, monkeypatch)
+  partFid = makePart(512*64)
+  with open("new.img", 'wb') as ff:
+    ff.write(os.urandom(512*64))
+  open("TRUNCATE", 'w').close()
+  assert not streamPartFlash("new.img", [partFid])
+
+
+def test_flash_tee_unchecked(fakeAdb, monkeypatch):
+  setup(fakeAdb, monkeypatch)
+  partFid = makePart(512*64)
+  with open("new.img", 'wb') as ff:
+    ff.write(os.urandom(512*64))
+  assert not streamPartFlash("new.img", [partFid, os.path.abspath("boot2")])
+
+
+def test_part_size_lookup(fakeAdb, monkeypatch):
+  setup(fakeAdb, monkeypatch)
+  partFid = makePart(512*64)
+  os.symlink("../mmcblk0p8", "by-name/rel")  # (A relative link)
+  assert examImg.remotePartSize(os.path.abspath("by-name/rel")) == 512*64
+  assert examImg.remotePartSize(os.path.abspath("mmcblk0p8")) == 512*64  # (Not a link)
+  os.symlink(os.path.abspath("mmcblk0p9"), "by-name/cache")
+  assert examImg.remotePartSize(os.path.abspath("by-name/cache")) is None  # (No sysfs)
+  os.remove("sys/mmcblk0p8/size")
+  assert examImg.remotePartSize(partFid) is None